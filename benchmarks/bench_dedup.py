@@ -0,0 +1,112 @@
+# Description: regression benchmark for the offline deduplication (Deduplication.CorpusDeduplicator). Synthetic
+#              corpora of growing size are scanned: a fraction of their transactions are variants (a few words changed)
+#              of a previous page, the others are new pages. The report shows the time per transaction, which must stay
+#              (roughly) constant while the corpus grows (the bands are looked up on an index), the peak memory of the
+#              process, and how many of the variants have been found (recall) and how many of the found duplicates are
+#              actually variants (precision).
+# Notes:
+#       Run it from the repository root:
+#           python benchmarks/bench_dedup.py [-sizes 2000 8000 32000] [-duplicates 0.5] [-workers 1] [-check]
+#       With -check the script exits with status 1 if the time per transaction of the largest corpus exceeds the
+#       one of the smallest by more than -tolerance times, or if the recall is below -min_recall.
+
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+# the modules of the interceptor live in src/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Deduplication import CorpusDeduplicator
+from RecordingFormat import RecordingFormat, RecordingWriter
+
+TRANSACTIONS_PER_SESSION = 100
+WORDS_PER_PAGE = 500
+
+
+# The words of page n (generated again every time: the corpus is never in memory).
+def page_words(n):
+    rng = random.Random(n)
+    return ["w%d" % rng.getrandbits(20) for _ in range(WORDS_PER_PAGE)]
+
+
+# Writes a corpus of transactions transactions in out_folder. Returns the set of (session id, key) of the variants.
+def synthetic_corpus(out_folder, transactions, duplicates, seed=1):
+    rng = random.Random(seed)
+    recording_format = RecordingFormat("compact")
+    pages = 0
+    variants = set()
+    sessions = (transactions + TRANSACTIONS_PER_SESSION - 1) // TRANSACTIONS_PER_SESSION
+    for s in range(sessions):
+        start_time = "2026-10-18_10:00:00.%06d" % s
+        folder = os.path.join(out_folder, "benchmark", start_time)
+        os.makedirs(folder)
+        with RecordingWriter(os.path.join(folder, recording_format.filename), recording_format) as writer:
+            writer.write_header({"window_height": "1080", "window_width": "1920"})
+            for key in range(1, min(TRANSACTIONS_PER_SESSION, transactions - s * TRANSACTIONS_PER_SESSION) + 1):
+                if pages and rng.random() < duplicates:
+                    n = rng.randrange(pages)
+                    words = page_words(n)
+                    for _ in range(3):
+                        words[rng.randrange(len(words))] = "changed%d" % rng.getrandbits(32)
+                    variants.add(("benchmark/" + start_time, str(key)))
+                else:
+                    n, words = pages, page_words(pages)
+                    pages += 1
+                writer.add(key, {"url": "http://benchmark/page%d.php" % n,
+                                 "request": {"method": "GET", "parameters": {}, "content": ""},
+                                 "response": {"status_code": 200, "content": "<html>" + " ".join(words) + "</html>"},
+                                 "actions": {}})
+    return variants
+
+
+def bench(transactions, duplicates, workers):
+    with tempfile.TemporaryDirectory() as out_folder:
+        variants = synthetic_corpus(out_folder, transactions, duplicates)
+        deduplicator = CorpusDeduplicator(out_folder, workers=workers)
+        start = time.perf_counter()
+        deduplicator.scan()
+        elapsed = time.perf_counter() - start
+        found = {(row["session_id"], row["transaction_id"]) for row in deduplicator.duplicates()}
+        deduplicator.close()
+    recall = len(found & variants) / len(variants) if variants else 1.0
+    precision = len(found & variants) / len(found) if found else 1.0
+    return elapsed, recall, precision
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-sizes", "--sizes", type=int, nargs="+", default=[2000, 8000, 32000],
+                            help="number of transactions of the synthetic corpora")
+    arg_parser.add_argument("-duplicates", "--duplicates", type=float, default=0.5,
+                            help="fraction of the transactions that are variants of a previous page")
+    arg_parser.add_argument("-workers", "--workers", type=int, default=1,
+                            help="number of processes fingerprinting the sessions")
+    arg_parser.add_argument("-check", "--check", action="store_true",
+                            help="exit with status 1 if the scan doesn't scale linearly or misses the variants")
+    arg_parser.add_argument("-tolerance", "--tolerance", type=float, default=2.0,
+                            help="maximum growth of the time per transaction accepted by -check")
+    arg_parser.add_argument("-min_recall", "--min_recall", type=float, default=0.95,
+                            help="minimum fraction of the variants that must be found with -check")
+    args = arg_parser.parse_args()
+
+    per_transaction = []
+    recalls = []
+    print("%12s %12s %16s %10s %10s %14s" % ("transactions", "scan (s)", "per trans. (us)", "recall", "precision",
+                                             "peak RSS (MB)"))
+    for size in args.sizes:
+        elapsed, recall, precision = bench(size, args.duplicates, args.workers)
+        per_transaction.append(elapsed / size)
+        recalls.append(recall)
+        print("%12d %12.3f %16.1f %10.3f %10.3f %14.1f" % (size, elapsed, elapsed / size * 1e6, recall, precision,
+                                                           resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    growth = per_transaction[-1] / per_transaction[0]
+    print("time per transaction growth (largest/smallest corpus): %.2fx" % growth)
+    if args.check and (growth > args.tolerance or min(recalls) < args.min_recall):
+        print("the deduplication doesn't scale linearly or misses the near-duplicates anymore!")
+        sys.exit(1)
@@ -0,0 +1,238 @@
+# Description: micro-benchmarks of the interceptor hooks. Synthetic flows, built with the test helpers of mitmproxy
+#              (mitmproxy.test.tflow), go through HTTPLogger.request and HTTPLogger.response: HTML pages of growing
+#              size, JSON, binary bodies and POST forms, with the recording on and off and with and without the
+#              injection of the javascript. For every scenario the latency of each hook is measured (median, p90,
+#              mean) together with the memory allocated (peak) and retained per flow; then Session.save_session is
+#              timed at different session sizes.
+#              The results are written as JSON (commit, versions and one entry per scenario), so the runs made on
+#              different commits can be compared with -compare.
+# Notes:
+#       Run it from the repository root (mitmproxy must be installed):
+#           python benchmarks/bench_hooks.py [-flows 300] [-save_sizes 100 1000 5000] [-output results.json]
+#           python benchmarks/bench_hooks.py -compare benchmarks/results/hooks-<old commit>.json
+#       By default the results are written in benchmarks/results/hooks-<commit>.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# the modules of the interceptor live in src/.
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from mitmproxy import version as mitmproxy_version
+from mitmproxy.test import tflow
+
+import Session as session_module
+from CapturePolicy import CapturePolicy
+from ClientRecording import CLIENT_COOKIE
+from HTTPLogger import HTTPLogger
+from HTTPTransaction import HTTPTransaction
+from Session import Session
+
+JS_FILE = os.path.join(ROOT, 'src', 'action_recording.js')
+EOS_FILE = os.path.join(ROOT, 'src', 'EOS.html')
+CLIENT_IP = "127.0.0.1"
+SERVICES = {CLIENT_IP: "bench-client"}
+
+
+def html_page(size):
+    paragraph = b"<p>Lorem ipsum dolor sit amet, <a href='/vulnerabilities/sqli/?id=1'>consectetur</a> elit.</p>\n"
+    body = paragraph * (size // len(paragraph) + 1)
+    return (b"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Benchmark page</title></head><body>" +
+            body[:size] + b"</body></html>")
+
+
+# name -> (method, path, request content type, request body, response content type, response body)
+PAYLOADS = {
+    "html_2k": ("GET", "/index.php", None, b"", "text/html; charset=utf-8", html_page(2 * 1024)),
+    "html_64k": ("GET", "/index.php", None, b"", "text/html; charset=utf-8", html_page(64 * 1024)),
+    "html_1m": ("GET", "/index.php", None, b"", "text/html; charset=utf-8", html_page(1024 * 1024)),
+    "json_32k": ("GET", "/api/items", None, b"", "application/json",
+                 json.dumps([{"id": n, "name": "item %d" % n, "tags": ["a", "b"]} for n in range(800)]).encode()),
+    "binary_256k": ("GET", "/static-img/logo.png", None, b"", "image/png", bytes(range(256)) * 1024),
+    "post_form": ("POST", "/vulnerabilities/sqli/", "application/x-www-form-urlencoded",
+                  b"id=1%27+OR+%271%27%3D%271&Submit=Submit", "text/html; charset=utf-8", html_page(4 * 1024)),
+}
+
+
+def make_flow(payload, cookie=None, query=""):
+    method, path, request_type, request_body, response_type, response_body = PAYLOADS[payload]
+    flow = tflow.tflow(resp=True)
+    flow.client_conn.ip_address = (CLIENT_IP, 50000)
+    flow.request.method = method
+    flow.request.url = "http://benchmark" + path + query
+    if request_type is not None:
+        flow.request.headers["content-type"] = request_type
+    flow.request.content = request_body
+    if cookie is not None:
+        flow.request.headers["cookie"] = cookie
+    flow.response.status_code = 200
+    flow.response.headers["content-type"] = response_type
+    flow.response.content = response_body
+    return flow
+
+
+# Returns an HTTPLogger and the cookie of its (only) client, with the recording on if recording is True.
+def make_logger(inject, recording, spill_folder):
+    logger = HTTPLogger(SERVICES, JS_FILE if inject else None, EOS_FILE,
+                        capture_policy=CapturePolicy(spill_folder=spill_folder))
+    flow = make_flow("html_2k", query="?record=true" if recording else "")
+    logger.request(flow)
+    logger.response(flow)
+    cookie = flow.response.headers["set-cookie"].split(";")[0]
+    assert cookie.startswith(CLIENT_COOKIE)
+    return logger, cookie
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {"median_us": statistics.median(samples) * 1e6, "p90_us": samples[int(len(samples) * 0.9)] * 1e6,
+            "mean_us": statistics.mean(samples) * 1e6}
+
+
+def bench_hooks(payload, recording, inject, flows_count):
+    spill_folder = tempfile.mkdtemp(prefix="bench-spill-")
+    try:
+        # flows are built in advance: their construction is not measured.
+        logger, cookie = make_logger(inject, recording, spill_folder)
+        flows = [make_flow(payload, cookie) for _ in range(flows_count)]
+        request_times, response_times = [], []
+        for flow in flows:
+            started = time.perf_counter()
+            logger.request(flow)
+            middle = time.perf_counter()
+            logger.response(flow)
+            request_times.append(middle - started)
+            response_times.append(time.perf_counter() - middle)
+        logger.done()
+
+        # memory, measured on a new logger (tracemalloc slows the hooks down).
+        logger, cookie = make_logger(inject, recording, spill_folder)
+        memory_flows = [make_flow(payload, cookie) for _ in range(min(flows_count, 50))]
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        for flow in memory_flows:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            logger.request(flow)
+            logger.response(flow)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        logger.done()
+    finally:
+        shutil.rmtree(spill_folder, ignore_errors=True)
+
+    return {"request": _summary(request_times), "response": _summary(response_times),
+            "peak_bytes_per_flow": peak, "retained_bytes_per_flow": retained // len(memory_flows)}
+
+
+def bench_save(size, actions_per_transaction=5):
+    session = Session("http://benchmark/index.php", "Benchmark task", datetime.now())
+    for n in range(size):
+        session.add_transaction(HTTPTransaction(make_flow("html_2k" if n % 4 else "post_form"), SERVICES[CLIENT_IP]))
+    # every transaction begins with a navigateTo, followed by its actions.
+    actions = {"window_height": "900", "window_width": "1600"}
+    key = 0
+    for n in range(size):
+        for m in range(actions_per_transaction + 1):
+            key += 1
+            action = {"type": "navigateTo", "url": "http://benchmark/"} if m == 0 else \
+                {"type": "click", "x": 10, "y": 20}
+            actions[str(key)] = {"time": key * 10, "action": action}
+    session.end_user_actions = json.dumps(actions)
+    started = time.perf_counter()
+    session.save_session()
+    elapsed = time.perf_counter() - started
+    return {"transactions": size, "seconds": elapsed, "us_per_transaction": elapsed / size * 1e6}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Prints the ratio between the results and the ones of a previous run (> 1: slower / bigger than before).
+def compare(results, previous):
+    old = {(entry["payload"], entry["recording"], entry["inject"]): entry for entry in previous["hooks"]}
+    print("\nComparison with %s (new / old):" % previous["commit"])
+    for entry in results["hooks"]:
+        before = old.get((entry["payload"], entry["recording"], entry["inject"]))
+        if before is None:
+            continue
+        print("  %-12s recording=%-5s inject=%-5s request %.2fx  response %.2fx  peak memory %.2fx" % (
+            entry["payload"], entry["recording"], entry["inject"],
+            entry["request"]["median_us"] / before["request"]["median_us"],
+            entry["response"]["median_us"] / before["response"]["median_us"],
+            entry["peak_bytes_per_flow"] / max(before["peak_bytes_per_flow"], 1)))
+    old_saves = {entry["transactions"]: entry for entry in previous.get("save_session", [])}
+    for entry in results["save_session"]:
+        if entry["transactions"] in old_saves:
+            print("  save_session %6d transactions: %.2fx" % (
+                entry["transactions"], entry["seconds"] / old_saves[entry["transactions"]]["seconds"]))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-flows", "--flows", type=int, default=300, help="flows per scenario.")
+    arg_parser.add_argument("-payloads", "--payloads", nargs="+", default=list(PAYLOADS), choices=list(PAYLOADS))
+    arg_parser.add_argument("-save_sizes", "--save_sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    arg_parser.add_argument("-output", "--output", default=None, help="file where the results are written.")
+    arg_parser.add_argument("-compare", "--compare", default=None, help="results of a previous run to compare.")
+    args = arg_parser.parse_args()
+
+    out_folder = tempfile.mkdtemp(prefix="bench-out-")
+    session_module.OUT_FOLDER = out_folder + "/"
+    commit = git_commit()
+    results = {"commit": commit, "date": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "mitmproxy": mitmproxy_version.VERSION,
+               "flows": args.flows, "hooks": [], "save_session": []}
+    try:
+        for payload in args.payloads:
+            for recording in (False, True):
+                for inject in (False, True):
+                    # the hooks print on every injection: the output is discarded.
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        entry = bench_hooks(payload, recording, inject, args.flows)
+                    entry.update({"payload": payload, "recording": recording, "inject": inject})
+                    results["hooks"].append(entry)
+                    print("%-12s recording=%-5s inject=%-5s request %8.1f us  response %8.1f us  peak %9d B"
+                          % (payload, recording, inject, entry["request"]["median_us"],
+                             entry["response"]["median_us"], entry["peak_bytes_per_flow"]))
+        for size in args.save_sizes:
+            entry = bench_save(size)
+            results["save_session"].append(entry)
+            print("save_session %6d transactions: %8.3f s (%.1f us per transaction)"
+                  % (size, entry["seconds"], entry["us_per_transaction"]))
+    finally:
+        shutil.rmtree(out_folder, ignore_errors=True)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "hooks-%s.json" % commit)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as stream:
+        json.dump(results, stream, indent=2)
+    print("Results written in " + output)
+
+    if args.compare is not None:
+        with open(args.compare) as stream:
+            compare(results, json.load(stream))
+
+
+if __name__ == "__main__":
+    main()
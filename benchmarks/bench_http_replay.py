@@ -0,0 +1,107 @@
+# Description: benchmark of HTTPReplayer against a local stub server. Synthetic recordings (GET and POST requests)
+#              are written in a temporary output folder and replayed towards the stub, that answers every request
+#              and sets a session cookie on the first request of each session: the replay must send it back in
+#              the following ones (one cookie jar per session). Latency and throughput are reported.
+# Notes:
+#       Run it from the repository root (aiohttp is needed):
+#           python benchmarks/bench_http_replay.py [-sessions 20] [-transactions 50] [-concurrency 16] [-check]
+#       With -check the script exits with status 1 if a request fails, if a status code differs from the recorded
+#       one or if a session cookie is not sent back.
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the modules of the interceptor live in src/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from HTTPReplayer import HTTPReplayer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    session_ids = itertools.count(1)
+    # requests that should have carried the session cookie but didn't.
+    missing_cookies = 0
+    lock = threading.Lock()
+
+    def __answer(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        body = b"<html><head><title>stub</title></head><body>" + b"x" * 512 + b"</body></html>"
+        self.send_response(200)
+        first = self.path.endswith("n=1")
+        if first:
+            self.send_header("Set-Cookie", "PHPSESSID=%d; Path=/" % next(self.session_ids))
+        elif "PHPSESSID=" not in self.headers.get("Cookie", ""):
+            with self.lock:
+                StubHandler.missing_cookies += 1
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = __answer
+    do_POST = __answer
+
+    def log_message(self, *args):
+        pass
+
+
+# Writes a recording of transactions_count transactions in out_folder and returns its path.
+def write_recording(out_folder, session_n, transactions_count):
+    folder = os.path.join(out_folder, "bench_task", "2021-01-01_00:00:%06d" % session_n)
+    os.makedirs(folder)
+    transactions = {}
+    for n in range(1, transactions_count + 1):
+        post = n % 5 == 0
+        transactions[str(n)] = {
+            "url": "http://172.18.0.2/vulnerabilities/sqli/?n=%d" % n,
+            "request": {"method": "POST" if post else "GET",
+                        "client": {"ip address": "172.18.0.1", "port": "50000", "name": "pentester"},
+                        "headers": {"Host": "172.18.0.2", "Cookie": "PHPSESSID=recorded",
+                                    "Content-Type": "application/x-www-form-urlencoded" if post else "text/html"},
+                        "content": "id=1&Submit=Submit" if post else "", "parameters": {}},
+            "response": {"status_code": 200, "headers": {"Content-Type": "text/html"}, "content": "<html></html>"},
+            "actions": {}}
+    recording = os.path.join(folder, "session_recording.json")
+    with open(recording, "w") as stream:
+        json.dump({"window_height": "900", "window_width": "1600", "transactions": transactions}, stream, indent=2)
+    return recording
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-sessions", "--sessions", type=int, default=20)
+    arg_parser.add_argument("-transactions", "--transactions", type=int, default=50)
+    arg_parser.add_argument("-concurrency", "--concurrency", type=int, default=16)
+    arg_parser.add_argument("-check", "--check", action="store_true")
+    args = arg_parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    target = "http://127.0.0.1:%d" % server.server_address[1]
+
+    with tempfile.TemporaryDirectory() as out_folder:
+        recordings = [write_recording(out_folder, n, args.transactions) for n in range(args.sessions)]
+        report, outcomes = HTTPReplayer(recordings, target, args.concurrency).run()
+    server.shutdown()
+
+    report["missing_cookies"] = StubHandler.missing_cookies
+    print(json.dumps(report, indent=2))
+    if args.check and (report["errors"] or report["status_mismatches"] or report["missing_cookies"]
+                       or report["requests"] != args.sessions * args.transactions):
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
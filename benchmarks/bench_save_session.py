@@ -0,0 +1,114 @@
+# Description: regression benchmark for Session.save_session. Synthetic sessions of growing size (transactions and
+#              recorded actions grow together) are saved and the time spent for each transaction is reported: since
+#              the alignment of the user actions to the transactions is linear, the time per transaction must stay
+#              (roughly) constant while the session grows.
+# Notes:
+#       Run it from the repository root:
+#           python benchmarks/bench_save_session.py [-sizes 1000 2000 4000 8000] [-actions 10] [-check]
+#                                                   [-format json|compact|msgpack] [-compression gzip|zstd]
+#       With -check the script exits with status 1 if the time per transaction of the largest session exceeds
+#       the one of the smallest by more than -tolerance times (i.e. saving is not linear anymore).
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# the modules of the interceptor live in src/.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import Session as session_module
+from Session import Session
+from RecordingFormat import RecordingFormat, ENCODINGS, COMPRESSIONS
+
+
+# A stand-in for HTTPTransaction: save_session only needs get_dict(), ready() and release().
+class SyntheticTransaction(object):
+
+    def __init__(self, n):
+        self.n = n
+
+    def get_dict(self):
+        return {"url": "http://benchmark/vulnerabilities/sqli/?id=" + str(self.n),
+                "request": {"client": {"ip address": "172.18.0.1", "port": "50000", "name": "pentester"},
+                            "headers": {"Host": "benchmark", "Accept": "text/html"}, "content": "",
+                            "parameters": {"id": str(self.n)}},
+                "response": {"headers": {"Content-Type": "text/html"}, "content": "<html>" + "x" * 256 + "</html>"}}
+
+    # the synthetic bodies are never streamed: the transaction can always be written.
+    def ready(self):
+        return True
+
+    def release(self):
+        pass
+
+
+# Builds the JSON sent by the browser at the end of the session: a navigateTo followed by actions_per_transaction
+# clicks and keystrokes for every transaction.
+def synthetic_actions(transactions, actions_per_transaction):
+    actions = {"window_height": "1080", "window_width": "1920", "task_name": "benchmark"}
+    key = 0
+    for t in range(transactions):
+        key += 1
+        actions[str(key)] = {"time": key, "action": {"type": "navigateTo", "url": "http://benchmark/" + str(t)}}
+        for a in range(actions_per_transaction):
+            key += 1
+            if a % 2 == 0:
+                actions[str(key)] = {"time": key, "action": {"type": "click", "x": 10, "y": 20}}
+            else:
+                actions[str(key)] = {"time": key, "action": {"type": "keypress", "key": "a"}}
+    return json.dumps(actions)
+
+
+def bench(transactions, actions_per_transaction, streaming, recording_format=None):
+    session = Session(task_name="benchmark", start_time=datetime.now(), http_transactions=[], streaming=streaming,
+                      recording_format=recording_format)
+    for n in range(transactions):
+        session.add_transaction(SyntheticTransaction(n))
+    session.end_user_actions = synthetic_actions(transactions, actions_per_transaction)
+
+    start = time.perf_counter()
+    session.save_session()
+    elapsed = time.perf_counter() - start
+    recording = session.get_out_folder() / session.recording_format.filename
+    return elapsed, os.path.getsize(recording)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-sizes", "--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000],
+                            help="number of transactions of the synthetic sessions")
+    arg_parser.add_argument("-actions", "--actions", type=int, default=10,
+                            help="number of recorded actions for each transaction")
+    arg_parser.add_argument("-streaming", "--streaming", action="store_true",
+                            help="record the synthetic sessions in streaming capture mode")
+    arg_parser.add_argument("-format", "--format", choices=ENCODINGS, default="json",
+                            help="output format of the recordings")
+    arg_parser.add_argument("-compression", "--compression", choices=COMPRESSIONS, default=None,
+                            help="compression of the recordings")
+    arg_parser.add_argument("-check", "--check", action="store_true",
+                            help="exit with status 1 if saving doesn't scale linearly")
+    arg_parser.add_argument("-tolerance", "--tolerance", type=float, default=2.0,
+                            help="maximum growth of the time per transaction accepted by -check")
+    args = arg_parser.parse_args()
+
+    per_transaction = []
+    with tempfile.TemporaryDirectory() as out_folder:
+        session_module.OUT_FOLDER = out_folder + "/"
+        recording_format = RecordingFormat(args.format, args.compression)
+        print("format: %r" % recording_format)
+        print("%12s %12s %12s %16s %14s" % ("transactions", "actions", "save (s)", "per trans. (us)", "size (bytes)"))
+        for size in args.sizes:
+            elapsed, recording_size = bench(size, args.actions, args.streaming, recording_format)
+            per_transaction.append(elapsed / size)
+            print("%12d %12d %12.3f %16.1f %14d" % (size, size * (args.actions + 1), elapsed, elapsed / size * 1e6,
+                                                   recording_size))
+
+    growth = per_transaction[-1] / per_transaction[0]
+    print("time per transaction growth (largest/smallest session): %.2fx" % growth)
+    if args.check and growth > args.tolerance:
+        print("save_session doesn't scale linearly anymore!")
+        sys.exit(1)
@@ -0,0 +1,123 @@
+# Description: BlobStore is a content-addressed store for the bodies of the recorded requests and responses. Every
+#              body is identified by the SHA-256 digest of its bytes, compressed and written only once under
+#              out/blobs/, no matter how many transactions (of how many sessions) contain it: the transaction record
+#              keeps only a reference to it (see HTTPTransaction.get_dict).
+# Notes:
+#           - A reference has the form {"blob": "sha256:<hex digest>", "length": <bytes>}. The bytes of a recorded
+#             body, referenced or inline, are read back by CapturePolicy.body_bytes.
+#           - Blobs are compressed with zstandard (a dependency of mitmproxy) if it is available, otherwise with
+#             gzip. The codec is recorded in the extension of the file, so a store can contain both.
+#           - Files are written to a temporary name and then renamed: a reader never sees a partial blob.
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Name of the folder (in the output folder) that contains the blobs.
+BLOB_FOLDER = "blobs"
+DIGEST_PREFIX = "sha256:"
+CODECS = {"zstd": ".zst", "gzip": ".gz"}
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "gzip"
+
+
+class BlobStore(object):
+
+    def __init__(self, root, codec=None, level=3):
+        self.root = str(root)
+        self.codec = codec if codec is not None else default_codec()
+        if self.codec not in CODECS:
+            raise ValueError("Unknown blob codec: " + str(self.codec))
+        if self.codec == "zstd" and zstandard is None:
+            raise ValueError("zstd blobs require the zstandard package (pip install zstandard)")
+        self.level = level
+        # digests already known to be in the store: they don't need to be checked on the disk again.
+        self._known = set()
+        self._lock = threading.Lock()
+        # counters, useful to know how much the store is saving.
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_in = 0
+        self.bytes_written = 0
+
+    # blobs are spread over two levels of subfolders to keep the folders small: blobs/ab/cd/abcd....zst
+    def _path(self, hex_digest, codec):
+        return os.path.join(self.root, hex_digest[:2], hex_digest[2:4], hex_digest + CODECS[codec])
+
+    def _find(self, hex_digest):
+        for codec in CODECS:
+            path = self._path(hex_digest, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None, None
+
+    def _compress(self, data):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return gzip.compress(data, compresslevel=self.level)
+
+    @staticmethod
+    def _decompress(data, codec):
+        if codec == "zstd":
+            if zstandard is None:
+                raise ValueError("zstd blobs require the zstandard package (pip install zstandard)")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return gzip.decompress(data)
+
+    # Stores data (bytes) if it is not already in the store. Returns its digest.
+    def put(self, data):
+        hex_digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.bytes_in += len(data)
+            if hex_digest in self._known:
+                self.deduplicated += 1
+                return DIGEST_PREFIX + hex_digest
+
+        if self._find(hex_digest)[0] is None:
+            path = self._path(hex_digest, self.codec)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = self._compress(data)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as stream:
+                stream.write(compressed)
+            os.replace(temp_path, path)
+            with self._lock:
+                self.stored += 1
+                self.bytes_written += len(compressed)
+        else:
+            with self._lock:
+                self.deduplicated += 1
+
+        with self._lock:
+            self._known.add(hex_digest)
+        return DIGEST_PREFIX + hex_digest
+
+    # Stores data and returns the reference to put in the transaction record in place of the body.
+    def reference(self, data):
+        return {"blob": self.put(data), "length": len(data)}
+
+    def exists(self, digest):
+        return self._find(digest[len(DIGEST_PREFIX):] if digest.startswith(DIGEST_PREFIX) else digest)[0] is not None
+
+    # Returns the bytes identified by digest. Raises KeyError if the store doesn't contain it.
+    def get(self, digest):
+        hex_digest = digest[len(DIGEST_PREFIX):] if digest.startswith(DIGEST_PREFIX) else digest
+        path, codec = self._find(hex_digest)
+        if path is None:
+            raise KeyError(digest)
+        with open(path, "rb") as stream:
+            return self._decompress(stream.read(), codec)
+
+
+# Returns the store of the output folder out_folder (e.g. "../out/").
+def open_store(out_folder, codec=None):
+    return BlobStore(os.path.join(str(out_folder), BLOB_FOLDER), codec)
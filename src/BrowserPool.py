@@ -0,0 +1,128 @@
+# Description: BrowserPool keeps Chrome instances (webdrivers) running between the replays, so that a batch of short
+#              recordings doesn't pay the start and the shutdown of Chrome for every recording. Before a driver is
+#              lent again its state is reset: extra windows are closed, the page is left, the cookies, the cache and
+#              the storage (local storage, indexedDB, service workers, ...) of the visited origins are cleared. The
+#              window is resized as in the recording by Player.
+#              A driver is quit and replaced after max_uses replays, when its reset fails or when it crashed.
+# Notes:
+#           - Every driver has its own free debugging port and its own temporary profile, removed when it is quit.
+#           - ReplayFarm gives a pool (of one driver) to every worker process.
+
+import shutil
+import tempfile
+import threading
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+# the options of the Chrome instances are the same of the ones started by Player.
+from Player import chrome_options
+from ReplayFarm import free_port
+
+# Window size of a new Chrome instance, Player resizes it as in the recording.
+DEFAULT_WINDOW_SIZE = (1280, 800)
+
+
+# A running Chrome instance of the pool.
+class PooledBrowser(object):
+
+    def __init__(self, headless):
+        self.profile_dir = tempfile.mkdtemp(prefix="wapt-chrome-")
+        self.debugging_port = free_port()
+        try:
+            self.driver = webdriver.Chrome(options=chrome_options(DEFAULT_WINDOW_SIZE[0], DEFAULT_WINDOW_SIZE[1],
+                                                                  self.debugging_port, self.profile_dir, headless))
+        except Exception:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            raise
+        self.uses = 0
+
+    def alive(self):
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    # Clears the state left by a replay. origins are the origins visited during the replay.
+    def reset(self, origins=()):
+        driver = self.driver
+        for handle in driver.window_handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(driver.window_handles[0])
+        driver.get("about:blank")
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        for origin in origins:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class BrowserPool(object):
+
+    def __init__(self, max_uses=50, headless=True):
+        self.max_uses = max_uses
+        self.headless = headless
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # counters: Chrome instances started, replays that used a warm instance, instances quit before closing.
+        self.launched = 0
+        self.reused = 0
+        self.recycled = 0
+
+    # Returns a browser ready for a replay: a warm one if available, otherwise a new one.
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("The browser pool has been closed")
+                browser = self._idle.pop() if self._idle else None
+            if browser is None:
+                break
+            if browser.alive():
+                with self._lock:
+                    self.reused += 1
+                browser.uses += 1
+                return browser
+            # Chrome crashed while it was idle.
+            self.__recycle(browser)
+
+        browser = PooledBrowser(self.headless)
+        with self._lock:
+            self.launched += 1
+        browser.uses += 1
+        return browser
+
+    # Gives browser back to the pool. broken is True if the replay failed because of the browser (it is replaced).
+    def release(self, browser, origins=(), broken=False):
+        if broken or browser.uses >= self.max_uses or self._closed:
+            self.__recycle(browser)
+            return
+        try:
+            browser.reset(origins)
+        except WebDriverException:
+            self.__recycle(browser)
+            return
+        with self._lock:
+            self._idle.append(browser)
+
+    def __recycle(self, browser):
+        browser.quit()
+        with self._lock:
+            self.recycled += 1
+
+    # Quits every idle browser. Browsers still lent are quit when they are released.
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for browser in idle:
+            browser.quit()
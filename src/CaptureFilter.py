@@ -0,0 +1,155 @@
+# Description: CaptureFilter decides which flows are recorded, by means of a list of declarative rules loaded from a
+#              JSON file (see DEFAULT_RULES and load_rules). Every rule has an action ("capture" or "exclude") and
+#              some conditions; the first rule whose conditions are all satisfied decides, if no rule matches the
+#              default action is applied. The conditions are:
+#              - "host":         glob (or list of globs) matched against the host of the request;
+#              - "path":         glob (or list of globs) matched against the path of the request;
+#              - "url_regex":    regular expression searched in the whole url;
+#              - "method":       method (or list of methods) of the request;
+#              - "content_type": prefix (or list of prefixes) of the content type of the response;
+#              - "status":       status code (or list of codes, or ranges as "200-299") of the response;
+#              - "min_size" and "max_size": bounds (bytes) of the response body.
+#              The rules are compiled once: at runtime a rule is a tuple of predicates.
+# Notes:
+#           A flow is evaluated as soon as possible: in the request hook only the conditions on the request can be
+#           checked, so if every rule that can still match is excluded (or a rule on the request alone matches) the
+#           decision is already taken and the flow never gets to the response stage as a candidate for the
+#           recording; otherwise it is decided in the responseheaders hook (before the body is received) or, when
+#           the size of the body is not declared by the server, in the response hook.
+
+import fnmatch
+import json
+import re
+from urllib.parse import urlsplit
+
+CAPTURE = "capture"
+EXCLUDE = "exclude"
+
+# Stages of a flow, in order: the information available grows from one to the next.
+REQUEST, RESPONSE_HEADERS, RESPONSE = 0, 1, 2
+
+# The rules that reproduce the historical behaviour of the interceptor: only the successful responses (200) are
+# recorded, and never the static resources.
+DEFAULT_RULES = {
+    "default": EXCLUDE,
+    "rules": [
+        {"action": EXCLUDE, "url_regex": "/static/"},
+        {"action": CAPTURE, "status": 200},
+    ]
+}
+
+_CONDITIONS = ("host", "path", "url_regex", "method", "content_type", "status", "min_size", "max_size")
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _globs(values):
+    pattern = re.compile("|".join("(?:%s)" % fnmatch.translate(value) for value in _as_list(values)), re.IGNORECASE)
+    return pattern.match
+
+
+def _statuses(values):
+    codes, ranges = set(), []
+    for value in _as_list(values):
+        if isinstance(value, str) and "-" in value:
+            low, high = value.split("-", 1)
+            ranges.append((int(low), int(high)))
+        else:
+            codes.add(int(value))
+    return lambda status: status in codes or any(low <= status <= high for low, high in ranges)
+
+
+def _content_length(flow, stage):
+    if stage == RESPONSE:
+        return len(flow.response.raw_content or b"")
+    length = flow.response.headers.get("content-length")
+    try:
+        return int(length) if length is not None else None
+    except ValueError:
+        return None
+
+
+# A compiled rule: (action, [(stage, predicate(flow, stage))]).
+def compile_rule(rule):
+    unknown = set(rule) - set(_CONDITIONS) - {"action"}
+    if unknown:
+        raise ValueError("Unknown condition(s) in capture rule: " + ", ".join(sorted(unknown)))
+    action = rule.get("action", CAPTURE)
+    if action not in (CAPTURE, EXCLUDE):
+        raise ValueError("Unknown action in capture rule: " + str(action))
+
+    predicates = []
+    if "host" in rule:
+        match_host = _globs(rule["host"])
+        predicates.append((REQUEST, lambda flow, stage: match_host(flow.request.pretty_host or "") is not None))
+    if "path" in rule:
+        match_path = _globs(rule["path"])
+        predicates.append((REQUEST, lambda flow, stage:
+                           match_path(urlsplit(flow.request.path).path) is not None))
+    if "url_regex" in rule:
+        search_url = re.compile(rule["url_regex"]).search
+        predicates.append((REQUEST, lambda flow, stage: search_url(flow.request.pretty_url) is not None))
+    if "method" in rule:
+        methods = {method.upper() for method in _as_list(rule["method"])}
+        predicates.append((REQUEST, lambda flow, stage: flow.request.method.upper() in methods))
+    if "status" in rule:
+        match_status = _statuses(rule["status"])
+        predicates.append((RESPONSE_HEADERS, lambda flow, stage: match_status(flow.response.status_code)))
+    if "content_type" in rule:
+        prefixes = tuple(prefix.lower() for prefix in _as_list(rule["content_type"]))
+        predicates.append((RESPONSE_HEADERS, lambda flow, stage:
+                           flow.response.headers.get("content-type", "").lower().startswith(prefixes)))
+    for condition, compare in (("min_size", lambda size, bound: size >= bound),
+                               ("max_size", lambda size, bound: size <= bound)):
+        if condition in rule:
+            bound = int(rule[condition])
+            # the size is known in the responseheaders hook only if the server declared it (content-length).
+            predicates.append((RESPONSE_HEADERS, lambda flow, stage, bound=bound, compare=compare:
+                               None if _content_length(flow, stage) is None
+                               else compare(_content_length(flow, stage), bound)))
+    return action == CAPTURE, predicates
+
+
+class CaptureFilter(object):
+
+    def __init__(self, rules=None):
+        rules = rules if rules is not None else DEFAULT_RULES
+        default = rules.get("default", CAPTURE)
+        if default not in (CAPTURE, EXCLUDE):
+            raise ValueError("Unknown default action of the capture rules: " + str(default))
+        self.default = default == CAPTURE
+        self.rules = [compile_rule(rule) for rule in rules.get("rules", [])]
+
+    # Returns True (capture), False (exclude) or None if the flow can't be decided yet at stage.
+    def decide(self, flow, stage):
+        for capture, predicates in self.rules:
+            undecided = False
+            for predicate_stage, predicate in predicates:
+                if predicate_stage > stage:
+                    undecided = True
+                    continue
+                result = predicate(flow, stage)
+                if result is None:
+                    # the data needed by the condition is not available yet (e.g. no content-length).
+                    undecided = True
+                elif not result:
+                    break
+            else:
+                if not undecided:
+                    return capture
+                # this rule could still match: the later rules can't decide before it.
+                if stage < RESPONSE:
+                    return None
+        return self.default
+
+
+# Returns the rules contained in the JSON file path (checking that they compile).
+def load_rules(path):
+    with open(path) as stream:
+        rules = json.load(stream)
+    if isinstance(rules, list):
+        rules = {"rules": rules}
+    CaptureFilter(rules)
+    return rules
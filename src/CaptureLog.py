@@ -0,0 +1,94 @@
+# Description: CaptureLog is an append-only, on-disk log of the http transactions recorded during a session. Each
+#              transaction is written as one JSON line as soon as it is captured, so the memory used by a session
+#              doesn't grow with its length and what has been recorded survives a crash of the interceptor.
+# Notes:
+#           The log is split into segments (transactions-000001.jsonl, transactions-000002.jsonl, ...): a new
+#           segment is started when the current one exceeds segment_size bytes. Segments are plain JSON Lines files,
+#           so they can be read even by other tools (e.g. to recover a session that has never been finalized).
+
+import json
+import os
+
+# Used to remove the log folder once the session has been finalized.
+import shutil
+
+SEGMENT_PREFIX = 'transactions-'
+SEGMENT_SUFFIX = '.jsonl'
+# Default maximum size of a segment (bytes).
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+class CaptureLog(object):
+
+    def __init__(self, folder, segment_size=SEGMENT_SIZE):
+        self.folder = str(folder)
+        self.segment_size = segment_size
+        # number of records appended (or found, if the log already existed) so far.
+        self.count = 0
+        self._segment_n = 0
+        self._segment = None
+        self._segment_bytes = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+        # An already existing log (e.g. left by a crashed interceptor) is continued, never overwritten.
+        for segment in self.segments():
+            self._segment_n += 1
+            with open(segment, 'rb') as stream:
+                self.count += sum(1 for _ in stream)
+
+    # Returns the paths of the segments, in the same order they have been written.
+    def segments(self):
+        if not os.path.isdir(self.folder):
+            return []
+        names = sorted(name for name in os.listdir(self.folder)
+                       if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.folder, name) for name in names]
+
+    def _next_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._segment_n += 1
+        path = os.path.join(self.folder, SEGMENT_PREFIX + '%06d' % self._segment_n + SEGMENT_SUFFIX)
+        self._segment = open(path, 'ab')
+        self._segment_bytes = self._segment.tell()
+
+    # Appends record (a JSON serializable dictionary) to the log. Returns the 1-based index of the record.
+    def append(self, record):
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        if self._segment is None or self._segment_bytes + len(line) > self.segment_size:
+            self._next_segment()
+        self._segment.write(line)
+        # the record is handed to the OS immediately: a crash of the interceptor won't lose it.
+        self._segment.flush()
+        self._segment_bytes += len(line)
+        self.count += 1
+        return self.count
+
+    # Yields the records in the order they have been appended, reading one line at a time.
+    def __iter__(self):
+        if self._segment is not None:
+            self._segment.flush()
+        for segment in self.segments():
+            with open(segment, 'rb') as stream:
+                for line in stream:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # empty line, or the last line of a segment torn by a crash of the interceptor.
+                        continue
+                    yield record
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    # Deletes the log from the disk. (employed when the session has been finalized)
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.count = 0
+        self._segment_n = 0
@@ -0,0 +1,303 @@
+# Description: CapturePolicy decides how the body of a request or a response is recorded in the dataset. Text bodies
+#              are recorded as strings, as they have always been, while:
+#              - binary bodies (images, PDFs, archives, ...) are recorded as base64 instead of being forced to UTF-8;
+#              - bodies larger than the maximum size for their content type keep only their head and their tail,
+#                together with their original length;
+#              - bodies larger than spill_threshold are moved to a temporary file until the session is saved, so
+#                they don't live in the memory of the interceptor while the session is being recorded;
+#              - the responses streamed by the proxy (see HTTPLogger.responseheaders) are never held in memory at
+#                all: a StreamTee writes their chunks to a temporary file while they are forwarded to the client.
+# Notes:
+#           The representations of a recorded body are:
+#           - "text": the whole body, decoded;
+#           - {"encoding": "base64", "data": "...", "length": n}: the whole binary body;
+#           - {"encoding": "utf-8" | "base64", "head": "...", "tail": "...", "length": n, "truncated": true};
+#           - {"blob": "sha256:...", "length": n, ...}: a reference to the BlobStore (see BlobStore.py), that can
+#             be truncated as well ("truncated": true, "head_length": h and "length" is the original length).
+#           body_bytes() returns the bytes of any of them.
+
+import base64
+import collections
+import os
+import tempfile
+import threading
+
+# Used to decode the streamed bodies, that are written to the disk as they were sent (e.g. gzip compressed). The
+# tools that only read the dataset (e.g. HTTPReplayer) don't need mitmproxy.
+try:
+    from mitmproxy.net.http import encoding
+except ImportError:
+    encoding = None
+
+# The body is decoded with the charset declared in the content-type header.
+from Injector import charset_of
+
+# Content types recorded as text (everything else is considered binary).
+TEXT_CONTENT_TYPES = ("text/", "application/json", "application/javascript", "application/x-javascript",
+                      "application/xml", "application/xhtml+xml", "application/x-www-form-urlencoded",
+                      "application/graphql", "image/svg+xml")
+# Maximum number of recorded bytes by content type (the longest matching prefix wins, "" matches everything).
+MAX_SIZES = {"": 1024 * 1024, "text/": 8 * 1024 * 1024, "application/json": 8 * 1024 * 1024,
+             "image/": 256 * 1024, "video/": 64 * 1024, "audio/": 64 * 1024}
+# Bodies larger than this (bytes) are kept in a temporary file until the session is saved.
+SPILL_THRESHOLD = 256 * 1024
+# Recorded responses declaring a larger body (bytes) are streamed through a StreamTee instead of being buffered.
+STREAM_THRESHOLD = 256 * 1024
+# Seconds a streamed body that is still being received is waited for when its transaction is serialized.
+STREAM_TIMEOUT = 60.0
+
+
+def _media_type(content_type):
+    return content_type.split(";", 1)[0].strip().lower() if content_type else ""
+
+
+def is_text(content_type):
+    return _media_type(content_type).startswith(TEXT_CONTENT_TYPES) or _media_type(content_type).endswith("+json")
+
+
+# Returns the bytes of a recorded body (for a truncated body, its head followed by its tail).
+def body_bytes(value, blob_store=None):
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if "blob" in value:
+        if blob_store is None:
+            raise ValueError("A BlobStore is needed to read " + value["blob"])
+        return blob_store.get(value["blob"])
+    if value.get("truncated"):
+        parts = (value["head"], value["tail"])
+    else:
+        parts = (value["data"],)
+    if value.get("encoding") == "base64":
+        return b"".join(base64.b64decode(part) for part in parts)
+    return "".join(parts).encode("utf-8")
+
+
+# A body that has been moved to a temporary file. HTTPTransaction.get_dict reads it back.
+class SpilledBody(object):
+
+    def __init__(self, path, length, content_type=None):
+        self.path = path
+        self.length = length
+        self.content_type = content_type
+
+    def read(self):
+        with open(self.path, "rb") as stream:
+            return stream.read()
+
+    # Returns the inline representation of the body (see CapturePolicy.encode).
+    def to_record(self):
+        return CapturePolicy.encode(self.read(), self.content_type)
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# A body that is being streamed to a temporary file by a StreamTee. It is complete when the last chunk has been
+# forwarded to the client (or the connection has been closed): until then to_record waits for it.
+class StreamedBody(SpilledBody):
+
+    def __init__(self, path, content_type=None, content_encoding=None, blob_store=None):
+        super().__init__(path, 0, content_type)
+        self.content_encoding = content_encoding
+        self.blob_store = blob_store
+        # set by the StreamTee: head_length is not None if only the head and the tail of the body have been kept.
+        self.head_length = None
+        self.aborted = False
+        self.complete = threading.Event()
+
+    def ready(self):
+        return self.complete.is_set()
+
+    def to_record(self, timeout=STREAM_TIMEOUT):
+        # a body still incomplete after timeout is recorded as it is. (e.g. a download that never ends)
+        incomplete = not self.complete.wait(timeout) or self.aborted
+        content = self.read()
+        if not content:
+            return ""
+        head_length = self.head_length
+        if self.content_encoding and head_length is None and not incomplete and encoding is not None:
+            try:
+                content = encoding.decode(content, self.content_encoding)
+            except ValueError:
+                pass
+            else:
+                self.content_encoding = None
+
+        if self.blob_store is not None:
+            record = self.blob_store.reference(content)
+            if head_length is not None:
+                record.update({"length": self.length, "truncated": True, "head_length": head_length})
+        elif self.content_encoding:
+            # the body could not be decoded (or only a part of it has been kept): its bytes are recorded as they
+            # were sent by the server.
+            record = CapturePolicy.encode(content, "application/octet-stream", self.length, head_length)
+        else:
+            record = CapturePolicy.encode(content, self.content_type, self.length, head_length)
+        if isinstance(record, dict):
+            if self.content_encoding:
+                record["content_encoding"] = self.content_encoding
+            if incomplete:
+                record["incomplete"] = True
+        return record
+
+
+# Assigned to flow.response.stream: mitmproxy calls it with the iterator of the chunks of the body, and forwards
+# to the client the chunks it yields. The chunks are yielded unchanged as soon as they are written to the file of
+# body. Only max_size bytes of the body are kept (see CapturePolicy.capture): the head is written to the file
+# and the rest is held in memory (at most max_size / 2 bytes) until the body ends, when its tail is appended.
+class StreamTee(object):
+
+    def __init__(self, body, max_size):
+        self.body = body
+        self.head_length = max_size - max_size // 2
+        self.tail_length = max_size // 2
+
+    def __call__(self, chunks):
+        body = self.body
+        tail = collections.deque()
+        tail_size = 0
+        written = 0
+        stream = None
+        try:
+            stream = open(body.path, "wb")
+        except OSError:
+            body.aborted = True
+        try:
+            for chunk in chunks:
+                body.length += len(chunk)
+                if stream is not None:
+                    try:
+                        if written < self.head_length:
+                            head = chunk[:self.head_length - written]
+                            stream.write(head)
+                            written += len(head)
+                            chunk_tail = chunk[len(head):]
+                        else:
+                            chunk_tail = chunk
+                        if chunk_tail:
+                            tail.append(chunk_tail)
+                            tail_size += len(chunk_tail)
+                            # only the chunks that can still be part of the tail are kept.
+                            while tail and tail_size - len(tail[0]) >= self.tail_length:
+                                tail_size -= len(tail.popleft())
+                    except OSError:
+                        # a full disk must not break the connection: the body is no longer recorded.
+                        body.aborted = True
+                        stream.close()
+                        stream = None
+                yield chunk
+        except BaseException:
+            # the client or the server closed the connection before the end of the body.
+            body.aborted = True
+            raise
+        finally:
+            if stream is not None:
+                try:
+                    rest = b"".join(tail)
+                    if body.length > self.head_length + self.tail_length:
+                        body.head_length = written
+                        rest = rest[len(rest) - self.tail_length:]
+                    stream.write(rest)
+                    stream.close()
+                except OSError:
+                    body.aborted = True
+            body.complete.set()
+
+
+class CapturePolicy(object):
+
+    def __init__(self, max_sizes=None, spill_threshold=SPILL_THRESHOLD, spill_folder=None,
+                 stream_threshold=STREAM_THRESHOLD):
+        self.max_sizes = dict(MAX_SIZES)
+        if max_sizes is not None:
+            self.max_sizes.update(max_sizes)
+        self.spill_threshold = spill_threshold
+        self.stream_threshold = stream_threshold
+        # the folder is created only when the first body is spilled.
+        self.spill_folder = spill_folder
+
+    # Returns the maximum number of bytes recorded for content_type.
+    def max_size(self, content_type):
+        media_type = _media_type(content_type)
+        prefix = max((p for p in self.max_sizes if media_type.startswith(p)), key=len)
+        return self.max_sizes[prefix]
+
+    # Returns the value to record for content (bytes) according to the policy.
+    def capture(self, content, content_type=None, blob_store=None):
+        if not content:
+            return ""
+        length = len(content)
+        limit = self.max_size(content_type)
+        truncated = length > limit
+        if truncated:
+            head_length = limit - limit // 2
+            content = content[:head_length] + content[length - limit // 2:]
+
+        if blob_store is not None:
+            reference = blob_store.reference(content)
+            if truncated:
+                reference.update({"length": length, "truncated": True, "head_length": head_length})
+            return reference
+
+        if not truncated and length > self.spill_threshold:
+            return self.__spill(content, content_type)
+        return self.encode(content, content_type, length, head_length if truncated else None)
+
+    # Returns the inline representation of content. head_length is given only for truncated bodies.
+    @staticmethod
+    def encode(content, content_type=None, length=None, head_length=None):
+        charset = charset_of(content_type)
+        textual = is_text(content_type) or not content_type
+
+        if head_length is None:
+            if textual:
+                try:
+                    return content.decode(charset)
+                except UnicodeDecodeError:
+                    # a body without content type (or with a wrong one) that is not text after all.
+                    pass
+            return {"encoding": "base64", "data": base64.b64encode(content).decode("ascii"), "length": len(content)}
+
+        head, tail = content[:head_length], content[head_length:]
+        if is_text(content_type):
+            # the cut could split a multi-byte character: the broken bytes are replaced.
+            head, tail = head.decode(charset, "replace"), tail.decode(charset, "replace")
+            encoding = "utf-8"
+        else:
+            head, tail = base64.b64encode(head).decode("ascii"), base64.b64encode(tail).decode("ascii")
+            encoding = "base64"
+        return {"encoding": encoding, "head": head, "tail": tail, "length": length, "truncated": True}
+
+    # True if a recorded response with these headers should be streamed (and teed) instead of buffered: its declared
+    # size is over stream_threshold, or it is binary and its size is not declared.
+    def should_stream(self, headers):
+        length = headers.get("content-length")
+        if length is not None:
+            try:
+                return int(length) > self.stream_threshold
+            except ValueError:
+                pass
+        return not is_text(headers.get("content-type"))
+
+    # Returns the StreamTee to assign to response.stream and the StreamedBody it writes.
+    def tee(self, headers, blob_store=None):
+        content_type = headers.get("content-type")
+        body = StreamedBody(self.__new_file(), content_type, headers.get("content-encoding"), blob_store)
+        return StreamTee(body, self.max_size(content_type)), body
+
+    def __new_file(self):
+        if self.spill_folder is None:
+            self.spill_folder = tempfile.mkdtemp(prefix="wapt-spill-")
+        os.makedirs(self.spill_folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.spill_folder, suffix=".body")
+        os.close(fd)
+        return path
+
+    def __spill(self, content, content_type):
+        path = self.__new_file()
+        with open(path, "wb") as stream:
+            stream.write(content)
+        return SpilledBody(path, len(content), content_type)
@@ -0,0 +1,56 @@
+# Description: ClientRecording holds the recording state of a single client (pentester) of the interceptor: its
+#              Session, the state of the recording protocol and the "waiting for JSON" flag. HTTPLogger keeps one
+#              ClientRecording for every client, so that many pentesters can record their sessions at the same time
+#              through the same interceptor without mixing their traffic.
+# Notes:
+#           Clients are identified by a cookie that HTTPLogger sets on the responses (see CLIENT_COOKIE) or,
+#           if cookies are disabled (client_key="ip"), by their IP address.
+
+import threading
+
+# Imported to instantiate the session of the client.
+from Session import Session
+
+# Name of the cookie employed to identify the clients.
+CLIENT_COOKIE = 'wapt_dataset_collector_client'
+
+
+class ClientRecording(object):
+
+    def __init__(self, client_id, streaming=False, catalog=None, recording_format=None, deduplicator=None):
+        self.client_id = client_id
+        # session attribute is an istance of Session. It contains all the info recorded during the session and will
+        # be used to write all this info on the disk when the recording protocol ends. During the recording session
+        # it will contain all the data related to current recording session and when the recording protocol ends it
+        # will be detached to make room for a new session.
+        # In streaming mode the session writes every transaction on the disk as soon as it is captured instead of
+        # keeping it in memory until the end of the recording.
+        # Every session saved is indexed in catalog (a DatasetCatalog), if given, and is written in recording_format
+        # (a RecordingFormat, pretty printed JSON by default), without the near-duplicates found by deduplicator.
+        self.session = Session(streaming=streaming, catalog=catalog, recording_format=recording_format,
+                               deduplicator=deduplicator)
+
+        # this boolean flag is employed to ensure a correct execution of the entire protocol.
+        # Initially it is set to False. It will be enabled only when the client asks to end the recording session:
+        # in that case the protocol establishes that there is a final POST request sent automatically from the
+        # user's browser to transmit the recorded session as JSON.
+        self.waiting_for_json = False
+        '''
+            recording attribute is employed to track the state of the session.
+            It can assume three different values:
+            - "on": when recording is on this state it means that the session is gonna be recorded or the recording
+                    is already taking place.
+            - "off": when recording is on this state it means that everything that this addon is gonna intercept will
+                     be not recorded.
+            - "end_recording": when recording is on this state it means that last http request contained "record"
+                               param set to false and that the proxy need to turn off the recording.
+                               This state is distinguished from other two because when the user asks to stop the
+                               recording we need to return him/her not the page him/her requested with the
+                               record parameter set to false but a simple HTML page that informs that the recording
+                               session has been successfully ended.
+        '''
+        self.recording = "off"
+
+        # the flows of the same client can be processed concurrently: every change to this object is made holding
+        # this lock.
+        self.lock = threading.RLock()
@@ -0,0 +1,55 @@
+# Description: helper functions shared by the tools that work on the dataset produced by the interceptor (export,
+#              catalog, ...). Every session is saved as out/<task name>/<start time>/session_recording.json (or
+#              with the name of another output format, see RecordingFormat.py).
+# Notes:
+#       This module doesn't depend on mitmproxy: the tools can run on any machine that has a copy of out/.
+
+import os
+
+# Name of the file that contains a recorded session.
+RECORDING_FILE = "session_recording.json"
+# Names of the recorded session in every output format: <name>.<encoding extension>[.<compression extension>]
+RECORDING_NAME = "session_recording"
+ENCODING_EXTENSIONS = {"json": ".json", "compact": ".json", "msgpack": ".msgpack"}
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+RECORDING_FILES = tuple(dict.fromkeys(RECORDING_NAME + encoding + compression
+                                      for encoding in ENCODING_EXTENSIONS.values()
+                                      for compression in ("",) + tuple(COMPRESSION_EXTENSIONS.values())))
+# Folders of out/ that don't contain sessions.
+RESERVED_FOLDERS = ("blobs", "shards")
+
+
+# Yields the paths of the recordings contained in out_folder, sorted by task and start time.
+def find_recordings(out_folder):
+    out_folder = str(out_folder)
+    if not os.path.isdir(out_folder):
+        return
+    for task in sorted(os.listdir(out_folder)):
+        task_folder = os.path.join(out_folder, task)
+        if task in RESERVED_FOLDERS or not os.path.isdir(task_folder):
+            continue
+        for start_time in sorted(os.listdir(task_folder)):
+            recording = recording_in(os.path.join(task_folder, start_time))
+            if recording is not None:
+                yield recording
+
+
+# Returns the path of the recording saved in session_folder, whatever its format, or None.
+def recording_in(session_folder):
+    for name in RECORDING_FILES:
+        recording = os.path.join(session_folder, name)
+        if os.path.isfile(recording):
+            return recording
+    return None
+
+
+# Returns the identifier of the session saved in recording: "<task name>/<start time>".
+def session_id(recording):
+    session_folder = os.path.dirname(os.path.abspath(recording))
+    return os.path.basename(os.path.dirname(session_folder)) + "/" + os.path.basename(session_folder)
+
+
+# Returns (task name, start time) of the session saved in recording, as they appear in its path.
+def session_info(recording):
+    task_name, start_time = session_id(recording).split("/", 1)
+    return task_name, start_time.replace("_", " ")
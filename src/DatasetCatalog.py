@@ -0,0 +1,254 @@
+# Description: DatasetCatalog is an index of the sessions and the transactions recorded in out/, kept in a SQLite
+#              database (out/catalog.sqlite). Finding, for example, every POST request to /vulnerabilities/sqli/
+#              across all the sessions is a lookup on the indexes instead of a parse of every session_recording.json.
+#              For every transaction the catalog stores where it is saved (byte offset and length inside the
+#              recording, digests of its bodies in the BlobStore), so read_transaction() can load just that one.
+# Notes:
+#           - Session.save_session adds every session to the catalog as soon as it is saved; rebuild() indexes an
+#             existing out/ tree (sessions that have not changed since the last rebuild are skipped).
+#           - The connection is shared by the threads of the interceptor (the persistence worker saves the
+#             sessions), so every operation is made holding a lock.
+
+import json
+import os
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+# find_recordings walks out/ looking for the recorded sessions.
+from Dataset import find_recordings, session_id, session_info
+
+# The recordings can be saved in different formats (see RecordingFormat.py).
+from RecordingFormat import detect_format, open_recording, read_transaction
+
+# Name of the catalog database (in the output folder).
+CATALOG_FILE = "catalog.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL UNIQUE,
+    task_name TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    url TEXT,
+    window_width TEXT,
+    window_height TEXT,
+    transactions_count INTEGER NOT NULL,
+    actions_count INTEGER NOT NULL,
+    recording TEXT NOT NULL,
+    recording_size INTEGER,
+    recording_mtime REAL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    transaction_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    host TEXT,
+    path TEXT,
+    method TEXT,
+    status_code INTEGER,
+    client_ip TEXT,
+    client_name TEXT,
+    actions_count INTEGER NOT NULL,
+    request_blob TEXT,
+    response_blob TEXT,
+    offset INTEGER,
+    length INTEGER
+);
+CREATE TABLE IF NOT EXISTS parameters (
+    txn INTEGER NOT NULL REFERENCES transactions(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_task ON sessions(task_name, start_time);
+CREATE INDEX IF NOT EXISTS transactions_session ON transactions(session, transaction_id);
+CREATE INDEX IF NOT EXISTS transactions_path ON transactions(path, method);
+CREATE INDEX IF NOT EXISTS transactions_method ON transactions(method, status_code);
+CREATE INDEX IF NOT EXISTS transactions_host ON transactions(host);
+CREATE INDEX IF NOT EXISTS transactions_client ON transactions(client_ip);
+CREATE INDEX IF NOT EXISTS parameters_name ON parameters(name, txn);
+"""
+
+
+def _blob(content):
+    return content["blob"] if isinstance(content, dict) and "blob" in content else None
+
+
+# Returns the summary of a transaction that the catalog stores. n is the number of the transaction in its session,
+# offset and length tell where its JSON object is saved in the recording (None if unknown).
+def summarize(n, transaction_dict, offset=None, length=None):
+    request = transaction_dict.get("request", {})
+    response = transaction_dict.get("response", {})
+    client = request.get("client", {})
+    url = transaction_dict.get("url", "")
+    split_url = urlsplit(url)
+    return {"transaction_id": n, "url": url, "host": split_url.hostname, "path": split_url.path,
+            "method": request.get("method"), "status_code": response.get("status_code"),
+            "client_ip": client.get("ip address"), "client_name": client.get("name"),
+            "actions_count": len(transaction_dict.get("actions", {})),
+            "request_blob": _blob(request.get("content")), "response_blob": _blob(response.get("content")),
+            "offset": offset, "length": length, "parameters": request.get("parameters", {})}
+
+
+class DatasetCatalog(object):
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    # Adds (or replaces) a session. summaries are the dictionaries returned by summarize().
+    def add_session(self, recording, summaries, url=None, window_width=None, window_height=None):
+        sid = session_id(recording)
+        task_name, start_time = session_info(recording)
+        try:
+            stat = os.stat(recording)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = None, None
+
+        with self._lock, self._connection:
+            cursor = self._connection.cursor()
+            cursor.execute("DELETE FROM sessions WHERE session_id = ?", (sid,))
+            cursor.execute("INSERT INTO sessions (session_id, task_name, start_time, url, window_width, "
+                           "window_height, transactions_count, actions_count, recording, recording_size, "
+                           "recording_mtime) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, ?, ?)",
+                           (sid, task_name, start_time, url, window_width, window_height,
+                            os.path.abspath(recording), size, mtime))
+            session = cursor.lastrowid
+            transactions_count = actions_count = 0
+            for summary in summaries:
+                if url is None and transactions_count == 0:
+                    url = summary["url"]
+                cursor.execute("INSERT INTO transactions (session, transaction_id, url, host, path, method, "
+                               "status_code, client_ip, client_name, actions_count, request_blob, response_blob, "
+                               "offset, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (session, summary["transaction_id"], summary["url"], summary["host"],
+                                summary["path"], summary["method"], summary["status_code"], summary["client_ip"],
+                                summary["client_name"], summary["actions_count"], summary["request_blob"],
+                                summary["response_blob"], summary["offset"], summary["length"]))
+                txn = cursor.lastrowid
+                cursor.executemany("INSERT INTO parameters (txn, name, value) VALUES (?, ?, ?)",
+                                   ((txn, name, str(value)) for name, value in summary["parameters"].items()))
+                transactions_count += 1
+                actions_count += summary["actions_count"]
+            cursor.execute("UPDATE sessions SET transactions_count = ?, actions_count = ?, url = ? WHERE id = ?",
+                           (transactions_count, actions_count, url, session))
+
+    # Indexes the recording (a session_recording.json file, or a recording of another format).
+    def index_recording(self, recording):
+        # the transactions are read (and summarized) one at a time. Their offsets are known for the uncompressed
+        # JSON recordings, pretty printed or compact: the reader tells where every transaction is in the file.
+        compression, encoding = detect_format(recording)
+        located = compression is None and encoding == "json"
+        summaries = []
+        with open_recording(recording, skip=()) as reader:
+            for n, transaction in reader.transactions():
+                summaries.append(summarize(int(n), transaction, *(reader.location if located else (None, None))))
+            header = reader.header
+        self.add_session(recording, summaries, None, header.get("window_width"), header.get("window_height"))
+
+    # Indexes every session of out_folder and removes from the catalog the sessions that don't exist anymore.
+    # Sessions already indexed, whose recording has not changed, are skipped unless full is True.
+    # Returns the number of indexed sessions and the list of (recording, error) that could not be indexed.
+    def rebuild(self, out_folder, full=False):
+        with self._lock:
+            known = {row["recording"]: (row["recording_size"], row["recording_mtime"])
+                     for row in self._connection.execute("SELECT recording, recording_size, recording_mtime "
+                                                         "FROM sessions")}
+        indexed, failed, found = 0, [], set()
+        for recording in find_recordings(out_folder):
+            recording = os.path.abspath(recording)
+            try:
+                stat = os.stat(recording)
+            except OSError:
+                # the recording has been deleted while out/ was walked: it is removed from the catalog below.
+                continue
+            found.add(recording)
+            if not full and known.get(recording) == (stat.st_size, stat.st_mtime):
+                continue
+            try:
+                self.index_recording(recording)
+                indexed += 1
+            except (OSError, ValueError) as error:
+                failed.append((recording, str(error)))
+
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM sessions WHERE recording = ?",
+                                         ((recording,) for recording in known if recording not in found))
+        return indexed, failed
+
+    # Returns the sessions (as dictionaries), optionally only the ones of task_name.
+    def sessions(self, task_name=None):
+        query = "SELECT * FROM sessions"
+        args = ()
+        if task_name is not None:
+            query += " WHERE task_name = ?"
+            args = (task_name,)
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(query + " ORDER BY task_name, start_time", args)]
+
+    # Returns the transactions that satisfy every given condition (as dictionaries, with the session_id and the
+    # recording they belong to). path and url accept SQL LIKE patterns (e.g. "/vulnerabilities/sqli%").
+    # parameter is the name of a parameter the request must contain.
+    def find_transactions(self, method=None, path=None, url=None, host=None, status_code=None, task_name=None,
+                          client_ip=None, parameter=None, limit=None):
+        conditions, args = [], []
+        for column, value in (("t.method", method), ("t.host", host), ("t.status_code", status_code),
+                              ("s.task_name", task_name), ("t.client_ip", client_ip)):
+            if value is not None:
+                conditions.append(column + " = ?")
+                args.append(value.upper() if column == "t.method" else value)
+        for column, value in (("t.path", path), ("t.url", url)):
+            if value is not None:
+                conditions.append(column + " LIKE ?")
+                args.append(value)
+        if parameter is not None:
+            conditions.append("EXISTS (SELECT 1 FROM parameters p WHERE p.txn = t.id AND p.name = ?)")
+            args.append(parameter)
+
+        query = ("SELECT s.session_id, s.recording, t.transaction_id, t.url, t.host, t.path, t.method, "
+                 "t.status_code, t.client_ip, t.client_name, t.actions_count, t.request_blob, t.response_blob, "
+                 "t.offset, t.length FROM transactions t JOIN sessions s ON s.id = t.session")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY s.task_name, s.start_time, t.transaction_id"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(int(limit))
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(query, args)]
+
+    # Returns the parameters of a transaction found by find_transactions.
+    def parameters(self, session_id_, transaction_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT p.name, p.value FROM parameters p JOIN transactions t ON t.id = p.txn "
+                "JOIN sessions s ON s.id = t.session WHERE s.session_id = ? AND t.transaction_id = ?",
+                (session_id_, transaction_id))
+            return {row["name"]: row["value"] for row in rows}
+
+    # Loads the whole transaction (as saved in its recording) found by find_transactions, reading only its bytes.
+    @staticmethod
+    def read_transaction(row):
+        if row["offset"] is None:
+            return read_transaction(row["recording"], str(row["transaction_id"]))
+        with open(row["recording"], "rb") as stream:
+            stream.seek(row["offset"])
+            return json.loads(stream.read(row["length"]))
+
+
+# Returns the catalog of the output folder out_folder (e.g. "../out/").
+def open_catalog(out_folder):
+    return DatasetCatalog(os.path.join(str(out_folder), CATALOG_FILE))
@@ -0,0 +1,226 @@
+# Description: DatasetExporter converts the sessions recorded in out/ into columnar tables (Parquet or Arrow IPC),
+#              so that the loaders of a machine learning pipeline can read only the columns (and the row groups)
+#              they need instead of parsing every session_recording.json at every epoch.
+#              The following tables are written, each one in its own folder of the destination:
+#              - sessions:     one row per session;
+#              - transactions: one row per http transaction (url, method, status, client, bodies, ...);
+#              - headers:      one row per request/response header;
+#              - parameters:   one row per request parameter;
+#              - actions:      one row per action performed by the pentester.
+#              Every row contains session_id ("<task name>/<start time>") and, except for sessions,
+#              transaction_id (the number of the transaction in its session) to join the tables.
+# Notes:
+#           - pyarrow is an optional dependency, needed only by this tool: pip install pyarrow
+#           - Sessions are split in parts that are exported in parallel by a pool of processes. Every part is
+#             written in batches of rows (a row group each), so the memory used doesn't depend on the size of
+#             the dataset. Each table folder can be read at once as a dataset, e.g.
+#             pyarrow.dataset.dataset("export/transactions").to_table(columns=[...], filter=...)
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+# find_recordings walks out/ looking for the recorded sessions.
+from Dataset import find_recordings, session_id, session_info
+
+# open_recording reads a recording of any output format, one transaction at a time.
+from RecordingFormat import open_recording
+
+TABLES = ("sessions", "transactions", "headers", "parameters", "actions")
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+# Number of rows of a table written at once (a row group).
+BATCH_SIZE = 10000
+
+
+def _schemas():
+    string, int64 = pyarrow.string(), pyarrow.int64()
+    keys = [("session_id", string), ("transaction_id", int64)]
+    return {
+        "sessions": pyarrow.schema([("session_id", string), ("task_name", string), ("start_time", string),
+                                    ("window_width", string), ("window_height", string),
+                                    ("transactions_count", int64), ("actions_count", int64)]),
+        "transactions": pyarrow.schema(keys + [("url", string), ("scheme", string), ("host", string),
+                                               ("path", string), ("query", string), ("method", string),
+                                               ("status_code", int64), ("client_ip", string),
+                                               ("client_port", string), ("client_name", string),
+                                               ("request_content", string), ("response_content", string),
+                                               ("actions_count", int64)]),
+        "headers": pyarrow.schema(keys + [("direction", string), ("name", string), ("value", string)]),
+        "parameters": pyarrow.schema(keys + [("name", string), ("value", string)]),
+        "actions": pyarrow.schema(keys + [("action_id", int64), ("time", pyarrow.float64()), ("type", string),
+                                          ("key", string), ("x", pyarrow.float64()), ("y", pyarrow.float64()),
+                                          ("url", string), ("action", string)]),
+    }
+
+
+# Bodies that are not plain text (base64, truncated, blob references) are exported as their JSON representation.
+def _content(value, include_bodies):
+    if not include_bodies or value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value, separators=(',', ':'))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Returns the rows of every table for the session saved in recording.
+def session_rows(recording, include_bodies=True):
+    sid = session_id(recording)
+    task_name, start_time = session_info(recording)
+    rows = {table: [] for table in TABLES}
+    transactions_count = 0
+
+    # without the bodies, they are not even decoded.
+    with open_recording(recording, skip=() if include_bodies else ("request.content", "response.content")) as reader:
+        for key, transaction in reader.transactions():
+            transactions_count += 1
+            _transaction_rows(rows, sid, int(key), transaction, include_bodies)
+        # the fields that follow the transactions are known once they have been read.
+        session = reader.header
+
+    rows["sessions"].append({
+        "session_id": sid, "task_name": task_name, "start_time": start_time,
+        "window_width": str(session.get("window_width")), "window_height": str(session.get("window_height")),
+        "transactions_count": transactions_count, "actions_count": len(rows["actions"])})
+    return rows
+
+
+# Appends to rows the rows of the transaction tid of the session sid.
+def _transaction_rows(rows, sid, tid, transaction, include_bodies):
+    request = transaction.get("request", {})
+    response = transaction.get("response", {})
+    client = request.get("client", {})
+    actions = transaction.get("actions", {})
+    url = urlsplit(transaction.get("url", ""))
+
+    rows["transactions"].append({
+        "session_id": sid, "transaction_id": tid, "url": transaction.get("url"), "scheme": url.scheme,
+        "host": url.hostname, "path": url.path, "query": url.query, "method": request.get("method"),
+        "status_code": response.get("status_code"), "client_ip": client.get("ip address"),
+        "client_port": client.get("port"), "client_name": client.get("name"),
+        "request_content": _content(request.get("content"), include_bodies),
+        "response_content": _content(response.get("content"), include_bodies), "actions_count": len(actions)})
+
+    for direction, message in (("request", request), ("response", response)):
+        for name, value in message.get("headers", {}).items():
+            rows["headers"].append({"session_id": sid, "transaction_id": tid, "direction": direction,
+                                    "name": name, "value": value})
+    for name, value in request.get("parameters", {}).items():
+        rows["parameters"].append({"session_id": sid, "transaction_id": tid, "name": name, "value": value})
+
+    for action_key, action in actions.items():
+        performed = action.get("action", {})
+        rows["actions"].append({
+            "session_id": sid, "transaction_id": tid, "action_id": int(action_key),
+            "time": _number(action.get("time")), "type": performed.get("type"), "key": performed.get("key"),
+            "x": _number(performed.get("x")), "y": _number(performed.get("y")), "url": performed.get("url"),
+            "action": json.dumps(action, separators=(',', ':'))})
+
+
+# Writes the rows of a table in batches, in a single file.
+class TableWriter(object):
+
+    def __init__(self, path, schema, file_format, batch_size):
+        self.path = path
+        self.schema = schema
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+        self._writer = None
+
+    def add(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self, force=False):
+        if not self.rows and not force:
+            return
+        table = pyarrow.Table.from_pylist(self.rows, schema=self.schema)
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if self.file_format == "parquet":
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression="zstd")
+            else:
+                self._writer = pyarrow.ipc.new_file(self.path, self.schema)
+        self._writer.write_table(table)
+        self.written += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        # a table without rows is written anyway: its readers still find the schema.
+        self.flush(force=self._writer is None)
+        if self._writer is not None:
+            self._writer.close()
+
+
+# Exports the sessions of recordings as part number part_n of every table. Runs in a worker process.
+def export_part(recordings, destination, part_n, file_format="parquet", batch_size=BATCH_SIZE,
+                include_bodies=True):
+    schemas = _schemas()
+    writers = {table: TableWriter(os.path.join(destination, table, "part-%05d%s" % (part_n, FORMATS[file_format])),
+                                  schemas[table], file_format, batch_size) for table in TABLES}
+    failed = []
+    try:
+        for recording in recordings:
+            try:
+                rows = session_rows(recording, include_bodies)
+            except (OSError, ValueError) as error:
+                failed.append((recording, str(error)))
+                continue
+            for table in TABLES:
+                writers[table].add(rows[table])
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {table: writers[table].written for table in TABLES}, failed
+
+
+class DatasetExporter(object):
+
+    def __init__(self, out_folder, destination, file_format="parquet", workers=None, batch_size=BATCH_SIZE,
+                 include_bodies=True, sessions_per_part=64):
+        if pyarrow is None:
+            raise ImportError("pyarrow is needed to export the dataset: pip install pyarrow")
+        if file_format not in FORMATS:
+            raise ValueError("Unknown format: " + str(file_format))
+        self.out_folder = out_folder
+        self.destination = destination
+        self.file_format = file_format
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.batch_size = batch_size
+        self.include_bodies = include_bodies
+        self.sessions_per_part = sessions_per_part
+
+    # Exports every session of out_folder. Returns the number of rows written in each table and the recordings
+    # that could not be read.
+    def export(self):
+        recordings = list(find_recordings(self.out_folder))
+        parts = [recordings[i:i + self.sessions_per_part]
+                 for i in range(0, len(recordings), self.sessions_per_part)]
+        totals = {table: 0 for table in TABLES}
+        failed = []
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(export_part, part, self.destination, part_n, self.file_format,
+                                       self.batch_size, self.include_bodies)
+                       for part_n, part in enumerate(parts, start=1)]
+            for future in futures:
+                written, part_failed = future.result()
+                for table in TABLES:
+                    totals[table] += written[table]
+                failed.extend(part_failed)
+        return totals, failed
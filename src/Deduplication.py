@@ -0,0 +1,468 @@
+# Description: detection of the near-duplicate transactions of the dataset: scanner payload sweeps, reloads of the
+#              same page and polling requests make most of the transactions of a session (and of out/) almost equal to
+#              some other one. Every transaction gets a Fingerprint:
+#              - its structure: method, normalized url (host and path, with the numeric identifiers replaced) and the
+#                names of its parameters. Two transactions with a different structure are never near-duplicates;
+#              - a MinHash signature of its content: the values of its parameters and the 3-word shingles of the
+#                request and response bodies.
+#              The signatures are split in bands (LSH): two transactions with the same structure that share a band
+#              are compared, and the later one is a near-duplicate of the earlier one if their signatures estimate a
+#              Jaccard similarity of at least threshold.
+#              Deduplicator flags (or drops) the near-duplicates of a session while it is saved (Session.save_session);
+#              CorpusDeduplicator finds them across all the sessions of out/, keeping the bands in a SQLite database
+#              (out/dedup.sqlite) so that the memory used doesn't depend on the number of transactions.
+# Notes:
+#           - A flagged transaction has the field "duplicate_of": {"transaction": <key>, "similarity": <estimate>},
+#             where key is the transaction it duplicates (in the same session). Only the transactions without
+#             actions are dropped: the actions of the pentester are never lost, and Player can still replay them.
+#           - The signature is a one permutation MinHash (every shingle is hashed once and goes to one of
+#             NUM_HASHES bins, the empty bins borrow the value of another one): the cost is linear in the number of
+#             shingles, without numpy. The words are hashed with CRC32 and the shingles with the hash of the tuple of
+#             their words (hashes of integers are not randomized): the signatures computed in different runs can be
+#             compared.
+#           - The WebSocket transactions are never duplicates: the segments of a connection share the handshake.
+
+import array
+import collections
+import hashlib
+import itertools
+import json
+import operator
+import os
+import random
+import re
+import sqlite3
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+
+# find_recordings walks out/ looking for the recorded sessions.
+from Dataset import find_recordings, session_id
+# The bodies saved as base64, truncated or in the BlobStore are turned back into bytes by body_bytes.
+from BlobStore import BLOB_FOLDER, BlobStore
+from CapturePolicy import body_bytes
+# The recordings are read one transaction at a time, and written again (without the dropped ones) in their format.
+from RecordingFormat import RecordingWriter, format_of, open_recording
+
+# Name of the database of CorpusDeduplicator (in the output folder).
+DEDUP_FILE = "dedup.sqlite"
+# Field added to the flagged transactions.
+DUPLICATE_FIELD = "duplicate_of"
+MODES = ("flag", "drop")
+
+# NUM_HASHES values per signature, split in BANDS bands of NUM_HASHES // BANDS values: two transactions whose
+# similarity is 0.8 share a band with probability 0.95 (0.61 at 0.7, 0.9998 at 0.9).
+NUM_HASHES = 128
+_BIN_BITS = 7
+BANDS = 16
+THRESHOLD = 0.8
+# Words per shingle, and bytes of every body that are shingled (the head of the body).
+SHINGLE_SIZE = 3
+MAX_SHINGLED_BYTES = 64 * 1024
+# Representatives compared to a transaction at most (those sharing a band with it).
+MAX_CANDIDATES = 64
+
+_MASK = (1 << 64) - 1
+_WORD = re.compile(rb"\w+")
+_NUMBER = re.compile(r"^\d+$")
+_IDENTIFIER = re.compile(r"^(?:[0-9a-f]{16,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$", re.I)
+
+
+def _hash(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+# The bins an empty bin borrows its value from, in order of preference: a fixed random order for every bin.
+_rng = random.Random(NUM_HASHES)
+_PROBES = [_rng.sample(range(NUM_HASHES), NUM_HASHES) for _ in range(NUM_HASHES)]
+
+
+# Returns host and path of url, with the numbers and the identifiers in the path replaced (/item/42 -> /item/{n}).
+def normalize_url(url):
+    split_url = urlsplit(url)
+    segments = []
+    for segment in split_url.path.split("/"):
+        if _NUMBER.match(segment):
+            segment = "{n}"
+        elif _IDENTIFIER.match(segment):
+            segment = "{id}"
+        segments.append(segment)
+    return split_url.netloc.lower() + ("/".join(segments).rstrip("/") or "/")
+
+
+# Returns the bytes of a recorded body (at most MAX_SHINGLED_BYTES), or None if it is empty.
+def _body_head(content, blob_store):
+    if not content:
+        return None
+    try:
+        data = body_bytes(content, blob_store)
+    except (KeyError, ValueError, OSError):
+        # e.g. a blob whose store is not available: equal references still give equal fingerprints.
+        data = json.dumps(content, sort_keys=True).encode("utf-8")
+    return data[:MAX_SHINGLED_BYTES]
+
+
+# Adds to hashes the hashes of the shingles of data. prefix tells apart the shingles of different bodies.
+def _add_shingles(hashes, data, prefix):
+    words = list(map(zlib.crc32, _WORD.findall(data.lower())))
+    if len(words) < SHINGLE_SIZE:
+        if words:
+            hashes.add(hash((prefix,) + tuple(words)))
+        return
+    hashes.update(map(hash, zip(itertools.repeat(prefix), *(words[i:] for i in range(SHINGLE_SIZE)))))
+
+
+# Returns the one permutation MinHash signature (an array of NUM_HASHES integers) of a set of 64 bits hashes.
+def minhash(hashes):
+    if not hashes:
+        return array.array("Q", bytes(8 * NUM_HASHES))
+    empty = _MASK
+    bins = [empty] * NUM_HASHES
+    # the low bits of a hash choose its bin, the others are its value.
+    for value in hashes:
+        value &= _MASK
+        position = value & (NUM_HASHES - 1)
+        value >>= _BIN_BITS
+        if value < bins[position]:
+            bins[position] = value
+    if empty in bins:
+        # densification: an empty bin takes the value of the first filled bin of its probe sequence, the same in
+        # every signature. (borrowing from the next bin would make the small sets look more similar than they are)
+        original = list(bins)
+        for position in range(NUM_HASHES):
+            if original[position] == empty:
+                bins[position] = next(original[j] for j in _PROBES[position] if original[j] != empty)
+    return array.array("Q", bins)
+
+
+# Returns the fraction of equal values of two signatures: an estimate of the Jaccard similarity of their sets.
+def similarity(signature, other):
+    return sum(map(operator.eq, signature, other)) / NUM_HASHES
+
+
+class Fingerprint(object):
+    __slots__ = ("structure", "signature", "buckets")
+
+    # transaction is a dictionary, as recorded (see HTTPTransaction.get_dict). blob_store is needed to read the
+    # bodies saved in the BlobStore.
+    def __init__(self, transaction, blob_store=None):
+        request = transaction.get("request", {})
+        response = transaction.get("response", {})
+        url = transaction.get("url", "")
+        parameters = request.get("parameters") or {}
+        names = set(parameters)
+        names.update(name for name, _ in parse_qsl(urlsplit(url).query, keep_blank_values=True))
+        self.structure = "%s %s?%s" % (request.get("method", ""), normalize_url(url), "&".join(sorted(names)))
+
+        hashes = set()
+        for name, value in parameters.items():
+            hashes.add(_hash(("%s=%s" % (name, value)).encode("utf-8", "replace")))
+        for prefix, content in ((1, request.get("content")), (2, response.get("content"))):
+            data = _body_head(content, blob_store)
+            if data:
+                _add_shingles(hashes, data, prefix)
+        self.signature = minhash(hashes)
+        structure = self.structure.encode("utf-8", "replace")
+        rows = NUM_HASHES // BANDS
+        # the bucket of a band depends on the structure too: only transactions with the same structure collide.
+        # (signed, to be stored as a SQLite INTEGER)
+        self.buckets = [int.from_bytes(hashlib.blake2b(structure + bytes((band,)) +
+                                                       self.signature[band * rows:(band + 1) * rows].tobytes(),
+                                                       digest_size=8).digest(), "little", signed=True)
+                        for band in range(BANDS)]
+
+
+# The in memory LSH index of the representatives (the transactions that are not duplicates) of a session.
+class NearDuplicateIndex(object):
+
+    # after max_entries representatives the new ones are not indexed: the memory stays bounded for huge sessions.
+    def __init__(self, threshold=THRESHOLD, max_entries=100000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = 0
+        self.buckets = {}
+
+    # Returns (reference, similarity) of the most similar representative of fingerprint, or None.
+    def match(self, fingerprint):
+        best = None
+        seen = set()
+        for bucket in fingerprint.buckets:
+            for reference, signature in self.buckets.get(bucket, ()):
+                if reference in seen:
+                    continue
+                seen.add(reference)
+                estimate = similarity(fingerprint.signature, signature)
+                if estimate >= self.threshold and (best is None or estimate > best[1]):
+                    best = (reference, estimate)
+        return best
+
+    def add(self, fingerprint, reference):
+        if self.entries >= self.max_entries:
+            return
+        self.entries += 1
+        for bucket in fingerprint.buckets:
+            self.buckets.setdefault(bucket, []).append((reference, fingerprint.signature))
+
+
+# Flags or drops the near-duplicates of every saved session (see Session.save_session).
+class Deduplicator(object):
+
+    def __init__(self, mode="flag", threshold=THRESHOLD, blob_store=None):
+        if mode not in MODES:
+            raise ValueError("Unknown deduplication mode: " + str(mode))
+        self.mode = mode
+        self.threshold = threshold
+        self.blob_store = blob_store
+        # counters of all the saved sessions. (reported by the metrics of HTTPLogger)
+        self.transactions = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+    # Yields the transactions (dictionaries, with their actions) to be saved, in order: the near-duplicates of a
+    # previous transaction are flagged, or left out if they have no actions and mode is "drop". The key of a
+    # transaction is its position among the yielded ones.
+    def filter(self, transactions):
+        index = NearDuplicateIndex(self.threshold)
+        n = 0
+        for transaction in transactions:
+            self.transactions += 1
+            if "websocket" not in transaction:
+                fingerprint = Fingerprint(transaction, self.blob_store)
+                match = index.match(fingerprint)
+                if match is None:
+                    index.add(fingerprint, str(n + 1))
+                else:
+                    self.duplicates += 1
+                    if self.mode == "drop" and not transaction.get("actions"):
+                        self.dropped += 1
+                        continue
+                    transaction[DUPLICATE_FIELD] = {"transaction": match[0], "similarity": round(match[1], 3)}
+            n += 1
+            yield transaction
+
+    def stats(self):
+        return {"transactions": self.transactions, "duplicates": self.duplicates, "dropped": self.dropped}
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    recording TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    recording_size INTEGER,
+    recording_mtime REAL,
+    transactions_count INTEGER NOT NULL,
+    duplicates_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS representatives (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket INTEGER NOT NULL,
+    representative INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    session_id TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    representative INTEGER NOT NULL REFERENCES representatives(id),
+    similarity REAL NOT NULL,
+    actions_count INTEGER NOT NULL,
+    dropped INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session_id, transaction_id)
+);
+CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets(bucket);
+"""
+
+_BUCKETS_QUERY = ("SELECT r.id, r.signature FROM buckets b JOIN representatives r ON r.id = b.representative "
+                  "WHERE b.bucket IN (%s) LIMIT %d" % (",".join("?" * BANDS), MAX_CANDIDATES * BANDS))
+
+
+# Returns the fingerprints of the transactions saved in recording, as a list of (key, number of actions, Fingerprint
+# or None for the WebSocket transactions), and None; or None and the error that prevented reading it.
+# Runs in a worker process.
+def fingerprint_recording(recording, blob_folder=None):
+    blob_store = BlobStore(blob_folder) if blob_folder is not None else None
+    try:
+        with open_recording(recording, skip=()) as reader:
+            return [(key, len(transaction.get("actions", {})),
+                     Fingerprint(transaction, blob_store) if "websocket" not in transaction else None)
+                    for key, transaction in reader.transactions()], None
+    except (OSError, ValueError) as error:
+        return None, str(error)
+
+
+# Finds the near-duplicates across all the sessions of an output folder. The representatives and their bands are
+# kept in a SQLite database: only the fingerprints of the sessions being scanned are in memory. The sessions are
+# fingerprinted in parallel by a pool of processes, and compared with the database in order, in this process: the
+# earliest transaction is always the one that is kept.
+class CorpusDeduplicator(object):
+
+    def __init__(self, out_folder, path=None, threshold=THRESHOLD, workers=None):
+        self.out_folder = str(out_folder)
+        self.path = path if path is not None else os.path.join(self.out_folder, DEDUP_FILE)
+        self.threshold = threshold
+        self.workers = workers if workers is not None else os.cpu_count()
+        self._connection = sqlite3.connect(self.path)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+        blob_folder = os.path.join(self.out_folder, BLOB_FOLDER)
+        self.blob_folder = blob_folder if os.path.isdir(blob_folder) else None
+
+    def close(self):
+        self._connection.close()
+
+    def __settings(self):
+        return {"threshold": repr(self.threshold), "num_hashes": str(NUM_HASHES), "bands": str(BANDS),
+                "shingle_size": str(SHINGLE_SIZE), "max_shingled_bytes": str(MAX_SHINGLED_BYTES)}
+
+    def __reset(self):
+        with self._connection:
+            for table in ("duplicates", "buckets", "representatives", "sessions", "settings"):
+                self._connection.execute("DELETE FROM " + table)
+            self._connection.executemany("INSERT INTO settings VALUES (?, ?)", self.__settings().items())
+
+    # Fingerprints the sessions of the output folder that have not been scanned yet (all of them if full is True,
+    # or if a scanned session has changed or has been removed, or the settings have changed).
+    # Returns the number of scanned sessions, of scanned transactions, of near-duplicates found and the list of
+    # (recording, error) that could not be read.
+    def scan(self, full=False):
+        known = {row["recording"]: (row["recording_size"], row["recording_mtime"])
+                 for row in self._connection.execute("SELECT * FROM sessions")}
+        settings = dict(tuple(row) for row in self._connection.execute("SELECT name, value FROM settings"))
+        recordings = [os.path.abspath(recording) for recording in find_recordings(self.out_folder)]
+        current = {}
+        for recording in recordings:
+            stat = os.stat(recording)
+            current[recording] = (stat.st_size, stat.st_mtime)
+        # the representatives of a changed session could be the ones of other duplicates: everything is scanned
+        # again, in order.
+        if full or settings != self.__settings() or any(current.get(recording) != state
+                                                        for recording, state in known.items()):
+            self.__reset()
+            known = {}
+        sessions, transactions, duplicates, failed = 0, 0, 0, []
+        for recording, (fingerprints, error) in self.__fingerprints([recording for recording in recordings
+                                                                      if recording not in known]):
+            if error is not None:
+                failed.append((recording, error))
+                continue
+            sessions += 1
+            transactions += len(fingerprints)
+            duplicates += self.__scan_recording(recording, current[recording], fingerprints)
+        return sessions, transactions, duplicates, failed
+
+    # Yields (recording, result of fingerprint_recording) in the order of recordings. Only a few sessions per worker
+    # are fingerprinted ahead of the one being compared.
+    def __fingerprints(self, recordings):
+        if self.workers <= 1:
+            for recording in recordings:
+                yield recording, fingerprint_recording(recording, self.blob_folder)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for recording in recordings:
+                pending.append((recording, executor.submit(fingerprint_recording, recording, self.blob_folder)))
+                if len(pending) >= 4 * self.workers:
+                    recording, future = pending.popleft()
+                    yield recording, future.result()
+            while pending:
+                recording, future = pending.popleft()
+                yield recording, future.result()
+
+    # Compares the fingerprints of a session with the representatives found so far. Returns the number of
+    # near-duplicates.
+    def __scan_recording(self, recording, state, fingerprints):
+        this_session = session_id(recording)
+        duplicates = 0
+        # the whole session is written at once: a scan interrupted in the middle of it scans it again.
+        with self._connection:
+            for key, actions_count, fingerprint in fingerprints:
+                if fingerprint is None:
+                    continue
+                best = None
+                seen = set()
+                for row in self._connection.execute(_BUCKETS_QUERY, fingerprint.buckets):
+                    if row["id"] in seen:
+                        continue
+                    seen.add(row["id"])
+                    estimate = similarity(fingerprint.signature, array.array("Q", row["signature"]))
+                    if estimate >= self.threshold and (best is None or estimate > best[1]):
+                        best = (row["id"], estimate)
+                if best is not None:
+                    duplicates += 1
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO duplicates (session_id, transaction_id, representative, similarity,"
+                        " actions_count) VALUES (?, ?, ?, ?, ?)",
+                        (this_session, key, best[0], best[1], actions_count))
+                    continue
+                cursor = self._connection.execute(
+                    "INSERT INTO representatives (session_id, transaction_id, signature) VALUES (?, ?, ?)",
+                    (this_session, key, fingerprint.signature.tobytes()))
+                self._connection.executemany("INSERT INTO buckets VALUES (?, ?)",
+                                             ((bucket, cursor.lastrowid) for bucket in fingerprint.buckets))
+            self._connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                                     (recording, this_session) + tuple(state) + (len(fingerprints), duplicates))
+        return duplicates
+
+    # Yields the near-duplicates found (as dictionaries): session_id and transaction_id of the duplicate and of the
+    # transaction it duplicates, similarity, actions_count and dropped.
+    def duplicates(self, limit=None):
+        query = ("SELECT d.session_id, d.transaction_id, r.session_id AS duplicate_of_session, "
+                 "r.transaction_id AS duplicate_of_transaction, d.similarity, d.actions_count, d.dropped "
+                 "FROM duplicates d JOIN representatives r ON r.id = d.representative "
+                 "ORDER BY d.session_id, CAST(d.transaction_id AS INTEGER)")
+        args = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            args = (limit,)
+        for row in self._connection.execute(query, args):
+            yield dict(row)
+
+    # Rewrites the recordings that contain near-duplicates without them (only the ones without actions). The
+    # other transactions keep their keys, so the references of the remaining duplicates are still valid.
+    # Returns the number of dropped transactions.
+    def drop(self, catalog=None):
+        dropped = 0
+        by_session = {}
+        for row in self._connection.execute("SELECT s.recording, d.transaction_id FROM duplicates d "
+                                            "JOIN sessions s ON s.session_id = d.session_id "
+                                            "WHERE d.dropped = 0 AND d.actions_count = 0"):
+            by_session.setdefault(row["recording"], set()).add(row["transaction_id"])
+        for recording, keys in by_session.items():
+            this_session = session_id(recording)
+            _rewrite_without(recording, keys)
+            stat = os.stat(recording)
+            with self._connection:
+                self._connection.executemany("UPDATE duplicates SET dropped = 1 "
+                                             "WHERE session_id = ? AND transaction_id = ?",
+                                             ((this_session, key) for key in keys))
+                self._connection.execute("UPDATE sessions SET recording_size = ?, recording_mtime = ? "
+                                         "WHERE recording = ?", (stat.st_size, stat.st_mtime, recording))
+            dropped += len(keys)
+        if catalog is not None and by_session:
+            catalog.rebuild(self.out_folder)
+        return dropped
+
+
+# Writes again the recording in path (in its format) without the transactions whose key is in keys.
+def _rewrite_without(path, keys):
+    temporary = path + ".dedup"
+    try:
+        with open_recording(path, skip=()) as reader, RecordingWriter(temporary, format_of(path)) as writer:
+            writer.write_header(reader.header)
+            for key, transaction in reader.transactions():
+                if key not in keys:
+                    writer.add(key, transaction)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
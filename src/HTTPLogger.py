@@ -21,8 +21,12 @@
 # Used to parse html content of the http_response and to get the title.
 # Class myParser is a subclass of HTTPParser of html library.
 
-# Beatifulsoup will be employed to quickly manipulate the response with the aim to add javascript to it.
-from bs4 import BeautifulSoup
+# extract_title parses the first page of the session incrementally (stopping at </title>) to name the task.
+from TitleParser import extract_title
+
+# ScriptInjector adds the javascript to the html responses with a byte-level scan. (no tree is built)
+# is_html tells the html responses, the ones the script is injected in.
+from Injector import ScriptInjector, InjectionCache, is_html
 
 # Added to decode flow.response to add js code.
 # from mitmproxy.net.http import encoding
@@ -33,6 +37,48 @@ import sys
 # Imported to instantiate HTTPLogger session attribute. (14/03/21)
 from Session import *
 
+# ReverseResolver performs the reverse DNS lookups of the clients in background.
+from Resolver import ReverseResolver
+
+# PersistenceWorker saves the finished sessions in background.
+from Persistence import PersistenceWorker
+
+# CapturePolicy decides how the bodies of the requests and responses are recorded.
+from CapturePolicy import CapturePolicy
+
+# ClientRecording contains the session and the recording state of a single client.
+from ClientRecording import ClientRecording, CLIENT_COOKIE
+
+# Metrics collects latencies, counters and gauges of the addon. (see Metrics.py)
+from Metrics import Metrics
+
+# CaptureFilter decides, by means of the capture rules, which flows are recorded. (see CaptureFilter.py)
+from CaptureFilter import CaptureFilter, REQUEST, RESPONSE_HEADERS, RESPONSE
+
+# WebSocketCapture records the messages of the WebSocket connections. (see WebSocketCapture.py)
+from WebSocketCapture import WebSocketCapture, WebSocketLimits
+
+# Used to generate the identifiers of the clients.
+import uuid
+import threading
+import time
+
+# The messages printed for every flow are debug messages: they are shown only with -log_level debug.
+import logging
+
+log = logging.getLogger(__name__)
+
+# Keys of flow.metadata: the name of the client (looked up once, by the request hook), the decision of the capture
+# rules, whether the response has been streamed without being recorded and the StreamedBody of a response recorded
+# while it is streamed.
+CLIENT_NAME = 'wapt_client_name'
+CAPTURE_DECISION = 'wapt_capture'
+STREAMED = 'wapt_streamed'
+STREAMED_BODY = 'wapt_streamed_body'
+
+# timedelta is employed to obtain a distinct start time for every session.
+from datetime import datetime, timedelta
+
 """
     HTTPLogger is the class that defines the addon for mitmproxy.
     The responsability of this class is to define methods to properly process
@@ -45,40 +91,54 @@ from Session import *
 
 
 class HTTPLogger(object):
-    def __init__(self, services=None, js_file=None, eos_file=None):
-        if services is None:
-            services = {}
+    def __init__(self, services=None, js_file=None, eos_file=None, streaming=False, client_key="cookie",
+                 blob_store=None, capture_policy=None, catalog=None, metrics=None, injection_cache_size=256,
+                 capture_filter=None, recording_format=None, capture_websockets=True, websocket_limits=None,
+                 deduplicator=None):
         self.name = 'HTTPLogger Addon, by Marco Urbano'
         self.version = '2.2 -- 20/03/21'
-        self.services = services
-        # session attribute is an istance of Session. It contains all the info recorded during the session and will
-        # be used to write all this info on the disk when the recording protocol ends. This attribute will initially
-        # be instantiated as a clean session (the constructor with no parameters will set this object attributes with
-        # empty strings or empty lists of objects). During the recording session it will contain all
-        # the data related to current recording session and when the recording protocol ends it will be
-        # cleaned again to make room for a new session.
-        self.session = Session()
-
-        # this boolean flag is employed to ensure a correct execution of the entire protocol.
-        # Initially it is set to False. It will be enabled only when this class will notice that user asked to end
-        # the recording session: in that case the protocol establishes that there is a final POST request
-        # sent automatically from the user's browser to transmit the recorded session as JSON.
-        self.waiting_for_json = False
-        ''' 
-            recording attribute is employed to track the state of the session.
-            It can assume three different values:
-            - "on": when recording is on this state it means that the session is gonna be recorded or the recording
-                    is already taking place.
-            - "off": when recording is on this state it means that everything that this addon is gonna intercept will
-                     be not recorded.
-            - "end_recording": when recording is on this state it means that last http request contained "record"
-                               param set to false and that the proxy need to turn off the recording.
-                               This state is distinguished from other two because when the user asks to stop the
-                               recording we need to return him/her not the page him/her requested with the
-                               record parameter set to false but a simple HTML page that informs that the recording
-                               session has been successfully ended. 
-        '''
-        self.recording = "off"
+        # services maps the IP address of the hosts on the network to their names. It can be given as an already
+        # configured ReverseResolver or as a dictionary of known hosts (e.g. the containers on the same network).
+        if isinstance(services, ReverseResolver):
+            self.services = services
+        else:
+            self.services = ReverseResolver(services)
+        # every client of the interceptor (pentester) has its own ClientRecording, that contains its session and the
+        # state of its recording protocol. The clients are identified by a cookie set by this addon ("cookie") or by
+        # their IP address ("ip").
+        self.clients = {}
+        self.client_key = client_key
+        self.streaming = streaming
+        # the DatasetCatalog (optional) where the sessions are indexed as soon as they are saved.
+        self.catalog = catalog
+        # the RecordingFormat of the saved sessions (None: pretty printed JSON). (see RecordingFormat.py)
+        self.recording_format = recording_format
+        # the Deduplicator (optional) that flags or drops the near-duplicate transactions of the saved sessions.
+        self.deduplicator = deduplicator
+        # identifiers given to the clients that don't have the cookie yet, by IP address: the requests that a browser
+        # sends before receiving its cookie must belong to the same client.
+        self.unassigned_ids = {}
+        # the flows of different clients can be processed concurrently: clients, unassigned_ids and last_start_time
+        # are accessed holding this lock.
+        self.lock = threading.Lock()
+        # start time of the last session: two sessions with the same task name must never share the output folder.
+        self.last_start_time = None
+        # when a BlobStore is given the bodies are written (once) in the store and the transactions only keep their
+        # digest.
+        self.blob_store = blob_store
+        # capture_policy decides how the bodies are recorded: binary bodies as base64, large bodies truncated or
+        # spilled to temporary files. (see CapturePolicy.py)
+        self.capture_policy = capture_policy if capture_policy is not None else CapturePolicy()
+        # capture_filter decides which flows are recorded (by default the successful responses that are not static
+        # resources): the flows excluded before their body is received are streamed to the client.
+        self.capture_filter = capture_filter if capture_filter is not None else CaptureFilter()
+        # the WebSocket connections being recorded: id of the WebSocketFlow -> (client id, WebSocketCapture).
+        # websocket_limits bound the messages kept in memory for every connection.
+        self.capture_websockets = capture_websockets
+        self.websocket_limits = websocket_limits if websocket_limits is not None else WebSocketLimits()
+        self.websockets = {}
+        # the finished sessions are handed to the persistence worker, that writes them without blocking the proxy.
+        self.persistence = PersistenceWorker()
 
         # action_recording_js is the javascript code that will be injected to every page visited from the pentester.
         if js_file is not None:
@@ -92,6 +152,14 @@ class HTTPLogger(object):
         else:
             self.action_recording_js = ''
 
+        # the injector is built once with the javascript to inject, there is nothing to inject without it.
+        # The pages already injected are kept in its cache (injection_cache_size pages, 0 disables the cache).
+        if self.action_recording_js != '':
+            cache = InjectionCache(injection_cache_size) if injection_cache_size > 0 else None
+            self.injector = ScriptInjector(self.action_recording_js, cache=cache)
+        else:
+            self.injector = None
+
         # we only open and store the webpage showed to the user when he/she ends the session once.
         # This webpage already contains the js contained in "action_recording_js"
         if eos_file is not None:
@@ -107,29 +175,134 @@ class HTTPLogger(object):
         else:
             self.EOS_webpage = ''
 
+        # runtime measures of the addon: they can be served by a MetricsServer or written by a StatsFileWriter.
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.__register_gauges()
+
+    # The gauges are read only when a snapshot of the metrics is taken: they cost nothing to the hooks.
+    def __register_gauges(self):
+        resolver = self.services
+        self.metrics.gauge("dns_cache_hit_rate",
+                           lambda: resolver.hits / (resolver.hits + resolver.misses)
+                           if resolver.hits + resolver.misses else None)
+        self.metrics.gauge("dns_cache_size", lambda: len(resolver))
+        self.metrics.gauge("persistence_queue_depth", lambda: self.persistence.depth)
+        self.metrics.gauge("sessions_saved", lambda: self.persistence.saved)
+        self.metrics.gauge("sessions_failed", lambda: self.persistence.failed)
+        self.metrics.gauge("sessions_overflowed", lambda: self.persistence.overflowed)
+        self.metrics.gauge("clients", lambda: len(self.clients))
+        self.metrics.gauge("websocket_connections_open", lambda: len(self.websockets))
+        self.metrics.gauge("websocket_buffered_bytes",
+                           lambda: sum(capture.buffered_bytes for _, capture in list(self.websockets.values())))
+        self.metrics.gauge("recording_clients",
+                           lambda: sum(1 for client in list(self.clients.values()) if client.recording == "on"))
+        # transactions (and their bodies) held in memory by the sessions being recorded.
+        self.metrics.gauge("in_memory_transactions",
+                           lambda: sum(len(client.session.http_transactions) for client in list(self.clients.values())))
+        self.metrics.gauge("in_memory_session_bytes",
+                           lambda: sum(client.session.captured_bytes for client in list(self.clients.values())
+                                       if not client.session.streaming))
+        if self.injector is not None and self.injector.cache is not None:
+            self.metrics.gauge("injection_cache", self.injector.cache.stats)
+        if self.blob_store is not None:
+            store = self.blob_store
+            self.metrics.gauge("blob_store", lambda: {"stored": store.stored, "deduplicated": store.deduplicated,
+                                                      "bytes_in": store.bytes_in,
+                                                      "bytes_written": store.bytes_written})
+        if self.deduplicator is not None:
+            self.metrics.gauge("deduplication", self.deduplicator.stats)
+
+    # Called by mitmproxy when the addon is removed or the proxy shuts down.
+    def done(self):
+        self.services.shutdown()
+        self.persistence.shutdown()
+
+    # Returns the identifier of the client that sent the request of flow.
+    def __identify_client(self, flow):
+        ip_address = flow.client_conn.ip_address[0]
+        if self.client_key == "ip":
+            return ip_address
+
+        client_id = flow.request.cookies.get(CLIENT_COOKIE)
+        with self.lock:
+            if client_id is not None:
+                # the browser received its cookie: a new browser from the same IP address will get a new identifier.
+                if self.unassigned_ids.get(ip_address) == client_id:
+                    del self.unassigned_ids[ip_address]
+                return client_id
+            # the response to this request will give the cookie to the client. (see response)
+            client_id = self.unassigned_ids.setdefault(ip_address, uuid.uuid4().hex)
+        flow.metadata[CLIENT_COOKIE + '_new'] = True
+        return client_id
+
+    # Returns the ClientRecording of client_id, creating it if this is the first flow of the client.
+    def __get_client(self, client_id):
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is None:
+                client = self.clients[client_id] = ClientRecording(client_id, self.streaming, self.catalog,
+                                                                   self.recording_format, self.deduplicator)
+            return client
+
+    # Returns a start time for a new session, never equal to the one of another session.
+    def __new_start_time(self):
+        with self.lock:
+            start_time = datetime.now()
+            if self.last_start_time is not None and start_time <= self.last_start_time:
+                start_time = self.last_start_time + timedelta(microseconds=1)
+            self.last_start_time = start_time
+            return start_time
+
     def request(self, flow):
-        # Add host info (ip_addr, hostname) in 'services' dictionary if it has been seen for the first time.
+        started = time.perf_counter()
         try:
-            # check if ip_address is already present in 'services', if not we simply query the DNS to obtain info.
-            self.services[flow.client_conn.ip_address[0]]
-        except KeyError:
-            # gethostbyaddr returns a triple (hostname, aliaslist, ipaddrlist).
-            self.services[flow.client_conn.ip_address[0]] = socket.gethostbyaddr(flow.client_conn.ip_address[0])[0]
-
+            self.__request(flow)
+        finally:
+            self.metrics.observe("request_hook", time.perf_counter() - started)
+
+    def __request(self, flow):
+        # Add host info (ip_addr, hostname) in 'services' if it has been seen for the first time. The lookup never
+        # blocks: the DNS is queried in background and, until the name is known, the IP address is used as name.
+        # The transactions of this flow take the name from its metadata: the client is looked up once per request.
+        flow.metadata[CLIENT_NAME] = self.services.lookup(flow.client_conn.ip_address[0])
+
+        client_id = self.__identify_client(flow)
+        # the response hook will find the client of this flow here.
+        flow.metadata[CLIENT_COOKIE] = client_id
+        # the cookie is only meaningful to the interceptor: neither the benchmark nor the dataset need to see it.
+        if CLIENT_COOKIE in flow.request.cookies:
+            del flow.request.cookies[CLIENT_COOKIE]
+            if not flow.request.cookies:
+                del flow.request.headers["cookie"]
+
+        # the capture rules on the request alone are evaluated here: the decision (None if it needs the response)
+        # is kept in the metadata of the flow.
+        flow.metadata[CAPTURE_DECISION] = self.capture_filter.decide(flow, REQUEST)
+
+        client = self.__get_client(client_id)
+        with client.lock:
+            self.__process_request(flow, client)
+
+    def __process_request(self, flow, client):
         # Case 1: this request is the final request of the exchange protocol. It contains all the actions performed
         #         by the penetration tester during the session in a JSON string.
-        if flow.request.headers.get("content-type") == "application/json; charset=UTF-8" and self.waiting_for_json:
+        if flow.request.headers.get("content-type") == "application/json; charset=UTF-8" and client.waiting_for_json:
             # TODO: here the code to handle the JSON contained in the final request made automatically from the js.
-            # Save user actions chain that has been received as JSON in self.session.
-            self.session.end_user_actions = str(flow.request.content.decode())
+            # Save user actions chain that has been received as JSON in the client session.
+            client.session.end_user_actions = str(flow.request.content.decode())
+
+            # the WebSocket connections still open are recorded up to now: their next messages will belong to the
+            # next session of the client.
+            if client.session.task_name != "":
+                for capture in self.__client_websockets(client.client_id):
+                    self.__add_websocket_segment(client, capture)
 
-            # Write recorded session in the output folder.
-            self.session.save_session()
-            # Set self.session == null to enable recording a new session. (Singleton pattern)
-            self.session.clear()
+            # Write recorded session in the output folder: the session is detached (client.session is cleared to
+            # enable recording a new session) and saved in background by the persistence worker.
+            self.persistence.submit(client.session.detach())
 
             # set to False the attribute "waiting_for_json", with this operation the protocol ends successfully.
-            self.waiting_for_json = False
+            client.waiting_for_json = False
 
         # Case 2: this request is not the final request containing the JSON describing the pentesting session.
         #         In this case we only need to check the request to start or stop the recording.
@@ -154,10 +327,109 @@ class HTTPLogger(object):
             except KeyError:
                 user_asked_to_record = False
 
-            if user_asked_to_record and self.recording == "off":
-                self.recording = "on"
-            elif user_asked_to_stop_record and self.recording == "on":
-                self.recording = "end_recording"
+            if user_asked_to_record and client.recording == "off":
+                client.recording = "on"
+            elif user_asked_to_stop_record and client.recording == "on":
+                client.recording = "end_recording"
+
+    # Called by mitmproxy when the headers of the response have been received, before its body. The flows that won't
+    # be recorded and don't need to be altered (no html to inject, no end of session page) are streamed: their body
+    # is forwarded to the client as it arrives, without being buffered and decoded by the proxy. The recorded flows
+    # that don't need to be altered are streamed as well if their body is large (or binary of unknown size): a
+    # StreamTee writes it to the disk while it is forwarded. (see CapturePolicy.py)
+    def responseheaders(self, flow):
+        client_id = flow.metadata.get(CLIENT_COOKIE)
+        if client_id is None:
+            return
+        decision = flow.metadata.get(CAPTURE_DECISION)
+        if decision is None:
+            decision = flow.metadata[CAPTURE_DECISION] = self.capture_filter.decide(flow, RESPONSE_HEADERS)
+
+        client = self.__get_client(client_id)
+        with client.lock:
+            recording = client.recording
+        captured = recording == "on" and decision is not False
+        altered = flow.response.status_code == 200 and (recording == "end_recording" or (
+                self.injector is not None and is_html(flow.response.headers.get("content-type"))))
+        if not captured and not altered:
+            flow.response.stream = True
+            flow.metadata[STREAMED] = True
+            self.metrics.increment("streamed_flows")
+            if recording == "on":
+                self.metrics.increment("excluded_flows")
+        elif captured and decision and not altered and self.capture_policy.should_stream(flow.response.headers):
+            flow.response.stream, flow.metadata[STREAMED_BODY] = self.capture_policy.tee(flow.response.headers,
+                                                                                         self.blob_store)
+            self.metrics.increment("teed_flows")
+
+        # the headers of a streamed response are sent right after this hook: the cookie must be added here.
+        self.__set_client_cookie(flow, client_id)
+
+    # The client will be recognized by this cookie from its next request on.
+    @staticmethod
+    def __set_client_cookie(flow, client_id):
+        if flow.metadata.get(CLIENT_COOKIE + '_new') and not flow.metadata.get(CLIENT_COOKIE + '_set'):
+            flow.response.headers.add("Set-Cookie", CLIENT_COOKIE + "=" + client_id + "; Path=/; HttpOnly")
+            flow.metadata[CLIENT_COOKIE + '_set'] = True
+
+    # The WebSocket connections opened by a client while the recording is on are recorded with their handshake:
+    # only the capture rules on the request are checked, since the 101 response of the handshake is not a page.
+    def websocket_start(self, flow):
+        handshake = flow.handshake_flow
+        client_id = handshake.metadata.get(CLIENT_COOKIE) if handshake is not None else None
+        if not self.capture_websockets or client_id is None:
+            return
+        if self.capture_filter.decide(handshake, REQUEST) is False:
+            return
+        with self.lock:
+            self.websockets[flow.id] = (client_id, WebSocketCapture(handshake, self.websocket_limits))
+        self.metrics.increment("websocket_connections")
+
+    def websocket_message(self, flow):
+        message = flow.messages[-1]
+        # mitmproxy keeps every message of the connection in the flow: only the last one is needed by the addons.
+        del flow.messages[:-1]
+        entry = self.websockets.get(flow.id)
+        if entry is None:
+            return
+        client_id, capture = entry
+        client = self.__get_client(client_id)
+        with client.lock:
+            recording = client.recording
+            streaming = client.session.streaming
+        if recording != "on":
+            return
+        self.metrics.increment("websocket_messages")
+        # a full ring buffer of a streamed session is written to the capture log, instead of losing its oldest
+        # messages. (the session must have been started by a recorded transaction)
+        if capture.add(message) and streaming:
+            with client.lock:
+                if client.recording == "on" and client.session.task_name != "":
+                    self.__add_websocket_segment(client, capture, flow)
+
+    def websocket_end(self, flow):
+        with self.lock:
+            entry = self.websockets.pop(flow.id, None)
+        if entry is None:
+            return
+        client_id, capture = entry
+        client = self.__get_client(client_id)
+        with client.lock:
+            if client.recording == "on" and client.session.task_name != "":
+                self.__add_websocket_segment(client, capture, flow, final=True)
+
+    # Returns the WebSocketCapture of the open connections of client_id.
+    def __client_websockets(self, client_id):
+        with self.lock:
+            return [capture for owner, capture in self.websockets.values() if owner == client_id]
+
+    # Adds the messages buffered by capture to the session of client (as a WebSocketTransaction).
+    def __add_websocket_segment(self, client, capture, flow=None, final=False):
+        transaction = capture.flush(capture.handshake_flow.metadata.get(CLIENT_NAME), flow, final, self.blob_store,
+                                    self.capture_policy)
+        if transaction is not None:
+            client.session.add_transaction(transaction, sum(len(message[3]) for message in transaction.messages))
+            self.metrics.increment("websocket_segments")
 
     # When handling a response we need to read not only the headers, but most importantly we
     # need to read the content of the message (the html page) because we need to observe what changes
@@ -167,63 +439,103 @@ class HTTPLogger(object):
     # (exactly the first page that we choose to open), this method will also be responsible of managing
     # the capture of user actions, captured by the event listeners.
     def response(self, flow):
-
-        # Processing only HTTP successful responses (code 200).
-        # Without this check we could record even pages that doesn't load for bad implementation. (e.g.
-        # favicon.ico that doesn't load in the benchmark we used to test [wavsep])
-        if flow.response.status_code == 200:
-            # Save html response code to manipulate it later.
-            html = BeautifulSoup(flow.response.text, 'html.parser')
-
-            # Perform recording only if the request preceding this response is the first that contains "record"
-            # parameter set to "true" or the recording has been enabled from a preceding request.
-            if self.recording == "on":
+        started = time.perf_counter()
+        try:
+            self.__response(flow)
+        finally:
+            self.metrics.observe("response_hook", time.perf_counter() - started)
+            self.metrics.increment("flows")
+
+    def __response(self, flow):
+        client_id = flow.metadata.get(CLIENT_COOKIE)
+        if client_id is None:
+            # the request of this flow has not been seen by this addon (e.g. the addon has been loaded meanwhile).
+            return
+        client = self.__get_client(client_id)
+        with client.lock:
+            self.__process_response(flow, client)
+
+        # (if responseheaders has not been called for this flow)
+        self.__set_client_cookie(flow, client_id)
+
+    def __process_response(self, flow, client):
+
+        # Case 1: the response is recorded if the recording is on and the capture rules (see CaptureFilter.py) accept
+        #         the flow. The default rules record only the successful responses (code 200), that are not static
+        #         resources: without this check we could record even pages that doesn't load for bad
+        #         implementation. (e.g. favicon.ico that doesn't load in the benchmark we used to test [wavsep])
+        # Perform recording only if the request preceding this response is the first that contains "record"
+        # parameter set to "true" or the recording has been enabled from a preceding request.
+        if client.recording == "on":
+            # no HTTPTransaction is built for the flows excluded by the rules, and their body is never decoded. (the
+            # ones excluded by responseheaders have been streamed and have no body at all)
+            decision = flow.metadata.get(CAPTURE_DECISION)
+            if decision is None:
+                decision = self.capture_filter.decide(flow, RESPONSE)
+            if decision and not flow.metadata.get(STREAMED):
                 # Here the concept of "Variable Annotation" is used to specify that variable named
                 # "url_request" is a string.
                 # To know more about Variable Annotation see: https://www.python.org/dev/peps/pep-0526/
                 url_request: str = str(flow.request.pretty_url)
 
-                """
-                    ISSUE: CHECK IF THE IF STATEMENT ON STATIC CAN BE OMITTED.
-
-                    Marco, 10/01/2020 23.39
-                """
-                if '/static/' not in url_request:
-                    # Uncomment to use the url as the name of the recorded http response.
-                    # url_request = url_request.replace("/", "_")
-
-                    # Instantiate session's attributes for the first time. If this response is not the first one
-                    # that follows the request with "record=true" simply push the HTTPTransaction in the existing
-                    # session.http_transaction list.
-                    if self.session.task_name == "":
-                        # Session class objects requires only url, task_name and start_time to be instantiated.
-                        self.session.task_name = html.title.string if html.title is not None else "Empty Task Name"
-                        self.session.start_time = datetime.now()
-                        self.session.url = url_request
-
-                    # Save current transaction into session.http_transactions
-                    self.session.http_transactions.append(HTTPTransaction(flow, self.services))
-
-            # Case 2: http_response HTML will be altered with a simple HTML page that informs the user that
-            #         the recording session has correctly been ended and provides him/her info about data recorded.
-            elif self.recording == "end_recording":
-                # TODO: here the code to manage the end of recording.
-                html = BeautifulSoup(self.EOS_webpage, 'html.parser')
-                self.recording = "off"
-                # put the proxy server in a "listening for JSON" state. (take a look to the protocol)
-                self.waiting_for_json = True
-
-            # We need to inject javascript code that will be employed from
-            # the browser to capture user actions (click, keyup, keydown, etc) before forwarding the reply .
-            # 02/03/21 (trying to not use Selenium to record user actions)
-
-            if self.action_recording_js != '':
-                # Inject a script tag containing the JavaScript.
-                container = html.head or html.body
-                if container:
-                    # Adding even an ID to the new tag to simply remove it from the records when writing the dataset.
-                    script = html.new_tag('script', type='text/javascript', id='wapt_dataset_collector_record')
-                    script.string = self.action_recording_js
-                    container.insert(0, script)
-                    flow.response.text = str(html)
-                    print('Successfully injected the `injected-javascript.js` script.')
+                # Uncomment to use the url as the name of the recorded http response.
+                # url_request = url_request.replace("/", "_")
+
+                # Instantiate session's attributes for the first time. If this response is not the first one
+                # that follows the request with "record=true" simply push the HTTPTransaction in the existing
+                # session.http_transaction list.
+                if client.session.task_name == "":
+                    # Only the head of the page is parsed, until </title>, to obtain the name of the task.
+                    with self.metrics.timer("title_parse"):
+                        title = extract_title(flow.response.content, flow.response.headers.get("content-type"))
+                    # Session class objects requires only url, task_name and start_time to be instantiated.
+                    client.session.task_name = title if title is not None else "Empty Task Name"
+                    client.session.start_time = self.__new_start_time()
+                    client.session.url = url_request
+
+                # Save current transaction into session.http_transactions (or in its capture log). The body of a
+                # teed response is not known yet: its declared size is counted.
+                streamed_body = flow.metadata.get(STREAMED_BODY)
+                transaction = HTTPTransaction(flow, flow.metadata.get(CLIENT_NAME), self.blob_store,
+                                              self.capture_policy, streamed_body)
+                if streamed_body is not None:
+                    try:
+                        response_bytes = int(flow.response.headers.get("content-length", "0"))
+                    except ValueError:
+                        response_bytes = 0
+                else:
+                    response_bytes = len(flow.response.content or b"")
+                captured_bytes = len(flow.request.content or b"") + response_bytes
+                client.session.add_transaction(transaction, captured_bytes)
+                self.metrics.increment("recorded_transactions")
+                self.metrics.increment("captured_bytes", captured_bytes)
+            elif not flow.metadata.get(STREAMED):
+                # (the streamed flows have already been counted in responseheaders)
+                self.metrics.increment("excluded_flows")
+
+        # The end of session page and the javascript are only added to the successful responses.
+        if flow.response.status_code != 200:
+            return
+
+        # Case 2: http_response HTML will be altered with a simple HTML page that informs the user that
+        #         the recording session has correctly been ended and provides him/her info about data recorded.
+        if client.recording == "end_recording":
+            # TODO: here the code to manage the end of recording.
+            flow.response.headers["content-type"] = "text/html; charset=utf-8"
+            flow.response.content = self.EOS_webpage.encode('utf-8')
+            client.recording = "off"
+            # put the client in a "listening for JSON" state. (take a look to the protocol)
+            client.waiting_for_json = True
+
+        # We need to inject javascript code that will be employed from
+        # the browser to capture user actions (click, keyup, keydown, etc) before forwarding the reply .
+        # 02/03/21 (trying to not use Selenium to record user actions)
+        # The injector checks the content type first: non html bodies (JSON, images, CSS) are forwarded
+        # untouched and html pages get the script spliced in without building a tree.
+        if self.injector is not None:
+            injection_started = time.perf_counter()
+            injected = self.injector.inject_response(flow.response)
+            self.metrics.observe("injection", time.perf_counter() - injection_started)
+            if injected:
+                self.metrics.increment("injected_pages")
+                log.debug('Successfully injected the `injected-javascript.js` script.')
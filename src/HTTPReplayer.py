@@ -0,0 +1,247 @@
+# Description: HTTPReplayer re-executes the HTTP layer of recorded sessions without a browser: the requests of every
+#              transaction are sent again (method, url, headers and body as recorded) with an asynchronous HTTP
+#              client, e.g. to regression test a new build of a benchmark or to regenerate its responses.
+#              Every session has its own cookie jar, so the cookies set by the server during the replay (the new
+#              session identifiers) are sent back as a browser would do; the requests of a session are sent in the
+#              recorded order, while many sessions are replayed at the same time.
+#              run() returns the report of the replay (latencies, throughput, errors, responses whose status code
+#              differs from the recorded one) and the outcome of every recording.
+# Notes:
+#           - aiohttp is an optional dependency, needed only by this tool: pip install aiohttp
+#           - target rewrites scheme, host and port of the recorded urls (e.g. "http://localhost:8080"), as Player
+#             does for the address of the benchmark container.
+#           - The recorded Cookie headers are not sent: the cookies come from the jar of the session. Bodies saved
+#             in the BlobStore are read from the blobs folder of the output folder that contains the recording.
+#           - A request whose body has been recorded truncated (see CapturePolicy) is not sent: its head and tail
+#             would be a different request. It is counted as "truncated" in the report.
+
+import asyncio
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# the recorded bodies (inline, base64, in the BlobStore) are turned back into bytes by body_bytes.
+from BlobStore import BLOB_FOLDER, BlobStore
+from CapturePolicy import body_bytes
+# open_recording reads a recording of any output format (see RecordingFormat.py).
+from RecordingFormat import open_recording
+
+# Headers that are not sent again: they describe the original connection, or they are computed by the client.
+DROPPED_HEADERS = {"connection", "keep-alive", "proxy-connection", "proxy-authorization", "te", "trailer",
+                   "transfer-encoding", "upgrade", "host", "content-length", "content-encoding", "cookie"}
+
+
+# Returns url with scheme, host and port replaced by the ones of target (None: url is not changed).
+def rewrite_url(url, target):
+    if not target:
+        return url
+    split_target = urlsplit(target if "//" in target else "//" + target)
+    split_url = urlsplit(url)
+    return urlunsplit((split_target.scheme or split_url.scheme, split_target.netloc, split_url.path,
+                       split_url.query, split_url.fragment))
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Latencies and counters of a replay.
+class ReplayStats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.requests = 0
+        self.errors = 0
+        # requests not sent because their body has been recorded truncated.
+        self.truncated = 0
+        self.status_mismatches = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, latency, status, expected_status, sent, received):
+        self.requests += 1
+        self.latencies.append(latency)
+        self.bytes_sent += sent
+        self.bytes_received += received
+        if expected_status is not None and status != expected_status:
+            self.status_mismatches += 1
+
+    def add_error(self):
+        self.requests += 1
+        self.errors += 1
+
+    def add_truncated(self):
+        self.truncated += 1
+
+    # Returns the counters and the latency distribution (milliseconds).
+    def summary(self):
+        latencies = sorted(self.latencies)
+        milliseconds = {name: (value * 1000 if value is not None else None) for name, value in (
+            ("mean", sum(latencies) / len(latencies) if latencies else None), ("p50", _percentile(latencies, 50)),
+            ("p90", _percentile(latencies, 90)), ("p99", _percentile(latencies, 99)),
+            ("max", latencies[-1] if latencies else None))}
+        return {"requests": self.requests, "errors": self.errors, "truncated": self.truncated,
+                "status_mismatches": self.status_mismatches,
+                "bytes_sent": self.bytes_sent, "bytes_received": self.bytes_received, "latency_ms": milliseconds}
+
+    # Returns the summary together with the throughput of a replay that lasted seconds.
+    def report(self, seconds):
+        report = self.summary()
+        report.update({"seconds": seconds, "requests_per_second": self.requests / seconds if seconds > 0 else 0.0})
+        return report
+
+
+class HTTPReplayer(object):
+
+    # concurrency is the maximum number of requests in flight (and of sessions replayed at the same time).
+    # With ordered=False the requests of a session are sent without waiting for the previous ones: they are read
+    # into a queue of at most concurrency transactions, emptied by concurrency senders (the memory used doesn't
+    # depend on the size of the recording).
+    def __init__(self, recordings, target=None, concurrency=16, ordered=True, timeout=30):
+        if aiohttp is None:
+            raise ImportError("aiohttp is needed to replay the requests: pip install aiohttp")
+        self.recordings = list(recordings)
+        self.target = target
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.timeout = timeout
+        self._stores = {}
+
+    # Replays every recording. Returns the report of the whole replay and the outcome of every recording.
+    def run(self):
+        return asyncio.run(self.__run())
+
+    async def __run(self):
+        stats = ReplayStats()
+        requests = asyncio.Semaphore(self.concurrency)
+        sessions = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=False)
+        try:
+            outcomes = await asyncio.gather(*(self.__replay_session(recording, connector, requests, sessions, stats)
+                                              for recording in self.recordings))
+        finally:
+            await connector.close()
+        return stats.report(time.perf_counter() - started), list(outcomes)
+
+    async def __replay_session(self, recording, connector, requests, sessions, stats):
+        session_stats = ReplayStats()
+        outcome = {"recording": recording, "error": None}
+        async with sessions:
+            # every session has its own cookies.
+            async with aiohttp.ClientSession(connector=connector, connector_owner=False,
+                                             cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             auto_decompress=True) as client:
+                all_stats = (stats, session_stats)
+                queue = None
+                senders = []
+                if not self.ordered:
+                    queue = asyncio.Queue(maxsize=self.concurrency)
+                    senders = [asyncio.ensure_future(self.__send_queued(client, recording, queue, requests, all_stats))
+                               for _ in range(self.concurrency)]
+                try:
+                    # the recorded responses are not needed, except their status code.
+                    reader = open_recording(recording, skip=("response.headers", "response.content"))
+                    try:
+                        for key, transaction in reader.transactions():
+                            if self.ordered:
+                                await self.__send(client, recording, transaction, requests, all_stats)
+                            # waits while the queue is full: the recording is read as fast as it is sent.
+                            elif not await self.__put(queue, transaction, senders):
+                                outcome["error"] = "the senders of the session have stopped"
+                                break
+                    finally:
+                        reader.close()
+                except (OSError, ValueError) as error:
+                    outcome["error"] = str(error)
+                finally:
+                    # every sender stops when it gets None, after the transactions queued before it.
+                    for _ in senders:
+                        if not await self.__put(queue, None, senders):
+                            break
+                    await asyncio.gather(*senders, return_exceptions=True)
+        outcome.update(session_stats.summary())
+        return outcome
+
+    # Sends the transactions of queue until it gets None.
+    async def __send_queued(self, client, recording, queue, requests, all_stats):
+        while True:
+            transaction = await queue.get()
+            if transaction is None:
+                return
+            try:
+                await self.__send(client, recording, transaction, requests, all_stats)
+            except Exception:
+                # e.g. a malformed transaction: a sender that stopped would leave its share of the queue unsent.
+                for stats in all_stats:
+                    stats.add_error()
+
+    # Puts item into queue, waiting while it is full. Returns False, without putting it, if every sender has stopped:
+    # nobody would empty the queue.
+    @staticmethod
+    async def __put(queue, item, senders):
+        try:
+            queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        put = asyncio.ensure_future(queue.put(item))
+        while not put.done():
+            running = [sender for sender in senders if not sender.done()]
+            if not running:
+                put.cancel()
+                return False
+            await asyncio.wait([put] + running, return_when=asyncio.FIRST_COMPLETED)
+        return True
+
+    async def __send(self, client, recording, transaction, requests, all_stats):
+        request = transaction.get("request", {})
+        method = request.get("method") or ("POST" if request.get("content") else "GET")
+        url = rewrite_url(transaction["url"], self.target)
+        headers = {name: value for name, value in request.get("headers", {}).items()
+                   if name.lower() not in DROPPED_HEADERS}
+        content = request.get("content")
+        if isinstance(content, dict) and content.get("truncated"):
+            # only the head and the tail of the body have been recorded.
+            for stats in all_stats:
+                stats.add_truncated()
+            return
+        try:
+            body = body_bytes(content, self.__store(recording)) if content else None
+        except (KeyError, ValueError):
+            # the body is in a BlobStore that is not available.
+            for stats in all_stats:
+                stats.add_error()
+            return
+        expected_status = transaction.get("response", {}).get("status_code")
+
+        async with requests:
+            started = time.perf_counter()
+            try:
+                async with client.request(method, url, headers=headers, data=body, allow_redirects=False) as response:
+                    received = len(await response.read())
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                for stats in all_stats:
+                    stats.add_error()
+                return
+            latency = time.perf_counter() - started
+        for stats in all_stats:
+            stats.add(latency, status, expected_status, len(body) if body else 0, received)
+
+    # Returns the BlobStore of the output folder that contains recording (out/<task>/<start time>/...), if any.
+    def __store(self, recording):
+        out_folder = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(recording))))
+        if out_folder not in self._stores:
+            blob_folder = os.path.join(out_folder, BLOB_FOLDER)
+            self._stores[out_folder] = BlobStore(blob_folder) if os.path.isdir(blob_folder) else None
+        return self._stores[out_folder]
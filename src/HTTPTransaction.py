@@ -17,7 +17,13 @@ import mitmproxy.net.http.url
 # to obtain name using gethostbyaddr
 import socket
 
+# CapturePolicy decides how the bodies are recorded (text, base64, truncated, spilled to a temporary file).
+from CapturePolicy import CapturePolicy, SpilledBody, StreamedBody
+
 class HTTPTransaction:
+    # the policy applied when HTTPLogger doesn't provide one.
+    default_policy = CapturePolicy()
+
     def __init__(self):
         # --------- REQUEST DATA ---------------
         self.req_headers: dict
@@ -33,13 +39,20 @@ class HTTPTransaction:
 
         # The following attribute will be employed by HTTPLogger when writing data on the output folder.
         self.time_intercepted = None
-    # services is the dict in the HTTPLogger constructor, it contains info about the host on the network.
-    def __init__(self, flow, services):
+    # client_name is the name of the client, as looked up by HTTPLogger when intercepting the request (None if it is
+    # not known: the IP address is used instead).
+    # blob_store (optional) is the BlobStore where the bodies are written: if given, the transaction only keeps a
+    # reference to them. capture_policy (optional) is the CapturePolicy applied to the bodies.
+    # response_body is the StreamedBody of a response that is streamed by the proxy. (see CapturePolicy.tee)
+    def __init__(self, flow, client_name, blob_store=None, capture_policy=None, response_body=None):
+        if capture_policy is None:
+            capture_policy = self.default_policy
 
         # --------- REQUEST DATA ---------------
-        # use .decode() on content to get the webcontent decoded. (mitmproxy saves it as Bytes)
+        self.req_method = flow.request.method
         self.req_headers = dict(flow.request.headers.items())
-        self.req_content = str(flow.request.content.decode())
+        self.req_content = capture_policy.capture(flow.request.content, flow.request.headers.get("content-type"),
+                                                  blob_store)
 
         """
             mitmproxy treats differently GET and POST requests. 
@@ -60,9 +73,14 @@ class HTTPTransaction:
             self.req_param = dict(flow.request.query)
 
         # --------- RESPONSE DATA ---------------
-        # use .decode() on content to get the webcontent decoded. (mitmproxy saves it as Bytes)
+        self.res_status_code = flow.response.status_code
         self.res_headers = dict(flow.response.headers.items())
-        self.res_content = str(flow.response.content.decode())
+        if response_body is not None:
+            # the body has not been received yet: it is being written to the disk while it is forwarded.
+            self.res_content = response_body
+        else:
+            self.res_content = capture_policy.capture(flow.response.content,
+                                                      flow.response.headers.get("content-type"), blob_store)
 
         # --------- OTHER FLOW DATA ---------------
         self.pretty_url = flow.request.pretty_url
@@ -74,21 +92,40 @@ class HTTPTransaction:
         # Further more, ip_address is still a tuple (look in connections.py) that has the same form of ClientConnection.
         self.client_ip = str(flow.client_conn.ip_address[0])
         self.client_port = str(flow.client_conn.ip_address[1])
-        # client name will always be already known to the interceptor (it queryes the DNS when intercepting the request)
-        self.client_name = services[self.client_ip]
+        # client name is looked up by the interceptor when intercepting the request: if the DNS has not answered yet
+        # it is the IP address itself.
+        self.client_name = client_name if client_name is not None else self.client_ip
+
+
+
 
+    # False while the body of the response is still being streamed.
+    def ready(self):
+        return not isinstance(self.res_content, StreamedBody) or self.res_content.ready()
 
+    # Removes the temporary files of the bodies spilled to disk. (to be called once the transaction has been saved)
+    def release(self):
+        for content in (self.req_content, self.res_content):
+            if isinstance(content, SpilledBody):
+                content.release()
 
+    # Bodies spilled to a temporary file are read back only when the transaction is serialized.
+    @staticmethod
+    def __record(content):
+        return content.to_record() if isinstance(content, SpilledBody) else content
 
     # Returns the serialized JSON of self.
     def get_dict(self):
         # Building an on-the-fly dictionary to make this object JSON serializable.
         dict_record = {
                         "url": self.pretty_url,
-                        "request": { "client": {"ip address": self.client_ip, "port": self.client_port,
+                        "request": { "method": self.req_method,
+                                     "client": {"ip address": self.client_ip, "port": self.client_port,
                                                 "name": self.client_name},
-                                     "headers": self.req_headers, "content": self.req_content, "parameters": self.req_param},
-                        "response": {"headers": self.res_headers, "content": self.res_content}
+                                     "headers": self.req_headers, "content": self.__record(self.req_content),
+                                     "parameters": self.req_param},
+                        "response": {"status_code": self.res_status_code, "headers": self.res_headers,
+                                     "content": self.__record(self.res_content)}
                      }
         # Passing the dictionary built on the fly because it is serializable.
         #return json.dumps(dict_record, indent=2)
@@ -0,0 +1,205 @@
+# Description: ScriptInjector splices the action recording javascript into the html responses forwarded to the
+#              pentester. The insertion point (right after the opening <head> tag, or the opening <body> tag when
+#              the page has no head) is found with a byte-level scan of the response body, so that no tree has to be
+#              built and the rest of the document is forwarded exactly as the webserver produced it.
+# Notes:
+#           - BeautifulSoup is still employed, but only as a fallback for markup that the byte-level scan cannot
+#             safely handle (e.g. an opening tag that could be hidden inside an html comment, or a charset that
+#             is not ASCII compatible).
+#           - The same pages (menus, index pages, login forms) are served again and again during a pentest: the
+#             injected bodies are kept in a bounded LRU cache (InjectionCache) keyed by the digest of the original
+#             body, its charset and the version of the script, so a repeated page costs a hash and a lookup.
+
+# Regular expressions used to find the opening tags directly on the bytes of the response.
+import re
+
+# Used to obtain the canonical name of the charset declared by the webserver.
+import codecs
+
+# The cache of the injected bodies is keyed by digest and shared by the threads of the proxy.
+import collections
+import hashlib
+import threading
+
+# Beatifulsoup is only used to handle the malformed markup.
+from bs4 import BeautifulSoup
+
+# The id given to the injected script tag: it is used to simply remove the tag from the records when writing the
+# dataset.
+SCRIPT_ID = 'wapt_dataset_collector_record'
+
+# Content types that are treated as html pages (everything else is forwarded untouched).
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Opening tags where the script can be inserted, in order of preference. The pattern matches '<head>' or
+# '<head ...attributes...>' but not '<header>'.
+_HEAD_TAG = re.compile(rb'<head(?:\s[^>]*)?>', re.IGNORECASE)
+_BODY_TAG = re.compile(rb'<body(?:\s[^>]*)?>', re.IGNORECASE)
+_COMMENT_START = b'<!--'
+
+_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def is_html(content_type):
+    # A response without content-type may still be a page (the script was always injected into it): it is
+    # injected only if an opening head or body tag is found anyway.
+    if not content_type:
+        return True
+    return content_type.split(';', 1)[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+def charset_of(content_type, default='utf-8'):
+    # Extract the charset parameter from the content-type header, returning its canonical python codec name.
+    if content_type:
+        match = _CHARSET.search(content_type)
+        if match is not None:
+            try:
+                return codecs.lookup(match.group(1)).name
+            except LookupError:
+                pass
+    return default
+
+
+def _is_ascii_compatible(charset):
+    # The byte-level scan looks for ASCII tag names, so it only works on ASCII supersets (utf-8, latin-1, ...).
+    try:
+        return 'a'.encode(charset) == b'a' and '<'.encode(charset) == b'<'
+    except (LookupError, UnicodeError):
+        return False
+
+
+# Bounded LRU cache of the injected bodies. Its size is limited both in entries and in bytes (of the injected
+# bodies); bodies larger than max_body_size are never cached.
+class InjectionCache(object):
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, max_body_size=1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_body_size = max_body_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(body, charset, version):
+        return hashlib.blake2b(body, digest_size=20).digest(), charset, version
+
+    def cacheable(self, body):
+        return self.max_entries > 0 and len(body) <= self.max_body_size
+
+    # Returns (True, injected body) if key is in the cache (the injected body is None for a page that can't be
+    # injected), (False, None) otherwise.
+    def get(self, key):
+        with self._lock:
+            try:
+                injected = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, injected
+
+    def put(self, key, injected):
+        size = len(injected) if injected is not None else 0
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = injected
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.bytes > self.max_bytes and len(self._entries) > 1):
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted) if evicted is not None else 0
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries),
+                "bytes": self.bytes}
+
+
+class ScriptInjector(object):
+
+    # cache is the InjectionCache of the injected bodies (None: no cache).
+    def __init__(self, script, script_id=SCRIPT_ID, cache=None):
+        self.script = script
+        self.script_id = script_id
+        # the tag is built once: every injection will only need to encode it with the charset of the page.
+        self.script_tag = '<script type="text/javascript" id="' + script_id + '">' + script + '</script>'
+        self._encoded_tags = {}
+        # the version of the script is part of the keys of the cache: a new script never gets the old bodies.
+        self.version = hashlib.blake2b(self.script_tag.encode('utf-8'), digest_size=8).hexdigest()
+        self.cache = cache
+
+    def _encoded_tag(self, charset):
+        try:
+            return self._encoded_tags[charset]
+        except KeyError:
+            tag = self._encoded_tags[charset] = self.script_tag.encode(charset, 'xmlcharrefreplace')
+            return tag
+
+    # Returns the offset right after the opening head (or body) tag, or None if the scan can't find it safely.
+    @staticmethod
+    def find_insertion_point(body):
+        for pattern in (_HEAD_TAG, _BODY_TAG):
+            match = pattern.search(body)
+            if match is not None:
+                # An html comment opened before the tag could hide it (e.g. "<!-- <head> -->"): in this case the
+                # markup is handed to BeautifulSoup that knows how to deal with it.
+                if body.find(_COMMENT_START, 0, match.start()) != -1:
+                    return None
+                return match.end()
+        return None
+
+    # Returns the body with the script spliced in, or None if the body can't be injected (no head nor body).
+    def inject(self, body, charset='utf-8'):
+        if self.cache is None or not self.cache.cacheable(body):
+            return self._inject(body, charset)
+        key = self.cache.key(body, charset, self.version)
+        found, injected = self.cache.get(key)
+        if not found:
+            injected = self._inject(body, charset)
+            self.cache.put(key, injected)
+        return injected
+
+    def _inject(self, body, charset):
+        if _is_ascii_compatible(charset):
+            offset = self.find_insertion_point(body)
+            if offset is not None:
+                return body[:offset] + self._encoded_tag(charset) + body[offset:]
+        return self.inject_fallback(body, charset)
+
+    # Slow path: the whole document is parsed and re-serialized as it was done before the byte-level scan.
+    def inject_fallback(self, body, charset='utf-8'):
+        html = BeautifulSoup(body.decode(charset, 'replace'), 'html.parser')
+        container = html.head or html.body
+        if container is None:
+            return None
+        script = html.new_tag('script', type='text/javascript', id=self.script_id)
+        script.string = self.script
+        container.insert(0, script)
+        return str(html).encode(charset, 'xmlcharrefreplace')
+
+    # Injects the script into the mitmproxy response. Returns True if the response has been modified.
+    def inject_response(self, response):
+        content_type = response.headers.get('content-type', '')
+        if not is_html(content_type):
+            return False
+        body = response.content
+        if not body:
+            return False
+        injected = self.inject(body, charset_of(content_type))
+        if injected is None:
+            return False
+        response.content = injected
+        return True
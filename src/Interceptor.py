@@ -24,9 +24,48 @@ from mitmproxy.tools.dump import DumpMaster
 # Used to read command line arguments with argv.
 import sys
 
+# re.error is raised by the capture rules with a malformed regular expression.
+import re
+
 # Importing the custom addon used to save http requests/responses as JSON.
 from HTTPLogger import *
 
+# The resolver used by the addon to obtain the names of the clients without blocking the proxy.
+from Resolver import ReverseResolver
+
+# The content-addressed store of the recorded bodies.
+import BlobStore
+
+# The policy that limits the size of the recorded bodies.
+from CapturePolicy import CapturePolicy
+
+# The catalog (SQLite index) of the recorded sessions.
+from DatasetCatalog import open_catalog
+
+# The limits of the messages recorded for every WebSocket connection.
+from WebSocketCapture import WebSocketLimits
+
+# The format of the saved recordings.
+from RecordingFormat import RecordingFormat, ENCODINGS, COMPRESSIONS
+
+# The detection of the near-duplicate transactions of the saved sessions.
+from Deduplication import Deduplicator, MODES as DEDUP_MODES, THRESHOLD as DEDUP_THRESHOLD
+
+# The rules that decide which flows are recorded.
+from CaptureFilter import CaptureFilter, load_rules
+
+# The runtime metrics of the addon, served on a local endpoint and/or written in a stats file.
+from Metrics import MetricsServer, StatsFileWriter
+
+# The sharded mode (-workers N): the workers, their shards of out/ and the distributor of the connections.
+import os
+import signal
+import Session as session_module
+from Sharding import ShardSupervisor, ClientAddressTable, ClientAddressAddon, shard_folder
+
+# The messages of the addon are logged: -log_level decides which ones are shown.
+import logging
+
 # Using requests in order to obtain the JSON string describing the network built by host's Docker compose.
 # The request will only be possible if the host's docker socket is shared with the container that
 # runs this script.
@@ -54,6 +93,8 @@ if __name__ == "__main__":
     # interception. If this script will be executed in container mode, this object will be replaced by one
     # instance that contains also the dictionary with the info about other containers on the same net.
     http_logger_addon = None
+    # exporters of the metrics (MetricsServer, StatsFileWriter), stopped when the interceptor shuts down.
+    metrics_exporters = []
     ################### END MITMPROXY AND BENCHMARK DEFAULT SETTINGS VARIABLES #####################
 
     # Reading command line arguments (if there any)
@@ -73,8 +114,152 @@ if __name__ == "__main__":
                                 help="IP Address of the benchmark")
         arg_parser.add_argument("-bp", "-benchmark_port", default=benchmark_port,
                                 help="the port that the benchmark webserver will use to receive requests")
+        arg_parser.add_argument("-dns_timeout", "--dns_timeout", type=float, default=2.0,
+                                help="seconds after which a reverse DNS lookup of a client is considered failed")
+        arg_parser.add_argument("-dns_ttl", "--dns_ttl", type=float, default=300.0,
+                                help="seconds the name of a client is cached before being looked up again")
+        arg_parser.add_argument("-dns_negative_ttl", "--dns_negative_ttl", type=float, default=60.0,
+                                help="seconds a failed reverse DNS lookup is cached before being retried")
+        arg_parser.add_argument("-client_key", "--client_key", choices=["cookie", "ip"], default="cookie",
+                                help="how the pentesters recording at the same time are told apart: by a cookie "
+                                     + "set by the interceptor (default) or by their IP address")
+        arg_parser.add_argument("-blob_store", "--blob_store", choices=["zstd", "gzip"], default=None,
+                                help="write the bodies once, compressed with the given codec, in the content-"
+                                     + "addressed store out/blobs/ and keep only their digest in the recordings")
+        arg_parser.add_argument("-max_body_size", "--max_body_size", type=int, default=None,
+                                help="maximum number of bytes recorded for a body whose content type has no "
+                                     + "specific limit: larger bodies keep only their head and tail")
+        arg_parser.add_argument("-body_limit", "--body_limit", action="append", default=[],
+                                metavar="CONTENT_TYPE=BYTES",
+                                help="maximum number of bytes recorded for the bodies whose content type starts "
+                                     + "with CONTENT_TYPE (e.g. image/=65536). Can be repeated.")
+        arg_parser.add_argument("-spill_threshold", "--spill_threshold", type=int, default=256 * 1024,
+                                help="bodies larger than this (bytes) wait in a temporary file until the session "
+                                     + "is saved instead of staying in memory")
+        arg_parser.add_argument("-stream_threshold", "--stream_threshold", type=int, default=256 * 1024,
+                                help="recorded responses larger than this (bytes) that are not altered by the proxy "
+                                     + "are streamed to the client while being written to the disk")
+        arg_parser.add_argument("-no_catalog", "--no_catalog", action="store_true",
+                                help="don't index the saved sessions in the catalog out/catalog.sqlite")
+        arg_parser.add_argument("-streaming", "--streaming", action="store_true",
+                                help="write every recorded transaction on the disk as soon as it is captured "
+                                     + "instead of keeping the whole session in memory")
+        arg_parser.add_argument("-injection_cache_size", "--injection_cache_size", type=int, default=256,
+                                help="number of injected pages kept in memory to be forwarded again without being "
+                                     + "injected (0 disables the cache)")
+        arg_parser.add_argument("-output_format", "--output_format", choices=ENCODINGS, default="json",
+                                help="format of the saved recordings: pretty printed JSON (json), JSON without "
+                                     + "whitespaces (compact, faster with orjson installed) or msgpack")
+        arg_parser.add_argument("-compression", "--compression", choices=COMPRESSIONS, default=None,
+                                help="compress the saved recordings")
+        arg_parser.add_argument("-no_websockets", "--no_websockets", action="store_true",
+                                help="don't record the messages of the WebSocket connections")
+        arg_parser.add_argument("-websocket_buffer", "--websocket_buffer", type=int, default=4 * 1024 * 1024,
+                                help="bytes of messages kept in memory for every WebSocket connection (the oldest "
+                                     + "are dropped, or written to the disk with -streaming)")
+        arg_parser.add_argument("-websocket_max_message", "--websocket_max_message", type=int, default=64 * 1024,
+                                help="bytes recorded for a single WebSocket message (head and tail)")
+        arg_parser.add_argument("-capture_rules", "--capture_rules", default=None,
+                                help="JSON file with the rules that decide which flows are recorded (see "
+                                     + "CaptureFilter.py); by default the successful responses that are not static "
+                                     + "resources are recorded")
+        arg_parser.add_argument("-dedup", "--dedup", choices=DEDUP_MODES, default=None,
+                                help="flag (or drop, if they have no actions) the transactions of a session that are "
+                                     + "near-duplicates of a previous one (see Deduplication.py)")
+        arg_parser.add_argument("-dedup_threshold", "--dedup_threshold", type=float, default=DEDUP_THRESHOLD,
+                                help="estimated similarity above which a transaction is a near-duplicate")
+        arg_parser.add_argument("-log_level", "--log_level", default="info",
+                                choices=["debug", "info", "warning", "error"],
+                                help="level of the messages printed by the interceptor (debug shows a message for "
+                                     + "every injected page)")
+        arg_parser.add_argument("-metrics_port", "--metrics_port", type=int, default=None,
+                                help="serve the runtime metrics as JSON on http://127.0.0.1:PORT/metrics")
+        arg_parser.add_argument("-stats_file", "--stats_file", default=None,
+                                help="file where the runtime metrics are periodically written (JSON)")
+        arg_parser.add_argument("-stats_interval", "--stats_interval", type=float, default=10.0,
+                                help="seconds between two writes of the stats file")
+        arg_parser.add_argument("-workers", "--workers", type=int, default=1,
+                                help="number of interceptor processes (see Sharding.py): the connections of a "
+                                     + "client always go to the same one, and the sessions saved by each of them "
+                                     + "are merged in out/ when the interceptor stops")
+        arg_parser.add_argument("-worker_port", "--worker_port", type=int, default=None,
+                                help="local port of the first worker (the others use the next ones); by default "
+                                     + "the one after the proxy port")
+        # set by the sharded interceptor on the command line of its workers.
+        arg_parser.add_argument("-shard", type=int, default=None, help=argparse.SUPPRESS)
+        arg_parser.add_argument("-shard_table", default=None, help=argparse.SUPPRESS)
         args = arg_parser.parse_args()
 
+        logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+        if args.workers > 1:
+            # this process only distributes the connections: each worker is this script with the same arguments,
+            # listening on a local port and saving its sessions in its own shard.
+            listen_host = socket.gethostbyname('interceptor') if args.mode == 'container' else args.ph
+            first_port = args.worker_port if args.worker_port is not None else int(args.pp) + 1
+
+            def worker_command(n, port, table_name):
+                command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+                    "-workers", "1", "-shard", str(n), "-shard_table", table_name, "-pp", str(port)]
+                # every worker has its own metrics.
+                if args.metrics_port is not None:
+                    command += ["-metrics_port", str(args.metrics_port + 1 + n)]
+                if args.stats_file is not None:
+                    command += ["-stats_file", args.stats_file + "." + str(n)]
+                return command
+
+            catalog = open_catalog(OUT_FOLDER) if not args.no_catalog else None
+            ShardSupervisor(worker_command, args.workers, listen_host, int(args.pp), first_port, OUT_FOLDER,
+                            catalog).run()
+            sys.exit()
+
+        if args.shard is not None:
+            # a worker: its sessions (and blobs) are saved in its shard, that is indexed by the catalog of out/
+            # when the shards are merged.
+            OUT_FOLDER = shard_folder(OUT_FOLDER, args.shard)
+            session_module.OUT_FOLDER = OUT_FOLDER
+            args.no_catalog = True
+            # the workers are stopped with SIGINT, even if the interceptor has been started with SIGINT ignored
+            # (e.g. in background).
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        # a codec whose package is missing stops the interceptor before the proxy starts.
+        try:
+            blob_store = BlobStore.open_store(OUT_FOLDER, args.blob_store) if args.blob_store is not None else None
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+
+        body_limits = {}
+        if args.max_body_size is not None:
+            body_limits[""] = args.max_body_size
+        for body_limit in args.body_limit:
+            content_type, _, size = body_limit.rpartition("=")
+            body_limits[content_type.strip().lower()] = int(size)
+        capture_policy = CapturePolicy(body_limits, args.spill_threshold, stream_threshold=args.stream_threshold)
+        catalog = open_catalog(OUT_FOLDER) if not args.no_catalog else None
+
+        websocket_limits = WebSocketLimits(buffer_size=args.websocket_buffer,
+                                           max_message_size=args.websocket_max_message)
+
+        try:
+            recording_format = RecordingFormat(args.output_format, args.compression)
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+
+        deduplicator = Deduplicator(args.dedup, args.dedup_threshold, blob_store) if args.dedup is not None else None
+
+        # the rules are compiled once, here: a malformed file stops the interceptor before the proxy starts.
+        capture_filter = None
+        if args.capture_rules is not None:
+            try:
+                capture_filter = CaptureFilter(load_rules(args.capture_rules))
+            except (OSError, ValueError, TypeError, AttributeError, re.error) as error:
+                print("Could not load the capture rules from", args.capture_rules, "-", error)
+                sys.exit(1)
+
         # When executed as a Docker container it'll perform a quick check to discover if the 'benchmark'
         # container has been correctly executed. (here we perform an additional check to ensure that
         # current container has been named 'interceptor')
@@ -96,19 +281,43 @@ if __name__ == "__main__":
                 print("docker-compose.yml doesn't define any container named 'interceptor'! Define it and retry!\n")
                 raise gai_error
 
-            # construct the addon instance with the dictionary initially composed only by the addresses of
+            # construct the addon instance with the resolver initially composed only by the addresses of
             # benchmark and interceptor itself.
-            http_logger_addon = HTTPLogger(containers, javascript_path, endofsession_path)
+            resolver = ReverseResolver(containers, ttl=args.dns_ttl, negative_ttl=args.dns_negative_ttl,
+                                       timeout=args.dns_timeout)
+            http_logger_addon = HTTPLogger(resolver, javascript_path, endofsession_path, args.streaming,
+                                           args.client_key, blob_store, capture_policy,
+                                           catalog, injection_cache_size=args.injection_cache_size,
+                                           capture_filter=capture_filter, recording_format=recording_format,
+                                           capture_websockets=not args.no_websockets,
+                                           websocket_limits=websocket_limits, deduplicator=deduplicator)
         else:
             # If this code will not be executed as a docker container simply build an HTTPLogger without containers.
-            http_logger_addon = HTTPLogger(None, javascript_path, endofsession_path)
+            resolver = ReverseResolver(None, ttl=args.dns_ttl, negative_ttl=args.dns_negative_ttl,
+                                       timeout=args.dns_timeout)
+            http_logger_addon = HTTPLogger(resolver, javascript_path, endofsession_path, args.streaming,
+                                           args.client_key, blob_store, capture_policy,
+                                           catalog, injection_cache_size=args.injection_cache_size,
+                                           capture_filter=capture_filter, recording_format=recording_format,
+                                           capture_websockets=not args.no_websockets,
+                                           websocket_limits=websocket_limits, deduplicator=deduplicator)
             proxy_host = args.ph
             benchmark_host = args.bh
 
+        if args.metrics_port is not None:
+            metrics_exporters.append(MetricsServer(http_logger_addon.metrics, args.metrics_port))
+            print('Metrics available on http://127.0.0.1:' + str(args.metrics_port) + '/metrics')
+        if args.stats_file is not None:
+            metrics_exporters.append(StatsFileWriter(http_logger_addon.metrics, args.stats_file,
+                                                     args.stats_interval))
+
         # benchmark and proxy ports could change even if executed as a docker container (DVWA runs on port 80,
         # Wavsep runs on port 8080).
         proxy_port = args.pp
         benchmark_port = args.bp
+        if args.shard is not None:
+            # the connections of a worker come from the distributor only.
+            proxy_host = '127.0.0.1'
         #else:
         #    print("Wrong syntax detected. Running the script with default parameters...")
 
@@ -121,6 +330,9 @@ if __name__ == "__main__":
     m = DumpMaster(options, with_termlog=True, with_dumper=False)
     config = ProxyConfig(options)
     m.server = ProxyServer(config)
+    # a worker of the sharded interceptor restores the address of the clients before the other addons see them.
+    if cmd_arg > 1 and args.shard is not None:
+        m.addons.add(ClientAddressAddon(ClientAddressTable(args.shard_table)))
     # Add an HTTPInterceptor instance as an addon for mitmproxy.
     m.addons.add(http_logger_addon)
 
@@ -130,4 +342,10 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print('KeyboardInterrupt received, shutting down mitmproxy.')
         m.shutdown()
-        print('mitmproxy has been shutted down.')
\ No newline at end of file
+        print('mitmproxy has been shutted down.')
+        # the sessions that have been ended but not yet written must not be lost.
+        print('Saving', http_logger_addon.persistence.depth, 'pending session(s)...')
+        http_logger_addon.persistence.shutdown()
+        print('All the sessions have been saved.')
+        for exporter in metrics_exporters:
+            exporter.shutdown()
\ No newline at end of file
@@ -0,0 +1,185 @@
+# Description: Metrics collects the runtime measures of the interceptor: counters (flows, captured bytes, injected
+#              pages, ...), latency histograms (request and response hooks, injection, title parsing) and gauges,
+#              i.e. values read when a snapshot is taken (DNS cache hit rate, sessions waiting to be saved, in-memory
+#              transactions, ...). A snapshot can be served by MetricsServer on a local HTTP endpoint or written
+#              periodically as a JSON file by StatsFileWriter.
+# Notes:
+#           - Histograms have fixed buckets (milliseconds): observing a value costs a bisection and a lock, there is
+#             no list of samples growing with the traffic. Percentiles are estimated from the buckets.
+#           - Rates (e.g. flows per second) are computed over the last RATE_WINDOW seconds.
+
+import bisect
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (milliseconds) of the buckets of the latency histograms.
+LATENCY_BUCKETS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Seconds over which the rates of the counters are computed.
+RATE_WINDOW = 60.0
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        # the last bucket counts the values larger than every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # Returns the upper bound of the bucket that contains the percentile (the maximum for the last bucket).
+    def percentile(self, percent):
+        if self.count == 0:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[n], self.max) if n < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        buckets = {"<=" + str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets[">" + str(self.bounds[-1])] = self.counts[-1]
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else None,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "max": self.max, "buckets": buckets}
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = collections.defaultdict(int)
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        # (time, counters) taken by the snapshots, to compute the rates.
+        self._samples = collections.deque()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    # Records a duration (seconds) in the histogram name, in milliseconds.
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds * 1000)
+
+    # with metrics.timer("name"): ... records the time spent in the block.
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    # Registers a gauge: function is called (without arguments) every time a snapshot is taken.
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+            # the oldest sample within the window is the reference for the rates.
+            self._samples.append((now, counters))
+            while len(self._samples) > 1 and now - self._samples[1][0] >= RATE_WINDOW:
+                self._samples.popleft()
+            reference_time, reference = self._samples[0]
+        if now - reference_time < 1:
+            reference_time, reference = self.started, {}
+        elapsed = max(now - reference_time, 1e-9)
+        rates = {name: (value - reference.get(name, 0)) / elapsed for name, value in counters.items()}
+
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception as error:
+                gauges[name] = "error: " + str(error)
+        return {"uptime_seconds": now - self.started, "counters": counters, "rates_per_second": rates,
+                "latency_ms": histograms, "gauges": gauges}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.metrics.snapshot(), indent=2).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# Serves the snapshot of metrics as JSON on http://host:port/metrics.
+class MetricsServer(object):
+
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.metrics = metrics
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Writes the snapshot of metrics in path every interval seconds (and once more when it is stopped).
+class StatsFileWriter(object):
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = str(path)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='StatsFileWriter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    # the file is replaced atomically: a reader never sees a partial snapshot.
+    def write(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".stats-")
+        with os.fdopen(fd, "w") as stream:
+            json.dump(self.metrics.snapshot(), stream, indent=2)
+        os.replace(temp_path, self.path)
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
@@ -0,0 +1,92 @@
+# Description: PersistenceWorker saves the finished sessions on the disk from a background thread. HTTPLogger hands
+#              it a snapshot of the session (see Session.detach) as soon as the end-of-session JSON arrives, so that
+#              building and writing the output never runs inside the mitmproxy event loop.
+# Notes:
+#           The queue is bounded, but submit() never waits for a free slot: it is called in the mitmproxy event loop.
+#           If the disk can't keep up with the sessions that are being ended, the ones that don't fit in the queue
+#           are kept in an overflow list, saved by the worker as well, and counted (overflowed) and logged so that
+#           a too small queue or a too slow disk can be noticed.
+
+import collections
+import queue
+import threading
+
+# Used to report the errors of the worker thread without stopping it.
+import traceback
+
+# Default maximum number of sessions waiting to be saved.
+QUEUE_SIZE = 16
+
+
+class PersistenceWorker(object):
+
+    def __init__(self, max_queue=QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_queue)
+        # sessions submitted while the queue was full (deque: appended and popped from different threads).
+        self._overflow = collections.deque()
+        # counters, useful to monitor the worker.
+        self.saved = 0
+        self.failed = 0
+        self.overflowed = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='PersistenceWorker', daemon=True)
+        self._thread.start()
+
+    # Number of sessions waiting to be saved (the one being saved included).
+    @property
+    def depth(self):
+        return self._queue.unfinished_tasks + len(self._overflow)
+
+    # Schedules the save of session. The worker becomes its owner: the caller must not use it anymore.
+    def submit(self, session):
+        if self._stopped:
+            # the worker has already been shut down: the session is saved right away rather than lost.
+            self._save(session)
+        else:
+            try:
+                self._queue.put_nowait(session)
+            except queue.Full:
+                # the queue holds the sessions the worker has still to save: it will get to the overflow after one
+                # of them.
+                self._overflow.append(session)
+                self.overflowed += 1
+                print("The persistence queue is full:", len(self._overflow), "session(s) waiting in overflow")
+
+    def _save(self, session):
+        try:
+            session.save_session()
+            self.saved += 1
+        except Exception:
+            self.failed += 1
+            print("Could not save the session", session.task_name, "started at", session.start_time)
+            traceback.print_exc()
+
+    def _save_overflow(self):
+        while self._overflow:
+            self._save(self._overflow.popleft())
+
+    def _run(self):
+        while True:
+            session = self._queue.get()
+            try:
+                # None is the sentinel sent by shutdown().
+                if session is None:
+                    self._save_overflow()
+                    return
+                self._save(session)
+                # saved before task_done(), so that flush() waits for them too.
+                self._save_overflow()
+            finally:
+                self._queue.task_done()
+
+    # Waits until every submitted session has been saved.
+    def flush(self):
+        self._queue.join()
+
+    # Saves the pending sessions and stops the worker thread. It can be safely called more than once.
+    def shutdown(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
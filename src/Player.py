@@ -15,18 +15,57 @@
 # importing webdriver from selenium
 from selenium import webdriver
 import chromedriver_binary
-import sys
 from selenium.webdriver.support.events import EventFiringWebDriver, AbstractEventListener
-import json
 from selenium.webdriver.common.by import By
 
-import sys
-import json
 import time
 from selenium import webdriver
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 import re
+# open_recording reads a recording of any output format (see RecordingFormat.py).
+from RecordingFormat import open_recording
+from urllib.parse import urlsplit
+from selenium.common.exceptions import WebDriverException
+
+
+# Returns the origin (scheme://host[:port]) of url.
+def origin_of(url):
+    split_url = urlsplit(url)
+    return split_url.scheme + "://" + split_url.netloc
+
+
+# Returns the options of the Chrome instances that replay the recordings.
+# debugging_port and profile_dir allow many Chrome instances to run on the same host: every instance must use a free
+# port and its own user data directory. (see ReplayFarm.py)
+def chrome_options(window_width, window_height, debugging_port=8320, profile_dir=None, headless=False):
+    # instantiating webdriver and setting options.
+    options = webdriver.ChromeOptions()
+    # set window size as maximum size
+    # options.add_argument('start-maximized')
+    # set window size as the same used during the recording.
+    options.add_argument("--window-size=" + str(window_width) + "," + str(window_height))
+    # set window position centered.
+    options.add_argument("--window-position=0,0")
+
+    # Default settings to avoid crashes during the chromedriver execution. (source: stackoverflow)
+    # disabling infobars
+    options.add_argument("disable-infobars")
+    # workaround to avoid "selenium.common.exceptions.WebDriverException: DevToolsActivePort file doesn't exist"
+    options.add_argument("--remote-debugging-port=" + str(debugging_port))
+    # a profile that is not shared with other Chrome instances.
+    if profile_dir is not None:
+        options.add_argument("--user-data-dir=" + profile_dir)
+    if headless:
+        options.add_argument("--headless")
+    # disabling extensions
+    options.add_argument("--disable-extensions")
+    # overcome limited resource problems
+    options.add_argument("--disable-dev-shm-usage")
+    # This is a workaround to avoid crashes: it bypasses OS security model.
+    options.add_argument("--no-sandbox")
+
+    return options
 
 
 class Player(object):
@@ -39,46 +78,61 @@ class Player(object):
     # keyValues['CapsLock'] = not found
     # keyValues['PrintScreen'] = not found
 
-    def __init__(self, rec_filename):
+    # the page is considered ready when it has been loaded and no resource has been fetched for NETWORK_IDLE seconds.
+    NETWORK_IDLE = 0.5
+    READINESS_POLL = 0.1
+    # state of the page used by __wait_until_ready: url, document.readyState and number of fetched resources.
+    # (performance entries are added when a fetch completes, so the number changes while the network is busy)
+    PAGE_STATE_SCRIPT = "return [document.URL, document.readyState, performance.getEntriesByType('resource').length];"
+
+    # debugging_port, profile_dir and headless are the options of the Chrome started by the player (see chrome_options).
+    # The pauses between the actions can be shortened: speed divides the recorded pauses (speed=10 replays a
+    # 40 minutes session in 4 minutes), max_pause (seconds) caps every pause. With event_driven the recorded pauses
+    # are ignored: the actions are performed as soon as the page is ready (loaded and with the network idle), the
+    # replay waits for it again only after the actions that can navigate or send requests (see __may_navigate).
+    # ready_timeout is the maximum time (seconds) waited for the page to be ready.
+    # driver is a running webdriver to use instead of starting a new Chrome (see BrowserPool.py).
+    def __init__(self, rec_filename, debugging_port=8320, profile_dir=None, headless=False, speed=1.0,
+                 max_pause=None, event_driven=False, ready_timeout=30, driver=None):
         # using time_elapsed to execute actions at the same time of the original recording: time is expressed in ms.
         self.time_elapsed = 0
+        if speed <= 0:
+            raise ValueError("speed must be greater than 0")
+        self.speed = speed
+        self.max_pause = max_pause
+        self.event_driven = event_driven
+        self.ready_timeout = ready_timeout
 
-        self.session = {}
-        rec_file = None
         # proceed only if -recording is not null, a recording to be reproduced must be provided.
+        # The transactions are read one at a time during the replay, without their requests and responses (bodies
+        # included) that are not needed: the replay starts immediately even for huge recordings.
+        # A recording that can't be read raises ValueError: the caller (replay.py or a worker of ReplayFarm) reports it.
+        try:
+            self.recording = open_recording(rec_filename, skip=("request", "response"))
+        except (OSError, ValueError) as exception:
+            raise ValueError("Could not open/read file: " + str(rec_filename) + " (" + str(exception) + ")") \
+                from exception
+
+        window_width = self.recording.header['window_width']
+        window_height = self.recording.header['window_height']
+        # a driver lent by a BrowserPool is already running: only its window has to be resized as during the
+        # recording. It is not quit at the end of the replay, its owner is the pool.
+        self.own_driver = driver is None
         try:
-            rec_file = open(rec_filename, 'r')
-        except OSError:
-            print("Could not open/read file:", rec_file)
-            sys.exit()
-
-        with rec_file:
-            # obtaining the json file as a dictionary.
-            self.session = json.load(rec_file)
-
-        # instantiating webdriver and setting options.
-        chrome_options = webdriver.ChromeOptions()
-        # set window size as maximum size
-        # chrome_options.add_argument('start-maximized')
-        # set window size as the same used during the recording.
-        chrome_options.add_argument("--window-size=" + self.session.pop('window_width') + ","
-                                    + self.session.pop('window_height'))
-        # set window position centered.
-        chrome_options.add_argument("--window-position=0,0")
-
-        # Default settings to avoid crashes during the chromedriver execution. (source: stackoverflow)
-        # disabling infobars
-        chrome_options.add_argument("disable-infobars")
-        # workaround to avoid "selenium.common.exceptions.WebDriverException: DevToolsActivePort file doesn't exist"
-        chrome_options.add_argument("--remote-debugging-port=8320")
-        # disabling extensions
-        chrome_options.add_argument("--disable-extensions")
-        # overcome limited resource problems
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        # This is a workaround to avoid crashes: it bypasses OS security model.
-        chrome_options.add_argument("--no-sandbox")
-
-        self.driver = webdriver.Chrome(options=chrome_options)
+            if driver is None:
+                driver = webdriver.Chrome(options=chrome_options(window_width, window_height, debugging_port,
+                                                                 profile_dir, headless))
+            elif str(window_width).isdigit() and str(window_height).isdigit():
+                driver.set_window_size(int(window_width), int(window_height))
+            else:
+                # the recording has no window dimension ("MAX").
+                driver.maximize_window()
+        except Exception:
+            self.recording.close()
+            raise
+        self.driver = driver
+        # origins of the visited pages, their storage is cleared when a pooled driver is reset.
+        self.visited_origins = set()
         self.action_chain = None
 
     # this method gets as input parameter a dict called "action" and selects the correct action to add to the
@@ -87,7 +141,9 @@ class Player(object):
         # since the actions are not performed one after the other immediately we need to consider the timing of each
         # action.
         ms_to_wait = action["time"] - self.time_elapsed
-        self.action_chain.pause(ms_to_wait / 1000)
+        seconds_to_wait = self.__pause_for(ms_to_wait)
+        if seconds_to_wait > 0:
+            self.action_chain.pause(seconds_to_wait)
         self.time_elapsed = action["time"]
 
         if action["action"]["type"] == "keydown" or action["action"]["type"] == "keyup":
@@ -113,18 +169,68 @@ class Player(object):
             if action["action"]["x"] != 0 and action["action"]["y"] != 0:
                 self.action_chain.move_by_offset(-action["action"]["x"], -action["action"]["y"])
 
+    # returns True if action can make the page navigate or send requests (clicks and Enter): in event driven mode the
+    # replay waits for the page to be ready only after them, the keystrokes in between are performed back to back.
+    @staticmethod
+    def __may_navigate(action):
+        action_type = action["action"]["type"]
+        if action_type == "click" or action_type == "dbclick":
+            return True
+        return (action_type == "keydown" or action_type == "keypress") and action["action"].get("key") == "Enter"
+
+    # returns the pause (seconds) to insert for a recorded pause of ms_to_wait milliseconds.
+    def __pause_for(self, ms_to_wait):
+        if self.event_driven:
+            return 0
+        seconds_to_wait = max(ms_to_wait, 0) / 1000 / self.speed
+        if self.max_pause is not None:
+            seconds_to_wait = min(seconds_to_wait, self.max_pause)
+        return seconds_to_wait
+
+    # waits until the page has been loaded and the network has been idle for NETWORK_IDLE seconds (or ready_timeout
+    # seconds have passed). Returns True if the page is ready.
+    def __wait_until_ready(self):
+        deadline = time.monotonic() + self.ready_timeout
+        last_state = None
+        stable_since = time.monotonic()
+        while time.monotonic() < deadline:
+            try:
+                state = self.driver.execute_script(self.PAGE_STATE_SCRIPT)
+            except WebDriverException:
+                # the page is changing (e.g. a click started a navigation).
+                state = None
+            now = time.monotonic()
+            if state != last_state:
+                last_state = state
+                stable_since = now
+            elif state is not None and state[1] == "complete" and now - stable_since >= self.NETWORK_IDLE:
+                return True
+            time.sleep(self.READINESS_POLL)
+        return False
+
     def replay_actions(self):
+        # the driver is quit even if the replay fails: a Chrome instance must never be left running.
+        try:
+            self.__replay_transactions()
+        finally:
+            self.recording.close()
+            if self.own_driver:
+                self.driver.quit()
+
+    def __replay_transactions(self):
         self.action_chain = ActionChains(self.driver)
-        for k, v in self.session['transactions'].items():
+        for k, v in self.recording.transactions():
             curr_url = v['url']
             # since the container changes IP every time that the network is restarted and the 'penetration_net' has been
             # designed to expose the benchmark container port even on localhost, we substitute the container IP ADDRESS
             # with localhost. Without doing this we could not be able to reproduce a recording that has the benchmark
             # IP ADDRESS that differs from the current benchmark IP ADDRESS.
             curr_url = re.sub(r'\/\/\d*\.\d*\.\d*\.\d', '//localhost', curr_url)
-            # add every action to the action_chain.
-            for k_action, v_action in v['actions'].items():
-                self.__add_action(v_action)
+            self.visited_origins.add(origin_of(curr_url))
+            # add every action to the action_chain (in event driven mode they are performed one at a time, later).
+            if not self.event_driven:
+                for k_action, v_action in v['actions'].items():
+                    self.__add_action(v_action)
 
             # TODO: here we need a check to caption if the webpage has been navigated manually
             #       as in the case of a Reflected XSS, or if it has been navigated just simply
@@ -135,9 +241,22 @@ class Player(object):
             else:
                 self.driver.get(curr_url)
 
-            self.action_chain.perform()
-            self.action_chain = ActionChains(self.driver)
+            if self.event_driven:
+                # the actions are performed as soon as the page is ready for them: the chain is performed, and the
+                # page waited for, after every action that can navigate or send requests.
+                self.__wait_until_ready()
+                for k_action, v_action in v['actions'].items():
+                    self.__add_action(v_action)
+                    if self.__may_navigate(v_action):
+                        self.action_chain.perform()
+                        self.action_chain = ActionChains(self.driver)
+                        self.__wait_until_ready()
+                # the keystrokes that follow the last click (if any).
+                self.action_chain.perform()
+                self.action_chain = ActionChains(self.driver)
+            else:
+                self.action_chain.perform()
+                self.action_chain = ActionChains(self.driver)
 
-        # quit the driver after the action chain for every transaction has ended.
-        time.sleep(5)
-        self.driver.quit()
+        # quit the driver once the requests caused by the last actions have been completed.
+        self.__wait_until_ready()
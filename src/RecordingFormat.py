@@ -0,0 +1,279 @@
+# Description: RecordingFormat is the format of the recordings written by Session.save_session. It combines an
+#              encoding:
+#              - "json":    the historical format, pretty printed (indent=2), meant to be read by humans;
+#              - "compact": the same JSON document without whitespaces, encoded with orjson if it is installed;
+#              - "msgpack": a sequence of msgpack objects, the header of the session followed by one
+#                           [key, transaction] pair per transaction;
+#              with an optional compression ("gzip" or "zstd") of the whole file. RecordingWriter writes a recording
+#              one transaction at a time, directly to the (compressing) file: the session is never encoded as a
+#              whole string. open_recording reads a recording of any format, recognized from its first bytes,
+#              one transaction at a time.
+# Notes:
+#           - orjson, msgpack and zstandard are optional dependencies (listed in docker/interceptor/dependencies): a
+#             format whose package is missing can't be written (the interceptor stops at startup), the others are not
+#             affected. Without orjson the compact format is encoded by the standard library.
+#           - The name of the recording tells its format (see Dataset.RECORDING_FILES), but the readers never rely
+#             on it: a renamed file is read as well.
+#           - Only uncompressed JSON recordings can be read at an offset: the writer returns the position of every
+#             transaction only for them (the catalog records it, see DatasetCatalog.py).
+
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from Dataset import RECORDING_NAME, ENCODING_EXTENSIONS, COMPRESSION_EXTENSIONS
+
+# The JSON scanner that reads a transaction at a time.
+from RecordingReader import RecordingReader, BODY_FIELDS
+
+ENCODINGS = tuple(ENCODING_EXTENSIONS)
+COMPRESSIONS = tuple(COMPRESSION_EXTENSIONS)
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# the first object of a msgpack recording is a map with this key.
+MSGPACK_MARKER = "wapt_recording"
+MSGPACK_VERSION = 1
+
+
+class RecordingFormat(object):
+
+    def __init__(self, encoding="json", compression=None):
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown output format: " + str(encoding))
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression: " + str(compression))
+        if encoding == "msgpack" and msgpack is None:
+            raise ValueError("The msgpack output format requires the msgpack package (pip install msgpack)")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("The zstd compression requires the zstandard package (pip install zstandard)")
+        self.encoding = encoding
+        self.compression = compression
+
+    @property
+    def filename(self):
+        return RECORDING_NAME + ENCODING_EXTENSIONS[self.encoding] + COMPRESSION_EXTENSIONS.get(self.compression, "")
+
+    def __repr__(self):
+        return self.encoding + ("+" + self.compression if self.compression is not None else "")
+
+
+# The format used when none is given: the historical one.
+DEFAULT_FORMAT = RecordingFormat()
+
+
+def _open_compressed(path, compression, mode):
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == "zstd":
+        stream = open(path, mode)
+        if mode == "wb":
+            return zstandard.ZstdCompressor(level=3).stream_writer(stream)
+        return zstandard.ZstdDecompressor().stream_reader(stream, closefd=True)
+    return open(path, mode)
+
+
+def _compact_json(value):
+    if orjson is not None:
+        try:
+            # the actions of a transaction are numbered with integer keys (see Session.align_actions): like json,
+            # orjson turns them into strings only with OPT_NON_STR_KEYS.
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers larger than 64 bits: the standard library handles them.
+            pass
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+# Writes a recording: write_header, then add for every transaction, then close.
+class RecordingWriter(object):
+
+    def __init__(self, path, recording_format=DEFAULT_FORMAT):
+        self.path = path
+        self.format = recording_format
+        self._stream = _open_compressed(path, recording_format.compression, "wb")
+        # bytes written so far: the offsets of the transactions are known only for uncompressed JSON.
+        self._position = 0 if recording_format.compression is None and recording_format.encoding != "msgpack" \
+            else None
+        self._count = 0
+        if recording_format.encoding == "msgpack":
+            self._packer = msgpack.Packer(use_bin_type=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __write(self, data):
+        self._stream.write(data)
+        if self._position is not None:
+            self._position += len(data)
+
+    # header is the dictionary of the fields of the session that precede the transactions.
+    def write_header(self, header):
+        encoding = self.format.encoding
+        if encoding == "json":
+            # the header without its closing brace: the output is exactly the same that
+            # json.dumps(session_dict, indent=2) would produce.
+            if header:
+                self.__write((json.dumps(header, indent=2)[:-2] + ',\n  "transactions": {').encode("ascii"))
+            else:
+                self.__write(b'{\n  "transactions": {')
+        elif encoding == "compact":
+            self.__write(_compact_json(header)[:-1] + (b',"transactions":{' if header else b'"transactions":{'))
+        else:
+            self.__write(self._packer.pack({MSGPACK_MARKER: MSGPACK_VERSION, "header": header}))
+
+    # Writes a transaction. Returns (offset, length) of its JSON object in the file, or None if it is not known.
+    def add(self, key, transaction):
+        self._count += 1
+        encoding = self.format.encoding
+        if encoding == "msgpack":
+            # the actions are numbered with integer keys (see Session.align_actions): they are written as strings,
+            # as in the JSON formats, so that every format is read back the same.
+            actions = transaction.get("actions")
+            if actions and not all(isinstance(action_key, str) for action_key in actions):
+                transaction = dict(transaction, actions={str(k): v for k, v in actions.items()})
+            self.__write(self._packer.pack([str(key), transaction]))
+            return None
+        if encoding == "json":
+            # every character written is ASCII (json.dumps escapes everything else).
+            prefix = (',\n    "' if self._count > 1 else '\n    "') + str(key) + '": '
+            data = json.dumps(transaction, indent=2).replace('\n', '\n    ').encode("ascii")
+            prefix = prefix.encode("ascii")
+        else:
+            prefix = (b',"' if self._count > 1 else b'"') + str(key).encode("utf-8") + b'":'
+            data = _compact_json(transaction)
+        self.__write(prefix)
+        offset = self._position
+        self.__write(data)
+        return (offset, len(data)) if offset is not None else None
+
+    def close(self):
+        if self._stream is None:
+            return
+        try:
+            if self.format.encoding == "json":
+                self.__write(b'\n  }\n}' if self._count > 0 else b'}\n}')
+            elif self.format.encoding == "compact":
+                self.__write(b'}}')
+        finally:
+            self._stream.close()
+            self._stream = None
+
+
+# Reads a msgpack recording with the same interface of RecordingReader.
+class MsgpackRecordingReader(object):
+
+    def __init__(self, path, skip=BODY_FIELDS, stream=None):
+        if msgpack is None:
+            raise ValueError("%s: reading a msgpack recording requires the msgpack package" % path)
+        self.path = path
+        self._skip = [tuple(field.split(".")) for field in skip]
+        self._stream = stream if stream is not None else open(path, "rb")
+        self._unpacker = msgpack.Unpacker(self._stream, raw=False, strict_map_key=False, max_buffer_size=0)
+        try:
+            first = next(self._unpacker, None)
+            if not isinstance(first, dict) or MSGPACK_MARKER not in first:
+                raise ValueError("%s: not a msgpack recording" % path)
+            self.header = first.get("header", {})
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # the fields are decoded anyway: they are dropped to keep only what the caller asked for in memory.
+    def __drop(self, transaction):
+        for path in self._skip:
+            parent = transaction
+            for field in path[:-1]:
+                parent = parent.get(field) if isinstance(parent, dict) else None
+            if isinstance(parent, dict):
+                parent.pop(path[-1], None)
+        return transaction
+
+    def transactions(self):
+        try:
+            for item in self._unpacker:
+                key, transaction = item
+                yield key, self.__drop(transaction)
+        except msgpack.UnpackException as error:
+            raise ValueError("%s: %s" % (self.path, error))
+        finally:
+            self.close()
+
+    def __iter__(self):
+        return self.transactions()
+
+
+# Returns (compression, encoding) of the recording in path, recognized from its first bytes.
+def detect_format(path):
+    with open(path, "rb") as stream:
+        magic = stream.read(4)
+    compression = "gzip" if magic.startswith(_GZIP_MAGIC) else "zstd" if magic.startswith(_ZSTD_MAGIC) else None
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("%s: reading a zstd recording requires the zstandard package" % path)
+    with _open_compressed(path, compression, "rb") as stream:
+        first = stream.read(64).lstrip()
+    return compression, "json" if first.startswith(b"{") else "msgpack"
+
+
+# Returns the RecordingFormat of the recording in path.
+def format_of(path):
+    compression, encoding = detect_format(path)
+    if encoding == "json":
+        # the pretty printed recordings begin with "{\n".
+        with _open_compressed(path, compression, "rb") as stream:
+            encoding = "json" if stream.read(2) == b"{\n" else "compact"
+    return RecordingFormat(encoding, compression)
+
+
+# Returns the reader of the recording in path (a RecordingReader or a MsgpackRecordingReader): it has a header and
+# yields (key, transaction) from transactions(). skip are the fields of the transactions that are not returned.
+def open_recording(path, skip=BODY_FIELDS):
+    compression, encoding = detect_format(path)
+    stream = _open_compressed(path, compression, "rb")
+    if encoding == "msgpack":
+        return MsgpackRecordingReader(path, skip, stream)
+    return RecordingReader(path, skip, stream=stream)
+
+
+# Returns the whole session saved in path, as the dictionary json.load returns for a JSON recording.
+def load_recording(path):
+    with open_recording(path, skip=()) as reader:
+        transactions = dict(reader.transactions())
+        session = dict(reader.header)
+    session["transactions"] = transactions
+    return session
+
+
+# Returns the transaction key (a string) of the recording in path, reading the transactions that precede it.
+def read_transaction(path, key, skip=()):
+    with open_recording(path, skip) as reader:
+        for transaction_key, transaction in reader.transactions():
+            if transaction_key == key:
+                return transaction
+    raise KeyError(key)
@@ -0,0 +1,216 @@
+# Description: RecordingReader reads a session_recording.json one transaction at a time, without loading the whole
+#              file: the fields to skip (by default the bodies of the requests and of the responses) are scanned but
+#              never decoded nor kept in memory. The memory used is proportional to a single transaction (without
+#              its skipped fields), so the replay of a session can start as soon as its first transaction is read.
+# Notes:
+#           - Fields to skip are given as paths inside a transaction: "request" skips the whole request,
+#             "request.content" only its body.
+#           - header contains the fields of the session that precede "transactions" (window_width and
+#             window_height in the recordings written by Session.save_session) as soon as the reader is created;
+#             fields that follow "transactions" are added to it once the transactions have been read.
+#           - This reader only knows JSON: RecordingFormat.open_recording recognizes the format of a recording
+#             (compressed, msgpack, ...) and returns the right reader for it.
+#           - location is (offset, length) of the last transaction read, in the bytes of the stream: for an
+#             uncompressed recording (indented or compact) the transaction can be read again from there.
+
+import json
+import re
+
+# Fields of a transaction skipped by default: the bodies.
+BODY_FIELDS = ("request.content", "response.content")
+CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+# the content of a string up to its closing quote (or up to the end of the buffer).
+_STRING_CONTENT = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*')
+_QUOTE = ord('"')
+_STRUCTURAL = re.compile(rb'["{}\[\]]')
+_SCALAR = re.compile(rb'[^,:}\] \t\n\r]*')
+
+
+class RecordingReader(object):
+
+    # stream is the binary stream to read instead of opening path (e.g. a decompressing stream): it is closed with
+    # the reader.
+    def __init__(self, path, skip=BODY_FIELDS, chunk_size=CHUNK_SIZE, stream=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._skip = {tuple(field.split(".")) for field in skip}
+        self._stream = stream if stream is not None else open(path, "rb")
+        self._buffer = bytearray()
+        self._position = 0
+        # bytes of the stream dropped from the buffer so far.
+        self._consumed = 0
+        self.location = None
+        # start of the value being read: the buffer is kept from here when it is refilled.
+        self._mark = None
+        self._eof = False
+        self._in_transactions = False
+        self.header = {}
+        try:
+            self.__read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Yields (key, transaction) for every transaction of the recording, in order. Can be iterated only once.
+    def transactions(self):
+        if self._in_transactions:
+            self._in_transactions = False
+            self.__expect(b"{")
+            for key in self.__members():
+                self.__peek()
+                start = self._consumed + self._position
+                value = self.__read_value(self._skip)
+                self.location = (start, self._consumed + self._position - start)
+                yield key, value
+            # the fields that follow the transactions.
+            self.__read_root_members()
+        self.close()
+
+    def __iter__(self):
+        return self.transactions()
+
+    # ---------------------------------------------------------------------------------------------------------------
+    # scanner
+
+    # reads more data in the buffer. Returns False at the end of the file.
+    def __refill(self):
+        if self._eof:
+            return False
+        data = self._stream.read(self.chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        keep_from = self._mark if self._mark is not None else self._position
+        del self._buffer[:keep_from]
+        self._consumed += keep_from
+        self._position -= keep_from
+        if self._mark is not None:
+            self._mark = 0
+        self._buffer += data
+        return True
+
+    def __error(self, message):
+        return ValueError("%s: %s" % (self.path, message))
+
+    # returns the next character that is not a whitespace (without consuming it), None at the end of the file.
+    def __peek(self):
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position:self._position + 1]
+            if not self.__refill():
+                return None
+
+    def __expect(self, character):
+        if self.__peek() != character:
+            raise self.__error("expected %r at byte %d" % (character, self._position))
+        self._position += 1
+
+    # moves after the closing quote of the string that begins at the current position.
+    def __skip_string(self):
+        self._position += 1
+        while True:
+            self._position = _STRING_CONTENT.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer) and self._buffer[self._position] == _QUOTE:
+                self._position += 1
+                return
+            # the end of the buffer has been reached, maybe in the middle of an escape sequence: its backslash is
+            # at the current position, so it is kept when the buffer is refilled.
+            if not self.__refill():
+                raise self.__error("unterminated string")
+
+    # moves after the value that begins at the current position.
+    def __skip_value(self):
+        first = self.__peek()
+        if first is None:
+            raise self.__error("unexpected end of file")
+        if first == b'"':
+            self.__skip_string()
+            return
+        if first not in (b"{", b"["):
+            while True:
+                self._position = _SCALAR.match(self._buffer, self._position).end()
+                if self._position < len(self._buffer) or not self.__refill():
+                    return
+        depth = 0
+        while True:
+            found = _STRUCTURAL.search(self._buffer, self._position)
+            if found is None:
+                self._position = len(self._buffer)
+                if not self.__refill():
+                    raise self.__error("unexpected end of file")
+                continue
+            self._position = found.start()
+            character = self._buffer[self._position]
+            if character == _QUOTE:
+                self.__skip_string()
+                continue
+            self._position += 1
+            if character in (ord("{"), ord("[")):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    # reads (and decodes) the value that begins at the current position, skipping the fields in skip (paths).
+    def __read_value(self, skip):
+        if skip and self.__peek() == b"{":
+            self._position += 1
+            value = {}
+            for key in self.__members():
+                if (key,) in skip:
+                    self.__skip_value()
+                    continue
+                value[key] = self.__read_value({path[1:] for path in skip if path[0] == key and len(path) > 1})
+            return value
+
+        self.__peek()
+        self._mark = self._position
+        try:
+            self.__skip_value()
+            return json.loads(bytes(self._buffer[self._mark:self._position]))
+        finally:
+            self._mark = None
+
+    # yields the keys of the object whose opening brace has just been consumed; after every key the caller must
+    # consume its value.
+    def __members(self):
+        first = True
+        while True:
+            character = self.__peek()
+            if character == b"}":
+                self._position += 1
+                return
+            if not first:
+                self.__expect(b",")
+            first = False
+            if self.__peek() != b'"':
+                raise self.__error("expected a key at byte %d" % self._position)
+            key = self.__read_value(())
+            self.__expect(b":")
+            yield key
+
+    # reads the fields of the root object up to "transactions" (or up to its end).
+    def __read_header(self):
+        self.__expect(b"{")
+        self._root_members = self.__members()
+        self.__read_root_members()
+
+    def __read_root_members(self):
+        for key in self._root_members:
+            if key == "transactions":
+                self._in_transactions = True
+                return
+            self.header[key] = self.__read_value(())
@@ -0,0 +1,157 @@
+# Description: ReplayFarm replays many recordings at once over a pool of worker processes, each one driving its own
+#              headless Chrome through a Player. Every replay gets a free remote debugging port and a temporary
+#              profile (user data directory), so that the Chrome instances don't interfere with each other; a replay
+#              that fails is retried (on a new port, with a new profile) up to retries times.
+#              run() returns the outcome of every recording and the report of the whole batch (throughput).
+# Notes:
+#           - Player (and so selenium) is imported by the worker processes only.
+#           - With max_uses > 1 every worker keeps its Chrome running between the recordings (see BrowserPool.py):
+#             the start of Chrome is paid once per worker instead of once per recording.
+#           - A free port is found by binding a socket to port 0 and closing it: another process could take the port
+#             before Chrome binds it, in that case the replay fails and is retried on another port.
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+# find_recordings walks out/ looking for the recorded sessions.
+from Dataset import RECORDING_FILES, find_recordings, recording_in
+
+
+# Returns a TCP port of localhost that is currently free.
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+# Returns the recordings contained in paths: a path can be a recording or a folder, that is searched recursively
+# (the output folder of the interceptor, the folder of a task, ...).
+def collect_recordings(paths):
+    recordings = []
+    for path in paths:
+        if os.path.isfile(path):
+            recordings.append(path)
+        elif os.path.isdir(path):
+            found = list(find_recordings(path))
+            if not found:
+                for folder, _, files in sorted(os.walk(path)):
+                    if any(name in files for name in RECORDING_FILES):
+                        found.append(recording_in(folder))
+            recordings.extend(found)
+        else:
+            print("Warning: " + path + " does not exist.")
+    # a recording given twice (e.g. by itself and inside its folder) is replayed once.
+    return list(dict.fromkeys(recordings))
+
+
+# BrowserPool of the worker process (None if the drivers are not reused).
+_browser_pool = None
+
+
+# Initializer of the worker processes.
+def _init_worker(headless, max_uses):
+    global _browser_pool
+    if max_uses > 1:
+        from BrowserPool import BrowserPool
+        _browser_pool = BrowserPool(max_uses, headless)
+        # the workers don't run the atexit handlers: the finalizer quits the warm Chrome when the worker exits.
+        Finalize(_browser_pool, _browser_pool.close, exitpriority=10)
+
+
+# Replays recording with a driver of the pool of the worker. Returns after the driver has been given back.
+def _replay_pooled(recording, player_options):
+    from Player import Player
+
+    browser = _browser_pool.acquire()
+    player = None
+    failed = True
+    try:
+        player = Player(recording, driver=browser.driver, **player_options)
+        player.replay_actions()
+        failed = False
+    finally:
+        # a replay can fail because of the recording: the driver is replaced only if it doesn't respond anymore.
+        _browser_pool.release(browser, player.visited_origins if player is not None else (),
+                              failed and not browser.alive())
+
+
+# Replays recording, retrying it if it fails (unless the recording itself can't be read). Runs in a worker process.
+# player_options are the other arguments of Player (speed, max_pause, event_driven, ...).
+# Returns the outcome: {"recording", "status": "ok" | "failed", "attempts", "seconds", "error"}.
+def replay_recording(recording, retries=1, headless=True, player_options=None):
+    from Player import Player
+
+    started = time.monotonic()
+    error = None
+    for attempt in range(1, retries + 2):
+        profile_dir = None
+        try:
+            if _browser_pool is not None:
+                _replay_pooled(recording, player_options or {})
+            else:
+                profile_dir = tempfile.mkdtemp(prefix="wapt-chrome-")
+                player = Player(recording, free_port(), profile_dir, headless, **(player_options or {}))
+                player.replay_actions()
+            return {"recording": recording, "status": "ok", "attempts": attempt,
+                    "seconds": time.monotonic() - started, "error": None}
+        # Player raises ValueError when the recording can't be read (or an option is invalid): another attempt would
+        # fail in the same way.
+        except ValueError as exception:
+            return {"recording": recording, "status": "failed", "attempts": attempt,
+                    "seconds": time.monotonic() - started, "error": "%s: %s" % (type(exception).__name__, exception)}
+        except Exception as exception:
+            error = "%s: %s" % (type(exception).__name__, exception)
+        finally:
+            if profile_dir is not None:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+    return {"recording": recording, "status": "failed", "attempts": retries + 1,
+            "seconds": time.monotonic() - started, "error": error}
+
+
+class ReplayFarm(object):
+
+    # max_uses is the number of recordings replayed by a Chrome instance before it is replaced (1: a new Chrome for
+    # every recording).
+    def __init__(self, recordings, workers=None, retries=1, headless=True, player_options=None, max_uses=50):
+        self.recordings = list(recordings)
+        self.max_uses = max_uses
+        self.player_options = player_options or {}
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 2) // 2)
+        self.retries = retries
+        self.headless = headless
+
+    # Replays every recording. on_outcome (if given) is called with each outcome as soon as it is available.
+    # Returns the outcomes (in the order of the recordings) and the report of the batch.
+    def run(self, on_outcome=None):
+        started = time.monotonic()
+        outcomes = {}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.headless, self.max_uses)) as executor:
+            futures = {executor.submit(replay_recording, recording, self.retries, self.headless,
+                                       self.player_options): recording
+                       for recording in self.recordings}
+            for future in as_completed(futures):
+                recording = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as exception:
+                    # the worker process itself died (e.g. killed by the OOM killer).
+                    outcome = {"recording": recording, "status": "failed", "attempts": 0, "seconds": None,
+                               "error": "%s: %s" % (type(exception).__name__, exception)}
+                outcomes[recording] = outcome
+                if on_outcome is not None:
+                    on_outcome(outcome)
+
+        elapsed = time.monotonic() - started
+        outcomes = [outcomes[recording] for recording in self.recordings]
+        succeeded = sum(1 for outcome in outcomes if outcome["status"] == "ok")
+        report = {"recordings": len(outcomes), "succeeded": succeeded, "failed": len(outcomes) - succeeded,
+                  "retried": sum(1 for outcome in outcomes if outcome["attempts"] > 1),
+                  "workers": self.workers, "seconds": elapsed,
+                  "recordings_per_minute": len(outcomes) * 60 / elapsed if elapsed > 0 else 0.0}
+        return outcomes, report
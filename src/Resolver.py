@@ -0,0 +1,151 @@
+# Description: ReverseResolver is the mapping IP address -> hostname employed by HTTPLogger (it replaces the plain
+#              "services" dictionary). Reverse DNS lookups are performed by a small pool of background threads, so
+#              the mitmproxy hooks never wait for the DNS: until the name of a client is known the raw IP address
+#              is returned.
+# Notes:
+#           - socket.gethostbyaddr can't be interrupted: a lookup that takes longer than "timeout" is considered
+#             failed (and negatively cached), its late result is simply discarded. The expired lookups are swept by
+#             every call of lookup() (at most once per timeout/2 seconds), not only by the next lookup of the same
+#             address: the ones still queued are cancelled. A lookup that is already running keeps its worker thread
+#             until gethostbyaddr returns: the wait is bounded by the resolver of the system (the "timeout" and
+#             "attempts" options of /etc/resolv.conf, 5 seconds and 2 attempts per server by default). Meanwhile
+#             the other workers keep resolving, and a client whose lookup is stuck is named by its IP address.
+#           - Static entries (e.g. the containers discovered by Interceptor.py) never expire.
+
+# gethostbyaddr is used to obtain the name of the clients.
+import socket
+
+# Used to run the lookups outside of the mitmproxy event loop.
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# OrderedDict is employed as LRU cache: the least recently used address is the first one.
+from collections import OrderedDict
+
+import time
+
+
+class ReverseResolver(object):
+
+    def __init__(self, static=None, ttl=300.0, negative_ttl=60.0, timeout=2.0, max_size=4096, max_workers=4):
+        # entries that are known in advance (they are never looked up nor evicted).
+        self.static = dict(static) if static is not None else {}
+        # seconds a resolved (or failed) name is kept before being looked up again.
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # seconds after which a pending lookup is considered failed.
+        self.timeout = timeout
+        # maximum number of cached addresses (and of pending lookups).
+        self.max_size = max_size
+
+        # ip -> (hostname, expiration time). A failed lookup is cached with the ip address as hostname.
+        self._cache = OrderedDict()
+        # ip -> (future, start time) of the lookups that are running in background.
+        self._pending = {}
+        # time of the next sweep of the expired lookups.
+        self._next_sweep = 0.0
+        # reentrant: a lookup that is already done runs its callback in the thread that submitted it.
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ReverseResolver')
+
+        # counters, useful to know how the cache is performing.
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the hostname of ip if it is known, otherwise it returns ip itself and starts the lookup in background.
+    # This method never blocks.
+    def lookup(self, ip):
+        try:
+            return self.static[ip]
+        except KeyError:
+            pass
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(ip)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+            if now >= self._next_sweep:
+                self._expire(now)
+            if ip in self._pending:
+                return entry[0] if entry is not None else ip
+            entry = self._cache.get(ip)
+            if entry is not None and entry[1] > now:
+                # the lookup of ip has just expired: its failure is remembered for negative_ttl seconds.
+                return entry[0]
+
+            # too many lookups are already running: this one will be retried with the next flow.
+            if len(self._pending) < self.max_size:
+                future = self._executor.submit(self._resolve, ip)
+                self._pending[ip] = (future, now)
+                future.add_done_callback(lambda f, ip=ip: self._resolved(ip, f))
+
+        # a stale name is still better than the raw address while the new lookup is running.
+        return entry[0] if entry is not None else ip
+
+    # Gives up the lookups that are pending for more than timeout seconds (the resolver could be unreachable) and
+    # remembers their failure for negative_ttl seconds. Must be called holding self._lock.
+    def _expire(self, now):
+        self._next_sweep = now + self.timeout / 2
+        expired = [ip for ip, (_, started) in self._pending.items() if now - started > self.timeout]
+        for ip in expired:
+            # a lookup still waiting for a worker will never run, a running one is discarded by _resolved.
+            self._pending.pop(ip)[0].cancel()
+            self._store(ip, ip, now + self.negative_ttl)
+
+    @staticmethod
+    def _resolve(ip):
+        # gethostbyaddr returns a triple (hostname, aliaslist, ipaddrlist).
+        return socket.gethostbyaddr(ip)[0]
+
+    def _resolved(self, ip, future):
+        with self._lock:
+            pending = self._pending.get(ip)
+            # the lookup timed out (or the cache has been cleared) while it was running: discard the result.
+            if pending is None or pending[0] is not future or future.cancelled():
+                return
+            del self._pending[ip]
+            try:
+                self._store(ip, future.result(), time.monotonic() + self.ttl)
+            except (OSError, UnicodeError):
+                # socket.herror and socket.gaierror are subclasses of OSError.
+                self._store(ip, ip, time.monotonic() + self.negative_ttl)
+
+    # Must be called holding self._lock.
+    def _store(self, ip, hostname, expiration):
+        self._cache[ip] = (hostname, expiration)
+        self._cache.move_to_end(ip)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, ip):
+        return self.lookup(ip)
+
+    def __contains__(self, ip):
+        if ip in self.static:
+            return True
+        with self._lock:
+            entry = self._cache.get(ip)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self.static) + len(self._cache)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._pending.clear()
+
+    def shutdown(self):
+        # pending lookups are abandoned: there is no one left to use their result. (cancel_futures of shutdown needs
+        # Python 3.9, the interceptor image is based on Python 3.8: the queued lookups are cancelled here)
+        with self._lock:
+            pending = [future for future, _ in self._pending.values()]
+            self._pending.clear()
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=False)
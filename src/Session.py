@@ -11,6 +11,9 @@
 # to save attribute named "start_time".
 from datetime import datetime
 
+# the transactions whose response is still being streamed wait in a queue before being written to the capture log.
+import collections
+
 from HTTPTransaction import *
 
 # Used to save files specifying the path (a directory that differs from the cwd)
@@ -20,13 +23,24 @@ from pathlib import Path
 import os
 import errno
 
-# To make a deep copy of the dictionary containing the action chain.
-import copy
+# CaptureLog writes the transactions on the disk as soon as they are captured. (streaming capture mode)
+from CaptureLog import CaptureLog
+
+# summarize extracts from a transaction what the catalog of the dataset indexes.
+from DatasetCatalog import summarize
+
+# RecordingWriter writes the recording, one transaction at a time, in the chosen output format.
+from RecordingFormat import RecordingWriter, DEFAULT_FORMAT
+
+# Every session will be saved under this folder, in a subfolder named as the task.
+OUT_FOLDER = "../out/"
+# Name of the subfolder of the session folder that contains the capture log while the session is being recorded.
+CAPTURE_FOLDER = "capture"
 
 class Session:
 
-    def __init__(self, url="", task_name="", start_time=None, http_transactions=[],
-                 end_user_actions=""):
+    def __init__(self, url="", task_name="", start_time=None, http_transactions=None,
+                 end_user_actions="", streaming=False, catalog=None, recording_format=None, deduplicator=None):
         self.url: str = url
         self.task_name: str = task_name
         self.start_time: datetime = start_time
@@ -36,33 +50,87 @@ class Session:
         # self.dataset_path: str = dataset_path
 
         # contains the list of HTTPTransaction objects.
-        self.http_transactions: list = http_transactions
+        # (a new list for every session: a default list would be shared by all the sessions of the clients)
+        self.http_transactions: list = http_transactions if http_transactions is not None else []
         # the JSON object that will be received at the end of the recording session.
         self.end_user_actions: str = end_user_actions
 
+        # when streaming is enabled the transactions are not kept in http_transactions but appended to capture_log,
+        # an on-disk log created in the session folder with the first transaction.
+        self.streaming: bool = streaming
+        self.capture_log: CaptureLog = None
+        # (streaming mode) the transactions that can't be written yet because the body of their response is still
+        # being received, followed by the ones recorded after them: the log keeps the order of the transactions.
+        self.pending_transactions = collections.deque()
+
+        # the DatasetCatalog (optional) where the session is indexed when it is saved.
+        self.catalog = catalog
+        # the RecordingFormat of the saved recording (pretty printed JSON by default).
+        self.recording_format = recording_format if recording_format is not None else DEFAULT_FORMAT
+        # the Deduplicator (optional) that flags or drops the near-duplicate transactions when the session is saved.
+        self.deduplicator = deduplicator
+        # bytes of the bodies captured so far. (reported by the metrics of HTTPLogger)
+        self.captured_bytes: int = 0
+
     def __del__(self):
         del self.url
         del self.task_name
         del self.http_transactions
         del self.end_user_actions
 
+    # Returns the folder where the session will be saved. task_name and start_time must already be set.
+    def get_out_folder(self):
+        # replacing all white space with underscores to avoid problems when making the directory named as the task.
+        task_name = self.task_name.replace(" ", "_")
+        # data_folder will be located outside of the current folder (named src/). It will be named as the task that
+        # we're currently recording. Every record related to the same task will be saved under the same parent folder.
+        return Path(OUT_FOLDER + task_name + "/" + str(self.start_time).replace(" ", "_"))
+
+    # Records a new HTTPTransaction: in streaming mode it is immediately written on the disk and then forgotten.
+    # captured_bytes is the size of its bodies.
+    def add_transaction(self, transaction, captured_bytes=0):
+        self.captured_bytes += captured_bytes
+        if self.streaming:
+            self.pending_transactions.append(transaction)
+            self.flush_pending(wait=False)
+        else:
+            self.http_transactions.append(transaction)
+
+    # Writes the pending transactions in the capture log, in order. If wait is False it stops at the first one whose
+    # response is still being streamed (the proxy must never wait for a body), otherwise its body is waited for.
+    def flush_pending(self, wait=True):
+        while self.pending_transactions and (wait or self.pending_transactions[0].ready()):
+            transaction = self.pending_transactions.popleft()
+            if self.capture_log is None:
+                self.capture_log = CaptureLog(self.get_out_folder() / CAPTURE_FOLDER)
+            self.capture_log.append(transaction.get_dict())
+            transaction.release()
+
+    # Yields the recorded transactions as dictionaries (see HTTPTransaction.get_dict), one at a time.
+    def iter_transactions(self):
+        self.flush_pending()
+        if self.capture_log is not None:
+            yield from self.capture_log
+        for transaction in self.http_transactions:
+            yield transaction.get_dict()
+
+    # Returns the number of recorded transactions.
+    def transactions_count(self):
+        return len(self.http_transactions) + len(self.pending_transactions) + \
+            (len(self.capture_log) if self.capture_log is not None else 0)
+
     def save_session(self):
         # here the code for saving both http_transactions and end_user_actions in the proper folder.
 
         # replacing all white space with underscores to avoid problems when making the directory named as the task.
         self.task_name = self.task_name.replace(" ", "_")
-        # data_folder will be located outside of the current folder (named src/). It will be named as the task that
-        # we're currently recording. Every record related to the same task will be saved under the same parent folder.
-        out_folder = Path("../out/" + self.task_name + "/" + str(self.start_time).replace(" ", "_"))
+        out_folder = self.get_out_folder()
 
         # Every intercepted request will be labeled with the name of the resource requested
         # plus the current datetime (YYYY-MM-DD HH:MM:SS.DS).
         # current_filename = '' + '.json'
         # file_to_open = dataset_folder / current_filename
 
-        # Save each recorded http transaction with an integer only to take trace of which has happened first.
-        trans_n = 1
-        temp_actions_dict = {}
         session_dict = {}
 
         # Writing the actions performed by the end client together with the http_transaction.
@@ -70,60 +138,13 @@ class Session:
         # extracting window dimension.
         session_dict['window_height'] = actions_performed.pop('window_height', "MAX")
         session_dict['window_width'] = actions_performed.pop('window_width', "MAX")
-        session_dict['transactions'] = {}
 
         # no_actions equals to eua_dict minus 1 because last key represents task name.
         # (could be modified before the release)
         # no_actions = len(eua_dict) - 1
 
-        for transaction in self.http_transactions:
-
-            # action number counter for every http_transaction. It is employed to enumerate actions from a single
-            # transaction from 1 to n.
-            action_n = 1
-
-            # The action containing JSON uses special actions named "navigateTo" to exactly know when a transaction
-            # is beginning. Exploiting this "delimiter" we can extract only values corresponding to actions
-            # related to current transaction. delimiter_encountered is a flag employed to know if the delimiter for
-            # current transaction has already been met.
-            delimiter_encountered = False
-
-            ''' 
-                we're doing a deep copy of the dictinary "actions_performed" because if we would 
-                iterate over it by using the method .items() we would not be able to do it because
-                we need to modify the dictionary while iterating on it.
-            '''
-            dict_to_iterate = copy.deepcopy(actions_performed)
-            for k, v in dict_to_iterate.items():
-                if k != "task_name" and k != "window_height" and k != "window_width":
-                    if v['action']['type'] == "navigateTo":
-                        if not delimiter_encountered:
-                            delimiter_encountered = True
-                            del actions_performed[k]
-                        else:
-                            break
-                    else:
-                        # Copy current key, value pair to the temporary dictionary
-                        # that only contains actions belonging to this transaction.
-                        temp_actions_dict[action_n] = v
-                        del actions_performed[k]
-                        action_n += 1
-                else:
-                    del actions_performed[k]
-
-            # A transaction will contain it own actions aside from http_request and http_response.
-            session_dict['transactions'][trans_n] = transaction.get_dict()
-            session_dict['transactions'][trans_n]['actions'] = dict(temp_actions_dict)
-
-            trans_n += 1
-
-            # Clean temporary dict to make room for next session.
-            temp_actions_dict.clear()
-            #temp_session_dict.clear()
-
-        # writing session_dict, the dictionary that contains the entire session, on the JSON output file.
-        output = 'session_recording.json'
-        trans_rec = out_folder / output
+        # writing session_dict, the dictionary that contains the entire session, on the output file.
+        trans_rec = out_folder / self.recording_format.filename
 
         # Create the directory named as the current task with the first usage.
         if not os.path.exists(os.path.dirname(trans_rec)):
@@ -133,11 +154,83 @@ class Session:
                 if exc.errno != errno.EEXIST:
                     raise
 
-        # Just a little syntaptic sugar: could be written without the "with ... as ..."
-        # but doing this way the opened file will be closed after the manipulation.
-        with open(trans_rec, "w") as record_1:
-            # write the entire session as JSON.
-            record_1.write(json.dumps(session_dict, indent=2))
+        # The transactions are written one at a time (they could come from the capture log, that doesn't fit in
+        # memory), directly to the file: the session is never encoded as a whole. The writer returns where each
+        # transaction begins in the file, when the format allows to read it from there, and the catalog records it.
+        summaries = []
+        with RecordingWriter(trans_rec, self.recording_format) as writer:
+            # the header (window dimensions).
+            writer.write_header(session_dict)
+            # Save each recorded http transaction with an integer only to take trace of which has happened first.
+            transactions = self.align_actions(self.iter_transactions(), actions_performed)
+            # the near-duplicates are found here, on the thread that saves the session, never in the proxy hooks.
+            if self.deduplicator is not None:
+                transactions = self.deduplicator.filter(transactions)
+            for trans_n, transaction_dict in enumerate(transactions, start=1):
+                location = writer.add(trans_n, transaction_dict)
+                if self.catalog is not None:
+                    summaries.append(summarize(trans_n, transaction_dict, *(location or (None, None))))
+
+        if self.catalog is not None:
+            self.catalog.add_session(trans_rec, summaries, self.url, session_dict['window_width'],
+                                     session_dict['window_height'])
+
+        # the session has been finalized: the temporary files of the transactions and the capture log are not
+        # needed anymore.
+        for transaction in self.http_transactions:
+            transaction.release()
+        if self.capture_log is not None:
+            self.capture_log.remove()
+            self.capture_log = None
+
+    # Yields the transactions (dictionaries, see HTTPTransaction.get_dict) together with the actions performed by the
+    # end client during each of them. actions_performed is the dictionary obtained from the JSON sent by the browser.
+    # Both transactions and actions are visited only once: the cost is linear in their number and no copy of the
+    # actions is made.
+    @staticmethod
+    def align_actions(transactions, actions_performed):
+        # keys of actions_performed that don't describe an action.
+        metadata_keys = ("task_name", "window_height", "window_width")
+        actions = (v for k, v in actions_performed.items() if k not in metadata_keys)
+        # next_action is the first action not yet assigned to any transaction.
+        next_action = next(actions, None)
+
+        for transaction_dict in transactions:
+            # actions of current transaction, enumerated from 1 to n.
+            transaction_actions = {}
+
+            # The action containing JSON uses special actions named "navigateTo" to exactly know when a transaction
+            # is beginning. Exploiting this "delimiter" we can extract only values corresponding to actions
+            # related to current transaction. delimiter_encountered is a flag employed to know if the delimiter for
+            # current transaction has already been met: a second delimiter belongs to the next transaction.
+            delimiter_encountered = False
+            while next_action is not None:
+                if next_action['action']['type'] == "navigateTo":
+                    if delimiter_encountered:
+                        break
+                    delimiter_encountered = True
+                else:
+                    transaction_actions[len(transaction_actions) + 1] = next_action
+                next_action = next(actions, None)
+
+            # A transaction will contain it own actions aside from http_request and http_response.
+            transaction_dict['actions'] = transaction_actions
+            yield transaction_dict
+
+    # Returns a new Session that owns all the data recorded so far and clears this one, that can immediately be
+    # employed to record a new session. (the returned snapshot can be saved from another thread)
+    def detach(self):
+        snapshot = Session(self.url, self.task_name, self.start_time, self.http_transactions, self.end_user_actions,
+                           self.streaming, self.catalog, self.recording_format, self.deduplicator)
+        snapshot.capture_log = self.capture_log
+        snapshot.pending_transactions = self.pending_transactions
+        snapshot.captured_bytes = self.captured_bytes
+        # the lists and the capture log now belong to the snapshot: they must not be cleared.
+        self.http_transactions = []
+        self.pending_transactions = collections.deque()
+        self.capture_log = None
+        self.clear()
+        return snapshot
 
     # This method will be employed to clean current object data structures: the business logic of this script
     # allows only one session per execution, so it is useless to delete and instantiate a new Session
@@ -146,8 +239,15 @@ class Session:
         self.task_name = ""
         self.url = ""
         self.start_time = None
+        self.captured_bytes = 0
         # Cleaning datastructures employed to save transactions and user actions.
         self.http_transactions.clear()
+        for transaction in self.pending_transactions:
+            transaction.release()
+        self.pending_transactions.clear()
+        if self.capture_log is not None:
+            self.capture_log.close()
+            self.capture_log = None
         # TODO: end_user_action will not be a string anymore with a upcoming update, this line will
         #       be modified to reflect the changes that will occurr to the new data structure employed.
         #       Marco, 20/03
@@ -0,0 +1,288 @@
+# Description: sharded mode of the interceptor (Interceptor.py -workers N). The hooks of HTTPLogger run on a single
+#              core, so under heavy load N interceptor processes (workers) are started, each one listening on its
+#              own local port, and a Distributor accepts the connections on the proxy port and forwards each one to a
+#              worker. All the connections of a client (IP address) go to the same worker, so its recording state
+#              (ClientRecording) lives in one process only. Every worker saves its sessions in its own shard
+#              (out/shards/<n>/) and merge_shards moves them to out/ when the interceptor stops.
+# Notes:
+#           - The workers see the connections coming from the Distributor (127.0.0.1): the real address of the
+#             client is published by the Distributor in a ClientAddressTable (shared memory), keyed by the local
+#             port of the forwarded connection, before the connection is opened. ClientAddressAddon puts it back in
+#             the client connection of mitmproxy as soon as it is accepted, so the addons never see the Distributor.
+#           - The affinity is by IP address: many pentesters from the same address are served by the same worker.
+#           - Only the standard library is used: the Distributor is an asyncio TCP relay that doesn't parse HTTP.
+
+import asyncio
+import ipaddress
+import os
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+# Blobs are content addressed: the blobs of the shards are merged in the BlobStore of out/.
+from BlobStore import BLOB_FOLDER
+
+# Folder of out/ that contains the shards of the workers.
+SHARDS_FOLDER = "shards"
+# A slot of the table: address family (4 or 6), 16 bytes of address, port.
+_SLOT = struct.Struct("!B16sH")
+_SLOT_SIZE = 24
+_PORTS = 65536
+# Bytes relayed by the Distributor at once.
+RELAY_CHUNK = 64 * 1024
+# Seconds given to the workers to save their pending sessions when the interceptor stops.
+WORKER_SHUTDOWN_TIMEOUT = 120
+
+
+# Returns the shard folder of worker n in out_folder.
+def shard_folder(out_folder, n):
+    return os.path.join(str(out_folder), SHARDS_FOLDER, str(n)) + "/"
+
+
+# The table of the real addresses of the forwarded connections, in shared memory: slot p contains the address of
+# the client whose connection has been forwarded from the local port p.
+class ClientAddressTable(object):
+
+    # create is True in the Distributor (that writes the table), False in the workers.
+    def __init__(self, name=None, create=False):
+        self.memory = shared_memory.SharedMemory(name=name, create=create, size=_PORTS * _SLOT_SIZE)
+        self.name = self.memory.name
+        self.owner = create
+        if not create:
+            # the table belongs to the Distributor: a worker that exits must not remove it.
+            resource_tracker.unregister(self.memory._name, "shared_memory")
+
+    def set(self, local_port, address):
+        ip = ipaddress.ip_address(address[0].split("%", 1)[0])
+        _SLOT.pack_into(self.memory.buf, local_port * _SLOT_SIZE, ip.version, ip.packed, address[1])
+
+    # Returns the (ip, port) forwarded from local_port, or None.
+    def get(self, local_port):
+        version, packed, port = _SLOT.unpack_from(self.memory.buf, local_port * _SLOT_SIZE)
+        if version == 4:
+            ip = ipaddress.IPv4Address(packed[:4])
+        elif version == 6:
+            ip = ipaddress.IPv6Address(packed)
+            # the clients of an IPv4 network are shown as such, as a not sharded interceptor would show them.
+            ip = ip.ipv4_mapped or ip
+        else:
+            return None
+        return str(ip), port
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# mitmproxy addon of the workers: restores the address of the clients forwarded by the Distributor. It must be
+# added before the other addons.
+class ClientAddressAddon(object):
+
+    def __init__(self, table):
+        self.table = table
+
+    def clientconnect(self, layer):
+        client_conn = layer.client_conn
+        address = self.table.get(client_conn.address[1])
+        if address is not None:
+            client_conn.address = address
+            client_conn.ip_address = address
+
+
+class Distributor(object):
+
+    # worker_ports are the local ports of the workers, table the ClientAddressTable they read.
+    def __init__(self, listen_host, listen_port, worker_ports, table):
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.worker_ports = list(worker_ports)
+        self.table = table
+        self.connections = [0] * len(self.worker_ports)
+        self.failures = 0
+
+    # Returns the worker of the client with IP address ip: always the same one.
+    def worker_for(self, ip):
+        return zlib.crc32(ip.encode()) % len(self.worker_ports)
+
+    async def __connect(self, worker, client_address):
+        loop = asyncio.get_running_loop()
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        upstream.setblocking(False)
+        upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            # the local port is chosen before connecting: the worker will find the client address in its slot.
+            upstream.bind(("127.0.0.1", 0))
+            self.table.set(upstream.getsockname()[1], client_address)
+            await loop.sock_connect(upstream, ("127.0.0.1", self.worker_ports[worker]))
+        except OSError:
+            upstream.close()
+            raise
+        return await asyncio.open_connection(sock=upstream)
+
+    @staticmethod
+    async def __relay(reader, writer):
+        try:
+            while True:
+                data = await reader.read(RELAY_CHUNK)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            try:
+                if writer.can_write_eof():
+                    writer.write_eof()
+            except (ConnectionError, OSError):
+                pass
+
+    async def __handle(self, client_reader, client_writer):
+        client_address = client_writer.get_extra_info("peername")
+        client_socket = client_writer.get_extra_info("socket")
+        if client_socket is not None:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        worker = self.worker_for(client_address[0])
+        upstream = None
+        # if the worker of the client is down the next ones are tried: the client loses its affinity, but not the
+        # connection.
+        for attempt in range(len(self.worker_ports)):
+            candidate = (worker + attempt) % len(self.worker_ports)
+            try:
+                upstream = await self.__connect(candidate, client_address)
+                self.connections[candidate] += 1
+                break
+            except OSError:
+                self.failures += 1
+        if upstream is None:
+            client_writer.close()
+            return
+        upstream_reader, upstream_writer = upstream
+        await asyncio.gather(self.__relay(client_reader, upstream_writer),
+                             self.__relay(upstream_reader, client_writer))
+        for writer in (upstream_writer, client_writer):
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.__handle, self.listen_host, self.listen_port,
+                                            reuse_address=True)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+# Starts the workers, forwards the connections to them until the interceptor is interrupted (Ctrl+C), then stops
+# them and merges their shards. worker_command(n, port, table name) returns the command line of worker n.
+class ShardSupervisor(object):
+
+    def __init__(self, worker_command, workers, listen_host, listen_port, base_port, out_folder, catalog=None):
+        self.worker_command = worker_command
+        self.worker_ports = [base_port + n for n in range(workers)]
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.out_folder = out_folder
+        self.catalog = catalog
+        self.processes = []
+
+    @staticmethod
+    def __interrupt(signum, frame):
+        raise KeyboardInterrupt()
+
+    def run(self):
+        # the workers must be stopped (and their shards merged) even when the interceptor is terminated
+        # (e.g. docker stop): otherwise they would keep running in their own process groups.
+        signal.signal(signal.SIGINT, self.__interrupt)
+        signal.signal(signal.SIGTERM, self.__interrupt)
+        table = ClientAddressTable(create=True)
+        try:
+            # the workers are in their own process group: Ctrl+C reaches only the supervisor, that stops each of
+            # them once (a second interrupt could stop a worker while it is saving its sessions).
+            for n, port in enumerate(self.worker_ports):
+                self.processes.append(subprocess.Popen(self.worker_command(n, port, table.name),
+                                                       start_new_session=True))
+            distributor = Distributor(self.listen_host, self.listen_port, self.worker_ports, table)
+            print('Distributing the connections to %d workers (ports %d-%d)...'
+                  % (len(self.worker_ports), self.worker_ports[0], self.worker_ports[-1]))
+            try:
+                distributor.run()
+            except KeyboardInterrupt:
+                print('KeyboardInterrupt received, stopping the workers.')
+            print('Connections per worker:', distributor.connections)
+        finally:
+            self.stop_workers()
+            table.close()
+        moved = merge_shards(self.out_folder, self.catalog)
+        print('Merged', moved, 'session(s) from the shards of the workers.')
+
+    def stop_workers(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        for process in self.processes:
+            try:
+                process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                print('Worker', process.pid, 'did not stop in time: killing it.')
+                process.kill()
+                process.wait()
+
+
+def _unique_destination(destination):
+    # two workers could save a session of the same task at the same time: the later one gets a suffix.
+    candidate, n = destination, 1
+    while os.path.exists(candidate):
+        candidate = "%s_%d" % (destination, n)
+        n += 1
+    return candidate
+
+
+# Moves the sessions (and the blobs) saved in the shards of out_folder to out_folder. Returns the number of moved
+# sessions. The catalog of out_folder, if given, indexes the moved sessions.
+def merge_shards(out_folder, catalog=None):
+    out_folder = str(out_folder)
+    shards_root = os.path.join(out_folder, SHARDS_FOLDER)
+    if not os.path.isdir(shards_root):
+        return 0
+    moved = 0
+    for shard in sorted(os.listdir(shards_root)):
+        shard_path = os.path.join(shards_root, shard)
+        if not os.path.isdir(shard_path):
+            continue
+        for task in sorted(os.listdir(shard_path)):
+            task_path = os.path.join(shard_path, task)
+            if not os.path.isdir(task_path):
+                # e.g. the catalog of the shard, that is rebuilt by the catalog of out_folder.
+                continue
+            if task == BLOB_FOLDER:
+                # the same blob can be in more shards: it is stored once.
+                for folder, _, files in os.walk(task_path):
+                    for name in files:
+                        source = os.path.join(folder, name)
+                        target = os.path.join(out_folder, BLOB_FOLDER, os.path.relpath(source, task_path))
+                        if os.path.exists(target):
+                            os.remove(source)
+                        else:
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            shutil.move(source, target)
+                continue
+            for start_time in sorted(os.listdir(task_path)):
+                session_path = os.path.join(task_path, start_time)
+                destination = _unique_destination(os.path.join(out_folder, task, start_time))
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.move(session_path, destination)
+                moved += 1
+        shutil.rmtree(shard_path, ignore_errors=True)
+    if not os.listdir(shards_root):
+        os.rmdir(shards_root)
+    if catalog is not None and moved:
+        catalog.rebuild(out_folder)
+    return moved
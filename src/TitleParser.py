@@ -0,0 +1,110 @@
+# Description: this file contains the class TitleParser, a subclass of HTMLParser, used to get the title from
+#              the http response intercepted by mitmproxy. It is the successor of the Parser class (see old/Parser.py):
+#              the response body is fed in small chunks and the parsing stops as soon as </title> is met, or when
+#              a byte budget has been consumed, so that the cost of naming a task doesn't depend on the page size.
+# Notes:
+#           The charset is detected as browsers do (see "prescan a byte stream to determine its encoding" in the
+#           HTML Living Standard): a BOM wins over the content-type header, which wins over a <meta> declaration.
+#           https://html.spec.whatwg.org/multipage/parsing.html#prescan-a-byte-stream-to-determine-its-encoding
+
+
+# html.parser library will be employed to extract the title from the http response received.
+from html.parser import HTMLParser
+
+# Used to decode the chunks incrementally (a multi-byte character could be split between two chunks).
+import codecs
+
+import re
+
+# Number of bytes fed to the parser at once.
+CHUNK_SIZE = 4096
+# Number of bytes after which the search of the title is abandoned.
+DEFAULT_BUDGET = 64 * 1024
+# Number of bytes inspected to find a <meta> charset declaration (as the HTML Living Standard suggests).
+PRESCAN_SIZE = 1024
+
+_BOMS = ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'))
+_CHARSET = re.compile(rb'charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+_META = re.compile(rb'<meta\s[^>]*>', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _lookup(charset):
+    # Returns the canonical python codec name of charset, or None if python doesn't know it.
+    if not charset:
+        return None
+    if isinstance(charset, bytes):
+        charset = charset.decode('ascii', 'ignore')
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+def detect_charset(body, content_type=None, default='utf-8'):
+    # 1. Byte order mark.
+    for bom, charset in _BOMS:
+        if body.startswith(bom):
+            return charset
+    # 2. charset parameter of the content-type header.
+    if content_type:
+        match = _CHARSET.search(content_type.encode('latin-1', 'ignore'))
+        if match is not None and _lookup(match.group(1)) is not None:
+            return _lookup(match.group(1))
+    # 3. <meta charset="..."> or <meta http-equiv="content-type" content="...; charset=..."> in the first bytes.
+    for meta in _META.finditer(body, 0, PRESCAN_SIZE):
+        match = _CHARSET.search(meta.group(0))
+        if match is not None and _lookup(match.group(1)) is not None:
+            return _lookup(match.group(1))
+    return default
+
+
+class TitleParser(HTMLParser):
+
+    def __init__(self):
+        # convert_charrefs makes HTMLParser decode the entities (e.g. &amp;, &#39;) contained into the title.
+        super().__init__(convert_charrefs=True)
+        # Initializing the boolean attribute that shows if the current tag is "title" to False.
+        self.handling_title = False
+        # done is set when </title> is met: there is no reason to keep on parsing the page.
+        self.done = False
+        self._title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title' and not self.done:
+            self.handling_title = True
+        # The title belongs to the head: once the body starts there is no title to look for.
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self.handling_title:
+            self.handling_title = False
+            self.done = True
+
+    def handle_data(self, data):
+        if self.handling_title:
+            self._title_parts.append(data)
+
+    def get_title(self):
+        # The title is returned as a browser shows it: whitespaces are collapsed. None if there is no title.
+        title = _WHITESPACE.sub(' ', ''.join(self._title_parts)).strip()
+        return title if title != '' else None
+
+
+def extract_title(body, content_type=None, budget=DEFAULT_BUDGET, chunk_size=CHUNK_SIZE):
+    # Returns the title of the html page contained into body (bytes), or None if it can't be found within budget.
+    if not body:
+        return None
+    decoder = codecs.getincrementaldecoder(detect_charset(body, content_type))('replace')
+    parser = TitleParser()
+    end = min(len(body), budget)
+    for offset in range(0, end, chunk_size):
+        parser.feed(decoder.decode(body[offset:min(offset + chunk_size, end)]))
+        if parser.done:
+            break
+    else:
+        # The budget ended inside the title: flush what the parser has buffered so far.
+        if parser.handling_title:
+            parser.close()
+    return parser.get_title()
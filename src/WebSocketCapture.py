@@ -0,0 +1,124 @@
+# Description: WebSocketCapture records the messages of a WebSocket connection opened by a pentester while the
+#              recording is on. The messages are kept in a ring buffer (one per connection) and are added to the
+#              session as a WebSocketTransaction: the transaction of the handshake (the http request that upgraded
+#              the connection and its 101 response) with a "websocket" field that contains the messages, each one
+#              with its time, direction ("client" or "server"), type ("text" or "binary") and length.
+# Notes:
+#           - The ring buffer is bounded (WebSocketLimits): when it is full the oldest messages are dropped or, if the
+#             session is streamed to the disk, written to the capture log as a segment of the connection. So a chatty
+#             socket never grows the memory of the interceptor, and a socket that stays open for the whole session is
+#             still recorded when the session ends (its messages so far are added as a segment).
+#           - Messages larger than max_message_size keep only their head and their tail (as the bodies, see
+#             CapturePolicy.py); after max_connection_bytes recorded bytes the messages of a connection are only
+#             counted.
+#           - The hooks of mitmproxy keep every message in flow.messages: HTTPLogger trims it to the last message.
+
+import collections
+import threading
+
+from HTTPTransaction import HTTPTransaction
+from CapturePolicy import CapturePolicy
+
+# Content types given to the messages to encode them as the bodies are encoded.
+_TEXT_TYPE = "text/plain; charset=utf-8"
+_BINARY_TYPE = "application/octet-stream"
+
+
+class WebSocketLimits(object):
+
+    def __init__(self, max_messages=1000, buffer_size=4 * 1024 * 1024, max_message_size=64 * 1024,
+                 max_connection_bytes=64 * 1024 * 1024):
+        # messages and bytes held by the ring buffer of a connection.
+        self.max_messages = max_messages
+        self.buffer_size = buffer_size
+        # bytes recorded for a single message (head and tail).
+        self.max_message_size = max_message_size
+        # bytes recorded for a connection, after which its messages are only counted.
+        self.max_connection_bytes = max_connection_bytes
+
+
+# A transaction of the handshake of a WebSocket connection, together with (some of) its messages.
+class WebSocketTransaction(HTTPTransaction):
+
+    def __init__(self, handshake_flow, client_name, messages, summary, blob_store=None, capture_policy=None):
+        super().__init__(handshake_flow, client_name, blob_store, capture_policy)
+        self.messages = messages
+        self.summary = summary
+
+    # the messages are encoded only here, out of the hooks of the proxy.
+    @staticmethod
+    def __message_record(message):
+        timestamp, from_client, text, data, length, head_length = message
+        content_type = _TEXT_TYPE if text else _BINARY_TYPE
+        content = CapturePolicy.encode(data, content_type, length, head_length) if data else ""
+        return {"time": timestamp, "direction": "client" if from_client else "server",
+                "type": "text" if text else "binary", "length": length, "content": content}
+
+    def get_dict(self):
+        dict_record = super().get_dict()
+        websocket = dict(self.summary)
+        websocket["messages"] = [self.__message_record(message) for message in self.messages]
+        dict_record["websocket"] = websocket
+        return dict_record
+
+
+class WebSocketCapture(object):
+
+    def __init__(self, handshake_flow, limits=None):
+        self.handshake_flow = handshake_flow
+        self.limits = limits if limits is not None else WebSocketLimits()
+        # (timestamp, from client, text, bytes kept, length, head length if truncated)
+        self.messages = collections.deque()
+        self.buffered_bytes = 0
+        self.recorded_bytes = 0
+        # counters of the whole connection.
+        self.total_messages = 0
+        self.dropped_messages = 0
+        self.segment = 0
+        # the messages are added by the hook of the proxy and taken by the end of the session.
+        self.lock = threading.Lock()
+
+    # Adds a message (a mitmproxy WebSocketMessage). Returns True if the ring buffer is full: the caller can flush it
+    # (streaming sessions), otherwise the oldest messages are dropped by the next call.
+    def add(self, message):
+        content = message.content
+        text = isinstance(content, str)
+        data = content.encode("utf-8") if text else bytes(content)
+        length = len(data)
+        limits = self.limits
+        with self.lock:
+            self.total_messages += 1
+            if self.recorded_bytes >= limits.max_connection_bytes:
+                self.dropped_messages += 1
+                return False
+            head_length = None
+            if length > limits.max_message_size:
+                head_length = limits.max_message_size - limits.max_message_size // 2
+                data = data[:head_length] + data[length - limits.max_message_size // 2:]
+            self.messages.append((message.timestamp, message.from_client, text, data, length, head_length))
+            self.buffered_bytes += len(data)
+            self.recorded_bytes += len(data)
+            while len(self.messages) > 1 and (len(self.messages) > limits.max_messages or
+                                              self.buffered_bytes > limits.buffer_size):
+                self.buffered_bytes -= len(self.messages.popleft()[3])
+                self.dropped_messages += 1
+            return len(self.messages) >= limits.max_messages or self.buffered_bytes >= limits.buffer_size
+
+    # Returns the WebSocketTransaction with the messages buffered so far (None if there are none and final is False),
+    # and empties the buffer. final is True when the connection has ended. wsflow is the mitmproxy WebSocketFlow.
+    # client_name is the name of the client, as looked up for the handshake.
+    def flush(self, client_name, wsflow=None, final=False, blob_store=None, capture_policy=None):
+        with self.lock:
+            if not self.messages and not final:
+                return None
+            messages = list(self.messages)
+            self.messages.clear()
+            self.buffered_bytes = 0
+            self.segment += 1
+            summary = {"segment": self.segment, "final": final, "total_messages": self.total_messages,
+                       "dropped_messages": self.dropped_messages}
+        if final and wsflow is not None:
+            summary.update({"close_sender": wsflow.close_sender, "close_code": int(wsflow.close_code),
+                            "close_reason": wsflow.close_reason,
+                            "error": str(wsflow.error) if wsflow.error is not None else None})
+        return WebSocketTransaction(self.handshake_flow, client_name, messages, summary, blob_store, capture_policy)
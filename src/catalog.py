@@ -0,0 +1,81 @@
+# Description: this script manages the catalog of the recorded sessions (out/catalog.sqlite) by means of
+#              DatasetCatalog class.
+# Notes:
+#       python catalog.py rebuild                                  indexes the sessions of out/ (new or changed)
+#       python catalog.py sessions [-task TASK]                    lists the indexed sessions
+#       python catalog.py query -method POST -path "/vulnerabilities/sqli%"
+#                                                                  lists the matching transactions
+#       Add -json to query to print the whole transactions (each one is read from its recording).
+
+# Command line argument parser.
+import argparse
+import json
+import sys
+import time
+
+# DatasetCatalog class.
+from DatasetCatalog import *
+
+
+def main():
+    # delegate parsing task to argparse library.
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-out", "--out", default="../out",
+                            help="the folder that contains the recorded sessions and the catalog (default: ../out)")
+    commands = arg_parser.add_subparsers(dest="command")
+
+    rebuild_parser = commands.add_parser("rebuild", help="index the sessions contained in the output folder")
+    rebuild_parser.add_argument("-full", "--full", action="store_true",
+                                help="index again even the sessions that have not changed")
+
+    sessions_parser = commands.add_parser("sessions", help="list the indexed sessions")
+    sessions_parser.add_argument("-task", "--task", default=None, help="list only the sessions of this task")
+
+    query_parser = commands.add_parser("query", help="list the transactions that match every given condition")
+    query_parser.add_argument("-method", "--method", default=None)
+    query_parser.add_argument("-path", "--path", default=None, help="SQL LIKE pattern (e.g. /vulnerabilities/sqli%%)")
+    query_parser.add_argument("-url", "--url", default=None, help="SQL LIKE pattern")
+    query_parser.add_argument("-host", "--host", default=None)
+    query_parser.add_argument("-status", "--status", type=int, default=None)
+    query_parser.add_argument("-task", "--task", default=None)
+    query_parser.add_argument("-client", "--client", default=None, help="IP address of the client")
+    query_parser.add_argument("-parameter", "--parameter", default=None,
+                              help="name of a parameter the request must contain")
+    query_parser.add_argument("-limit", "--limit", type=int, default=None)
+    query_parser.add_argument("-json", "--json", action="store_true",
+                              help="print the whole transactions as JSON lines")
+    args = arg_parser.parse_args()
+
+    if args.command is None:
+        arg_parser.print_help()
+        sys.exit(1)
+
+    catalog = open_catalog(args.out)
+    start = time.perf_counter()
+
+    if args.command == "rebuild":
+        indexed, failed = catalog.rebuild(args.out, args.full)
+        for recording, error in failed:
+            print("Could not index", recording, ":", error)
+        print("Indexed %d session(s) in %.2f s." % (indexed, time.perf_counter() - start))
+
+    elif args.command == "sessions":
+        for session in catalog.sessions(args.task):
+            print(session["session_id"], session["transactions_count"], "transactions",
+                  session["actions_count"], "actions", session["url"] or "")
+
+    elif args.command == "query":
+        rows = catalog.find_transactions(args.method, args.path, args.url, args.host, args.status, args.task,
+                                         args.client, args.parameter, args.limit)
+        for row in rows:
+            if args.json:
+                print(json.dumps(DatasetCatalog.read_transaction(row)))
+            else:
+                print(row["session_id"], row["transaction_id"], row["method"], row["status_code"], row["url"])
+        print("%d transaction(s) found in %.3f s." % (len(rows), time.perf_counter() - start), file=sys.stderr)
+
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
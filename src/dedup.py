@@ -0,0 +1,74 @@
+# Description: this script finds the near-duplicate transactions across all the sessions recorded in out/ by means of
+#              CorpusDeduplicator class (see Deduplication.py), and optionally removes them from the recordings.
+# Notes:
+#       python dedup.py scan [-full] [-threshold 0.8]      fingerprints the sessions of out/ not yet scanned
+#       python dedup.py report [-limit N]                  lists the near-duplicates found
+#       python dedup.py drop                               rewrites the recordings without the near-duplicates that
+#                                                          have no actions (and updates the catalog)
+#       The fingerprints are kept in out/dedup.sqlite: a scan after new sessions have been recorded only reads them.
+
+# Command line argument parser.
+import argparse
+import sys
+import time
+
+# CorpusDeduplicator class.
+from Deduplication import *
+from DatasetCatalog import open_catalog
+
+
+def main():
+    # delegate parsing task to argparse library.
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-out", "--out", default="../out",
+                            help="the folder that contains the recorded sessions (default: ../out)")
+    arg_parser.add_argument("-threshold", "--threshold", type=float, default=THRESHOLD,
+                            help="estimated similarity above which a transaction is a near-duplicate (default: %.1f)"
+                                 % THRESHOLD)
+    commands = arg_parser.add_subparsers(dest="command")
+
+    scan_parser = commands.add_parser("scan", help="find the near-duplicates of the sessions not yet scanned")
+    scan_parser.add_argument("-full", "--full", action="store_true", help="scan again every session")
+    scan_parser.add_argument("-workers", "--workers", type=int, default=None,
+                             help="number of processes fingerprinting the sessions in parallel"
+                                  + " (default: number of cores)")
+
+    report_parser = commands.add_parser("report", help="list the near-duplicates found by the last scan")
+    report_parser.add_argument("-limit", "--limit", type=int, default=None)
+
+    drop_parser = commands.add_parser("drop", help="remove the near-duplicates without actions from the recordings")
+    drop_parser.add_argument("-no_catalog", "--no_catalog", action="store_true",
+                             help="don't update the catalog of the output folder")
+    args = arg_parser.parse_args()
+
+    if args.command is None:
+        arg_parser.print_help()
+        sys.exit(1)
+
+    deduplicator = CorpusDeduplicator(args.out, threshold=args.threshold, workers=getattr(args, "workers", None))
+    start = time.perf_counter()
+
+    if args.command == "scan":
+        sessions, transactions, duplicates, failed = deduplicator.scan(args.full)
+        for recording, error in failed:
+            print("Could not scan", recording, ":", error)
+        print("Scanned %d session(s), %d transaction(s) in %.2f s: %d near-duplicate(s) found."
+              % (sessions, transactions, time.perf_counter() - start, duplicates))
+
+    elif args.command == "report":
+        for row in deduplicator.duplicates(args.limit):
+            print(row["session_id"], row["transaction_id"], "duplicates", row["duplicate_of_session"],
+                  row["duplicate_of_transaction"], "(%.2f)" % row["similarity"],
+                  "dropped" if row["dropped"] else "%d actions" % row["actions_count"])
+
+    elif args.command == "drop":
+        catalog = open_catalog(args.out) if not args.no_catalog else None
+        print("Dropped %d transaction(s) in %.2f s." % (deduplicator.drop(catalog), time.perf_counter() - start))
+        if catalog is not None:
+            catalog.close()
+
+    deduplicator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Description: this script exports the sessions recorded in out/ as columnar tables (Parquet or Arrow IPC) by means
+#              of DatasetExporter class.
+# Notes:
+#       Example: python export_dataset.py -out ../out -destination ../export -workers 8
+
+# Command line argument parser.
+import argparse
+import os
+import sys
+import time
+
+# DatasetExporter class.
+from DatasetExporter import *
+
+
+# the exporting workers import this module again when they are spawned.
+def main():
+    # delegate parsing task to argparse library.
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-out", "--out", default="../out",
+                            help="the folder that contains the recorded sessions (default: ../out)")
+    arg_parser.add_argument("-destination", "--destination", default="../export",
+                            help="the folder where the tables will be written (it must not contain a previous export)")
+    arg_parser.add_argument("-format", "--format", choices=sorted(FORMATS), default="parquet",
+                            help="format of the tables (default: parquet)")
+    arg_parser.add_argument("-workers", "--workers", type=int, default=None,
+                            help="number of processes exporting the sessions in parallel (default: number of cores)")
+    arg_parser.add_argument("-batch_size", "--batch_size", type=int, default=BATCH_SIZE,
+                            help="number of rows written at once in each table")
+    arg_parser.add_argument("-no_bodies", "--no_bodies", action="store_true",
+                            help="don't export the bodies of requests and responses")
+    args = arg_parser.parse_args()
+
+    if os.path.isdir(args.destination) and os.listdir(args.destination):
+        print("Error! The destination folder", args.destination, "is not empty!\n")
+        sys.exit(1)
+
+    try:
+        exporter = DatasetExporter(args.out, args.destination, args.format, args.workers, args.batch_size,
+                                   not args.no_bodies)
+    except ImportError as error:
+        print("Error!", error, "\n")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    totals, failed = exporter.export()
+    for recording, error in failed:
+        print("Could not export", recording, ":", error)
+    print("Exported in %.2f s:" % (time.perf_counter() - start),
+          ", ".join(str(totals[table]) + " " + table for table in TABLES))
+
+
+if __name__ == "__main__":
+    main()
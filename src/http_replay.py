@@ -0,0 +1,64 @@
+# Description: this script re-sends the HTTP requests of recorded sessions without a browser, by means of
+#              HTTPReplayer, and reports latency and throughput.
+# Notes:
+#       e.g. python3 http_replay.py -recordings ../out/ -target http://localhost:8080 -concurrency 32
+#       aiohttp is needed: pip install aiohttp
+
+# Command line argument parser.
+import argparse
+import json
+import sys
+
+from HTTPReplayer import HTTPReplayer
+# recordings can be given as files or folders, as in the batch mode of replay.py.
+from ReplayFarm import collect_recordings
+
+
+def main():
+    # delegate parsing task to argparse library.
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-recordings", "--recordings", nargs="+", required=True,
+                            help="recordings and/or folders containing recordings (e.g. out/) to replay.")
+    arg_parser.add_argument("-target", "--target", default=None,
+                            help="scheme, host and port that replace the recorded ones (e.g. http://localhost:8080).")
+    arg_parser.add_argument("-concurrency", "--concurrency", type=int, default=16,
+                            help="maximum number of requests in flight.")
+    arg_parser.add_argument("-unordered", "--unordered", action="store_true",
+                            help="send the requests of a session without waiting for the previous ones.")
+    arg_parser.add_argument("-timeout", "--timeout", type=float, default=30,
+                            help="timeout (seconds) of every request.")
+    arg_parser.add_argument("-report", "--report", default=None,
+                            help="file where the report and the outcome of every recording are saved (JSON).")
+    args = arg_parser.parse_args()
+
+    recordings = collect_recordings(args.recordings)
+    if not recordings:
+        print("Error! No recording found in " + ", ".join(args.recordings) + "\n")
+        sys.exit(1)
+
+    try:
+        replayer = HTTPReplayer(recordings, args.target, args.concurrency, not args.unordered, args.timeout)
+    except ImportError as error:
+        print("Error! " + str(error) + "\n")
+        sys.exit(1)
+
+    report, outcomes = replayer.run()
+    for outcome in outcomes:
+        if outcome["error"] is not None:
+            print("[FAILED] %s: %s" % (outcome["recording"], outcome["error"]))
+    latency = report["latency_ms"]
+    print("%d requests (%d errors, %d with a different status code) in %.2f s: %.1f requests/s."
+          % (report["requests"], report["errors"], report["status_mismatches"], report["seconds"],
+             report["requests_per_second"]))
+    if report["truncated"]:
+        print("%d requests not sent: their body has been recorded truncated." % report["truncated"])
+    if latency["mean"] is not None:
+        print("latency (ms): mean %.1f, p50 %.1f, p90 %.1f, p99 %.1f, max %.1f"
+              % (latency["mean"], latency["p50"], latency["p90"], latency["p99"], latency["max"]))
+    if args.report is not None:
+        with open(args.report, "w") as report_file:
+            json.dump({"report": report, "outcomes": outcomes}, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
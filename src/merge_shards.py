@@ -0,0 +1,29 @@
+# Description: this script moves the sessions saved by the workers of a sharded interceptor (Interceptor.py -workers N)
+#              from out/shards/ to out/, as the interceptor does when it stops (see Sharding.py).
+# Notes:
+#       python merge_shards.py [-out ../out] [-no_catalog]
+#       Needed only if the interceptor has been stopped before merging the shards (e.g. killed).
+
+# Command line argument parser.
+import argparse
+
+from DatasetCatalog import open_catalog
+from Sharding import merge_shards
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-out", "--out", default="../out",
+                            help="the folder that contains the shards of the workers (default: ../out)")
+    arg_parser.add_argument("-no_catalog", "--no_catalog", action="store_true",
+                            help="don't index the merged sessions in the catalog of the output folder")
+    args = arg_parser.parse_args()
+
+    catalog = open_catalog(args.out) if not args.no_catalog else None
+    print("Merged", merge_shards(args.out, catalog), "session(s).")
+    if catalog is not None:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
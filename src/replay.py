@@ -3,29 +3,91 @@
 # Description: this script performs the replay of the recorded session by means of Player class.
 # Notes:
 #       Not so much to say about this script, it only performs a arguments check and instantiates a Player.
+#       With -batch many recordings (files or folders, e.g. out/) are replayed by a pool of headless Chrome instances
+#       (see ReplayFarm.py), e.g. python3 replay.py -batch ../out/ -workers 4 -retries 2 -report report.json
+#       -speed, -max_pause and -event_driven shorten the recorded think time of the pentester, e.g.
+#       python3 replay.py -recording session_recording.json -speed 10 -max_pause 2
 
 # Command line argument parser.
 import argparse
 
-# Player class.
-from Player import *
+# JSON report of the batch mode.
+import json
+import sys
 
-# delegate parsing task to argparse library.
-arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("-recording", "--recording", default='null',
-                        help="recording must contain the name of the file that contain the recording to reproduce."
-                             + "WAPT-Dataset-Collector saves recording files in out/ folder.")
-args = arg_parser.parse_args()
+# ReplayFarm replays many recordings in parallel.
+from ReplayFarm import ReplayFarm, collect_recordings
 
 
-# proceed only if -recording is not null, a recording to be reproduced must be provided.
-if args.recording != 'null':
-    player = Player(args.recording)
-    player.replay_actions()
-else:
-    print("Error! You must  provide the path to the recording to replay!\n")
+def print_outcome(outcome):
+    if outcome["status"] == "ok":
+        print("[OK]     %s (%.1f s, %d attempt(s))" % (outcome["recording"], outcome["seconds"], outcome["attempts"]))
+    else:
+        print("[FAILED] %s: %s" % (outcome["recording"], outcome["error"]))
 
 
+# batch workers import this module again when they are spawned.
+def main():
+    # delegate parsing task to argparse library.
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("-recording", "--recording", default='null',
+                            help="recording must contain the name of the file that contain the recording to"
+                                 + " reproduce. WAPT-Dataset-Collector saves recording files in out/ folder.")
+    arg_parser.add_argument("-batch", "--batch", nargs="+", default=None,
+                            help="recordings and/or folders containing recordings (e.g. out/) to replay in parallel.")
+    arg_parser.add_argument("-workers", "--workers", type=int, default=None,
+                            help="number of Chrome instances running at the same time in batch mode.")
+    arg_parser.add_argument("-retries", "--retries", type=int, default=1,
+                            help="number of times a failed replay is retried in batch mode.")
+    arg_parser.add_argument("-max_uses", "--max_uses", type=int, default=50,
+                            help="number of recordings replayed by a Chrome instance of the batch mode before it is"
+                                 + " restarted (1: a new Chrome for every recording).")
+    arg_parser.add_argument("-no_headless", "--no_headless", action="store_true",
+                            help="show the Chrome windows in batch mode.")
+    arg_parser.add_argument("-report", "--report", default=None,
+                            help="file where the outcome of every replay of the batch is saved (JSON).")
+    arg_parser.add_argument("-speed", "--speed", type=float, default=1.0,
+                            help="replay speed factor: the recorded pauses between the actions are divided by it.")
+    arg_parser.add_argument("-max_pause", "--max_pause", type=float, default=None,
+                            help="maximum pause (seconds) between two actions.")
+    arg_parser.add_argument("-event_driven", "--event_driven", action="store_true",
+                            help="ignore the recorded pauses: perform every action as soon as the page is loaded"
+                                 + " and the network is idle.")
+    arg_parser.add_argument("-ready_timeout", "--ready_timeout", type=float, default=30,
+                            help="maximum time (seconds) waited for a page to be ready.")
+    args = arg_parser.parse_args()
+    player_options = {"speed": args.speed, "max_pause": args.max_pause, "event_driven": args.event_driven,
+                      "ready_timeout": args.ready_timeout}
 
+    if args.batch is not None:
+        recordings = collect_recordings(args.batch)
+        if not recordings:
+            print("Error! No recording found in " + ", ".join(args.batch) + "\n")
+            sys.exit(1)
+        farm = ReplayFarm(recordings, args.workers, args.retries, not args.no_headless, player_options,
+                          args.max_uses)
+        print("Replaying " + str(len(recordings)) + " recordings with " + str(farm.workers) + " workers.")
+        outcomes, report = farm.run(print_outcome)
+        print("%d/%d recordings replayed (%d retried) in %.1f s: %.2f recordings/minute."
+              % (report["succeeded"], report["recordings"], report["retried"], report["seconds"],
+                 report["recordings_per_minute"]))
+        if args.report is not None:
+            with open(args.report, "w") as report_file:
+                json.dump({"report": report, "outcomes": outcomes}, report_file, indent=2)
+        sys.exit(0 if report["failed"] == 0 else 1)
+    # proceed only if -recording is not null, a recording to be reproduced must be provided.
+    elif args.recording != 'null':
+        # Player class (imported here: the batch mode imports it in the worker processes).
+        from Player import Player
+        try:
+            player = Player(args.recording, **player_options)
+        except ValueError as exception:
+            print(exception)
+            sys.exit(1)
+        player.replay_actions()
+    else:
+        print("Error! You must  provide the path to the recording to replay!\n")
 
 
+if __name__ == "__main__":
+    main()
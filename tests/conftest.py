@@ -0,0 +1,10 @@
+# Description: configuration of the pytest suite: the modules under test live in src/ and import each other by their
+#              names (e.g. "from Session import Session"), as they do when the interceptor runs from there.
+# Notes:
+#       Run the suite from the repository root:
+#           python -m pytest tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
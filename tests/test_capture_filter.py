@@ -0,0 +1,105 @@
+# Description: tests of the capture rules (CaptureFilter.py).
+# Notes:
+
+import json
+import re
+import types
+
+import pytest
+
+from CaptureFilter import CAPTURE, EXCLUDE, REQUEST, RESPONSE_HEADERS, RESPONSE, CaptureFilter, load_rules
+
+
+# The attributes of a mitmproxy flow that the rules read. The header names are lowercase, as the rules ask them.
+def flow(url="http://dvwa/vulnerabilities/sqli/?id=1", method="GET", status_code=200, headers=None, content=b""):
+    host, _, path = url.split("://", 1)[1].partition("/")
+    request = types.SimpleNamespace(pretty_host=host, path="/" + path, pretty_url=url, method=method)
+    response = types.SimpleNamespace(status_code=status_code, headers=headers or {}, raw_content=content)
+    return types.SimpleNamespace(request=request, response=response)
+
+
+def test_default_rules_record_successful_responses_except_static_resources():
+    capture_filter = CaptureFilter()
+    # the url alone decides the static resources, before the request is sent.
+    assert capture_filter.decide(flow("http://dvwa/static/style.css"), REQUEST) is False
+    assert capture_filter.decide(flow(), REQUEST) is None
+    assert capture_filter.decide(flow(), RESPONSE_HEADERS) is True
+    assert capture_filter.decide(flow(status_code=302), RESPONSE_HEADERS) is False
+
+
+def test_first_matching_rule_decides():
+    rules = {"rules": [{"action": EXCLUDE, "path": "/login.php"},
+                       {"action": CAPTURE, "host": "dvwa"},
+                       {"action": EXCLUDE, "method": "GET"}]}
+    capture_filter = CaptureFilter(rules)
+    assert capture_filter.decide(flow("http://dvwa/login.php"), REQUEST) is False
+    assert capture_filter.decide(flow("http://dvwa/index.php"), REQUEST) is True
+    # the first rule doesn't match, the second one does: the third one is never reached.
+    assert capture_filter.decide(flow("http://DVWA/index.php", method="POST"), REQUEST) is True
+    assert capture_filter.decide(flow("http://other/index.php"), REQUEST) is False
+
+
+@pytest.mark.parametrize("default, expected", [(CAPTURE, True), (EXCLUDE, False)])
+def test_default_action_applies_when_no_rule_matches(default, expected):
+    capture_filter = CaptureFilter({"default": default, "rules": [{"action": CAPTURE, "method": "PUT"}]})
+    assert capture_filter.decide(flow(method="GET"), REQUEST) is expected
+    # without rules the default is decided at once.
+    assert CaptureFilter({"default": default}).decide(flow(), REQUEST) is expected
+
+
+def test_status_codes_lists_and_ranges():
+    capture_filter = CaptureFilter({"default": EXCLUDE, "rules": [{"action": CAPTURE, "status": ["200-299", 302]}]})
+    decisions = {status: capture_filter.decide(flow(status_code=status), RESPONSE_HEADERS)
+                 for status in (199, 200, 250, 299, 300, 302, 404)}
+    assert decisions == {199: False, 200: True, 250: True, 299: True, 300: False, 302: True, 404: False}
+
+
+def test_request_stage_waits_for_response_conditions():
+    rules = {"default": EXCLUDE, "rules": [{"action": CAPTURE, "method": "POST", "content_type": "text/html"},
+                                           {"action": CAPTURE, "path": "/api/*"}]}
+    capture_filter = CaptureFilter(rules)
+    # the first rule could still match: the second one can't decide before it.
+    assert capture_filter.decide(flow("http://dvwa/api/users", method="POST"), REQUEST) is None
+    # the first rule can't match anymore: the second one decides.
+    assert capture_filter.decide(flow("http://dvwa/api/users", method="GET"), REQUEST) is True
+    assert capture_filter.decide(flow("http://dvwa/index.php", method="GET"), REQUEST) is False
+
+    html = flow("http://dvwa/index.php", method="POST", headers={"content-type": "text/html; charset=utf-8"})
+    assert capture_filter.decide(html, RESPONSE_HEADERS) is True
+    json_response = flow("http://dvwa/index.php", method="POST", headers={"content-type": "application/json"})
+    assert capture_filter.decide(json_response, RESPONSE_HEADERS) is False
+
+
+def test_size_is_decided_in_the_response_stage_without_content_length():
+    capture_filter = CaptureFilter({"default": EXCLUDE, "rules": [{"action": CAPTURE, "max_size": 10}]})
+    declared = flow(headers={"content-length": "100"})
+    assert capture_filter.decide(declared, RESPONSE_HEADERS) is False
+    undeclared = flow(content=b"0123456789")
+    assert capture_filter.decide(undeclared, RESPONSE_HEADERS) is None
+    assert capture_filter.decide(undeclared, RESPONSE) is True
+    assert capture_filter.decide(flow(content=b"x" * 11), RESPONSE) is False
+
+
+def write_rules(tmp_path, rules):
+    path = tmp_path / "rules.json"
+    path.write_text(rules if isinstance(rules, str) else json.dumps(rules))
+    return str(path)
+
+
+def test_load_rules_accepts_a_list_of_rules(tmp_path):
+    rules = load_rules(write_rules(tmp_path, [{"action": EXCLUDE, "host": ["*.google.com", "*.gstatic.com"]}]))
+    assert rules == {"rules": [{"action": EXCLUDE, "host": ["*.google.com", "*.gstatic.com"]}]}
+    assert CaptureFilter(rules).decide(flow("http://fonts.gstatic.com/font.woff"), REQUEST) is False
+
+
+@pytest.mark.parametrize("rules, error", [
+    ("{not json", ValueError),
+    ({"rules": [{"action": CAPTURE, "hostname": "dvwa"}]}, ValueError),
+    ({"rules": [{"action": "record"}]}, ValueError),
+    ({"default": "drop", "rules": []}, ValueError),
+    ({"rules": [{"status": "two hundred"}]}, ValueError),
+    ({"rules": [{"url_regex": "(unclosed"}]}, re.error),
+])
+def test_load_rules_rejects_malformed_rules(tmp_path, rules, error):
+    with pytest.raises(error):
+        load_rules(write_rules(tmp_path, rules))
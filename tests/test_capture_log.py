@@ -0,0 +1,61 @@
+# Description: tests of the on-disk log of the recorded transactions (CaptureLog.py).
+# Notes:
+
+import os
+
+from CaptureLog import CaptureLog
+
+
+def record(n):
+    return {"url": "http://dvwa/vulnerabilities/xss_r/?name=%d" % n, "request": {"method": "GET"},
+            "response": {"status_code": 200, "content": "<p>caffè \"%d\"\n</p>" % n}}
+
+
+def test_records_are_read_back_in_order(tmp_path):
+    log = CaptureLog(tmp_path / "log")
+    assert [log.append(record(n)) for n in range(5)] == [1, 2, 3, 4, 5]
+    # iterating doesn't need the log to be closed.
+    assert list(log) == [record(n) for n in range(5)]
+    assert len(log) == 5
+    log.close()
+
+
+def test_segments_roll_over_at_segment_size(tmp_path):
+    log = CaptureLog(tmp_path / "log", segment_size=300)
+    for n in range(20):
+        log.append(record(n))
+    log.close()
+    segments = log.segments()
+    assert len(segments) > 1
+    assert [os.path.basename(segment) for segment in segments] == \
+        ["transactions-%06d.jsonl" % n for n in range(1, len(segments) + 1)]
+    # a record is never split: every segment is a valid JSON Lines file, not larger than segment_size (unless a
+    # single record is larger).
+    assert all(os.path.getsize(segment) <= 300 for segment in segments)
+    assert list(log) == [record(n) for n in range(20)]
+
+
+def test_an_existing_log_is_continued(tmp_path):
+    log = CaptureLog(tmp_path / "log", segment_size=300)
+    for n in range(6):
+        log.append(record(n))
+    log.close()
+    segments = len(log.segments())
+
+    # e.g. the log left by a crashed interceptor: its last line has been torn.
+    with open(log.segments()[-1], "ab") as segment:
+        segment.write(b'{"url": "http://dvwa/tor')
+    reopened = CaptureLog(tmp_path / "log", segment_size=300)
+    assert reopened.append(record(6)) == len(reopened)
+    # the new records start a new segment: the existing ones are never rewritten.
+    assert len(reopened.segments()) == segments + 1
+    assert list(reopened) == [record(n) for n in range(7)]
+    reopened.close()
+
+
+def test_remove_deletes_the_log(tmp_path):
+    log = CaptureLog(tmp_path / "log")
+    log.append(record(1))
+    log.remove()
+    assert not os.path.exists(str(tmp_path / "log"))
+    assert len(log) == 0 and list(log) == []
@@ -0,0 +1,108 @@
+# Description: tests of the capture of the bodies (CapturePolicy.py): binary bodies, truncation to head and tail,
+#              spilled bodies and the StreamTee of the streamed responses.
+# Notes:
+
+import os
+
+import pytest
+
+from BlobStore import BlobStore
+from CapturePolicy import CapturePolicy, SpilledBody, StreamTee, StreamedBody, body_bytes
+
+
+def test_text_and_binary_bodies():
+    policy = CapturePolicy()
+    assert policy.capture(b"") == ""
+    assert policy.capture("<p>caffè</p>".encode("utf-8"), "text/html; charset=utf-8") == "<p>caffè</p>"
+    png = b"\x89PNG\r\n\x1a\n\x00\xff"
+    record = policy.capture(png, "image/png")
+    assert record["encoding"] == "base64" and record["length"] == len(png)
+    assert body_bytes(record) == png
+    # a body without content type that is not text.
+    assert body_bytes(policy.capture(b"\xff\xfe\x00", None)) == b"\xff\xfe\x00"
+
+
+def test_truncated_text_keeps_head_and_tail():
+    policy = CapturePolicy({"text/": 10})
+    record = policy.capture(b"0123456789abcdefghij", "text/plain")
+    assert record == {"encoding": "utf-8", "head": "01234", "tail": "fghij", "length": 20, "truncated": True}
+    assert body_bytes(record) == b"01234fghij"
+
+
+def test_truncated_binary_keeps_head_and_tail():
+    policy = CapturePolicy({"image/": 4})
+    record = policy.capture(bytes(range(10)), "image/png")
+    assert record["encoding"] == "base64" and record["truncated"] and record["length"] == 10
+    assert body_bytes(record) == bytes([0, 1, 8, 9])
+
+
+def test_truncation_splitting_a_character():
+    # "è" is encoded in two bytes: the cut of the head falls between them.
+    policy = CapturePolicy({"text/": 4})
+    record = policy.capture("aèbbbb".encode("utf-8"), "text/plain; charset=utf-8")
+    assert record["head"] == "a�" and record["tail"] == "bb"
+
+
+def test_truncated_blob_reference(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"), "gzip")
+    record = CapturePolicy({"": 6}).capture(b"abcdefghijkl", "application/octet-stream", store)
+    assert record["truncated"] and record["length"] == 12 and record["head_length"] == 3
+    assert body_bytes(record, store) == b"abcjkl"
+
+
+def test_spilled_body(tmp_path):
+    policy = CapturePolicy(spill_threshold=8, spill_folder=str(tmp_path))
+    content = b"<html>" + b"x" * 100 + b"</html>"
+    spilled = policy.capture(content, "text/html")
+    assert isinstance(spilled, SpilledBody) and spilled.length == len(content)
+    assert spilled.to_record() == content.decode()
+    spilled.release()
+    assert not os.path.exists(spilled.path)
+
+
+def tee(tmp_path, max_size, content_type="application/octet-stream"):
+    body = StreamedBody(str(tmp_path / "streamed.body"), content_type)
+    return StreamTee(body, max_size), body
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_stream_tee_keeps_head_and_tail(tmp_path, chunk_size):
+    content = bytes(range(256)) * 4
+    stream_tee, body = tee(tmp_path, 100)
+    chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+    # the chunks are forwarded unchanged.
+    assert list(stream_tee(iter(chunks))) == chunks
+    assert body.ready() and not body.aborted
+    assert body.length == len(content) and body.head_length == 50
+    assert body.read() == content[:50] + content[-50:]
+    record = body.to_record()
+    assert record["truncated"] and record["length"] == len(content)
+    assert body_bytes(record) == content[:50] + content[-50:]
+
+
+def test_stream_tee_small_body(tmp_path):
+    stream_tee, body = tee(tmp_path, 100, "text/plain")
+    assert b"".join(stream_tee(iter([b"hello ", b"world"]))) == b"hello world"
+    assert body.head_length is None
+    assert body.to_record() == "hello world"
+
+
+def test_stream_tee_interrupted(tmp_path):
+    stream_tee, body = tee(tmp_path, 100)
+
+    def chunks():
+        yield b"partial"
+        raise ConnectionError("the server closed the connection")
+    with pytest.raises(ConnectionError):
+        list(stream_tee(chunks()))
+    assert body.ready() and body.aborted
+    record = body.to_record()
+    assert record["incomplete"] and body_bytes(record) == b"partial"
+
+
+def test_should_stream():
+    policy = CapturePolicy(stream_threshold=1000)
+    assert policy.should_stream({"content-length": "1001", "content-type": "text/html"})
+    assert not policy.should_stream({"content-length": "1000", "content-type": "application/zip"})
+    assert policy.should_stream({"content-type": "application/zip"})
+    assert not policy.should_stream({"content-type": "text/html"})
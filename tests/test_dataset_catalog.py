@@ -0,0 +1,54 @@
+# Description: tests of the catalog of the dataset (DatasetCatalog.py): the offsets of the transactions found by
+#              rebuild() and the recordings that disappear while out/ is walked.
+# Notes:
+
+import os
+
+import pytest
+
+import DatasetCatalog
+from DatasetCatalog import open_catalog
+from RecordingFormat import RecordingFormat, RecordingWriter, load_recording
+
+
+# Writes a session of count transactions in out_folder and returns the path of its recording. The bodies are large
+# enough to make the reader refill its buffer many times, and contain characters that are not ASCII.
+def write_session(out_folder, recording_format, count=40, task="sqli"):
+    folder = os.path.join(str(out_folder), task, "2026-10-18_10:00:00.000000")
+    os.makedirs(folder)
+    recording = os.path.join(folder, recording_format.filename)
+    with RecordingWriter(recording, recording_format) as writer:
+        writer.write_header({"window_height": "1080", "window_width": "1920"})
+        for key in range(1, count + 1):
+            writer.add(key, {"url": "http://dvwa/vulnerabilities/sqli/?id=%d" % key,
+                             "request": {"method": "GET", "parameters": {"id": str(key)}, "content": ""},
+                             "response": {"status_code": 200, "content": "<p>caffè</p>" * (5000 * key)},
+                             "actions": {1: {"action": {"type": "click", "x": key, "y": 1}}}})
+    return recording
+
+
+@pytest.mark.parametrize("encoding", ["json", "compact"])
+def test_rebuild_locates_the_transactions(tmp_path, encoding):
+    recording = write_session(tmp_path / "out", RecordingFormat(encoding))
+    catalog = open_catalog(tmp_path / "out")
+    assert catalog.rebuild(tmp_path / "out") == (1, [])
+
+    rows = catalog.find_transactions()
+    assert len(rows) == 40
+    transactions = load_recording(recording)["transactions"]
+    for row in rows:
+        assert row["offset"] is not None
+        assert catalog.read_transaction(row) == transactions[str(row["transaction_id"])]
+    catalog.close()
+
+
+def test_rebuild_skips_the_recordings_deleted_during_the_walk(tmp_path, monkeypatch):
+    write_session(tmp_path / "out", RecordingFormat("compact"), count=2)
+    deleted = os.path.join(str(tmp_path / "out"), "xss", "2026-10-18_11:00:00.000000", "session_recording.json")
+    walk = DatasetCatalog.find_recordings
+    monkeypatch.setattr(DatasetCatalog, "find_recordings", lambda out_folder: [deleted] + list(walk(out_folder)))
+
+    catalog = open_catalog(tmp_path / "out")
+    assert catalog.rebuild(tmp_path / "out") == (1, [])
+    assert [session["task_name"] for session in catalog.sessions()] == ["sqli"]
+    catalog.close()
@@ -0,0 +1,83 @@
+# Description: tests of the near-duplicate detection of the saved sessions (Deduplicator in Deduplication.py).
+# Notes:
+
+import pytest
+
+from Deduplication import DUPLICATE_FIELD, Deduplicator, Fingerprint, normalize_url, similarity
+
+WORDS = " ".join("word%d" % n for n in range(400))
+
+
+def page(path, body, actions=None, parameters=None):
+    transaction = {"url": "http://dvwa" + path, "request": {"method": "GET", "parameters": parameters or {}},
+                   "response": {"status_code": 200, "content": "<html><body>%s</body></html>" % body}}
+    if actions:
+        transaction["actions"] = actions
+    return transaction
+
+
+# index (1-based), home, the same page reloaded twice (the second time with an action), a different page.
+def session():
+    return [page("/index.php", "index " + WORDS),
+            page("/vulnerabilities/sqli/", "sqli form " + WORDS + " token 1"),
+            page("/vulnerabilities/sqli/", "sqli form " + WORDS + " token 2"),
+            page("/about.php", "about the project and its authors"),
+            page("/vulnerabilities/sqli/", "sqli form " + WORDS + " token 3",
+                 actions={1: {"action": {"type": "click"}}})]
+
+
+def test_normalized_urls_ignore_identifiers():
+    assert normalize_url("http://DVWA/item/42/") == normalize_url("http://dvwa/item/7") == "dvwa/item/{n}"
+    assert normalize_url("http://dvwa/u/0123456789abcdef0123/edit") == "dvwa/u/{id}/edit"
+
+
+def test_similar_pages_have_similar_signatures():
+    first, second, other = (Fingerprint(transaction) for transaction in session()[1:4])
+    assert first.structure == second.structure != other.structure
+    assert similarity(first.signature, second.signature) >= 0.8
+    assert similarity(first.signature, other.signature) < 0.5
+
+
+def test_flag_mode_keeps_every_transaction():
+    deduplicator = Deduplicator("flag")
+    saved = list(deduplicator.filter(session()))
+    assert len(saved) == 5
+    assert [DUPLICATE_FIELD in transaction for transaction in saved] == [False, False, True, False, True]
+    # the keys are the ones the transactions get in the saved session (1-based).
+    assert {saved[2][DUPLICATE_FIELD]["transaction"], saved[4][DUPLICATE_FIELD]["transaction"]} == {"2"}
+    assert saved[2][DUPLICATE_FIELD]["similarity"] >= 0.8
+    assert deduplicator.stats() == {"transactions": 5, "duplicates": 2, "dropped": 0}
+
+
+def test_drop_mode_keeps_the_keys_consistent():
+    deduplicator = Deduplicator("drop")
+    saved = list(deduplicator.filter(session()))
+    # the reload without actions is dropped, the one with the click of the pentester is only flagged.
+    assert [transaction["url"] for transaction in saved] == \
+        ["http://dvwa/index.php", "http://dvwa/vulnerabilities/sqli/", "http://dvwa/about.php",
+         "http://dvwa/vulnerabilities/sqli/"]
+    key = saved[3][DUPLICATE_FIELD]["transaction"]
+    # key points to the saved position of the page it duplicates, after the dropped transaction.
+    assert saved[int(key) - 1] is saved[1] and DUPLICATE_FIELD not in saved[1]
+    assert deduplicator.stats() == {"transactions": 5, "duplicates": 2, "dropped": 1}
+
+
+def test_different_parameters_are_not_duplicates():
+    transactions = [page("/vulnerabilities/sqli/", WORDS, parameters={"id": "1"}),
+                    page("/vulnerabilities/sqli/", WORDS, parameters={"id": "1", "Submit": "Submit"}),
+                    page("/vulnerabilities/sqli/", WORDS, parameters={"id": "1"})]
+    saved = list(Deduplicator("flag").filter(transactions))
+    # a different set of parameter names is a different structure.
+    assert DUPLICATE_FIELD not in saved[1]
+    assert saved[2][DUPLICATE_FIELD]["transaction"] == "1"
+
+
+def test_websocket_transactions_are_never_duplicates():
+    segment = dict(page("/ws", WORDS), websocket={"segment": 1, "messages": []})
+    saved = list(Deduplicator("drop").filter([segment, dict(segment), dict(segment)]))
+    assert len(saved) == 3 and not any(DUPLICATE_FIELD in transaction for transaction in saved)
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        Deduplicator("merge")
@@ -0,0 +1,94 @@
+# Description: tests of the HTTPLogger addon: the sessions of many clients recorded at the same time through the same
+#              interceptor.
+# Notes:
+#       The flows are built with the test helpers of mitmproxy and given to the hooks in the order mitmproxy calls
+#       them (request, responseheaders, response).
+
+import pytest
+
+pytest.importorskip("mitmproxy")
+pytest.importorskip("bs4")
+
+from mitmproxy.test import tflow, tutils
+
+from ClientRecording import CLIENT_COOKIE
+from HTTPLogger import HTTPLogger
+
+
+def flow(url, ip_address, title="", cookie=None):
+    http_flow = tflow.tflow(req=tutils.treq(), resp=tutils.tresp())
+    http_flow.request.url = url
+    # the address of the client as HTTPLogger reads it.
+    http_flow.client_conn.ip_address = (ip_address, 50000)
+    if cookie is not None:
+        http_flow.request.headers["cookie"] = CLIENT_COOKIE + "=" + cookie
+    http_flow.response.headers["content-type"] = "text/html; charset=utf-8"
+    http_flow.response.content = ("<html><head><title>%s</title></head><body></body></html>" % title).encode()
+    return http_flow
+
+
+def send(logger, http_flow):
+    logger.request(http_flow)
+    logger.responseheaders(http_flow)
+    logger.response(http_flow)
+    return http_flow
+
+
+@pytest.fixture
+def logger():
+    addon = HTTPLogger({"10.0.0.1": "alice", "10.0.0.2": "bob"}, client_key="ip")
+    yield addon
+    addon.done()
+
+
+def test_the_sessions_of_two_clients_stay_separate(logger):
+    # the page that starts the recording is the first transaction of the session, and gives its name.
+    send(logger, flow("http://dvwa/vulnerabilities/sqli/?record=true", "10.0.0.1", "SQL Injection"))
+    send(logger, flow("http://dvwa/vulnerabilities/xss_r/?record=true", "10.0.0.2", "Reflected XSS"))
+    # the flows of the two clients are interleaved.
+    for page in range(3):
+        send(logger, flow("http://dvwa/vulnerabilities/sqli/?id=%d" % page, "10.0.0.1", "SQL Injection"))
+        send(logger, flow("http://dvwa/vulnerabilities/xss_r/?name=%d" % page, "10.0.0.2", "Reflected XSS"))
+
+    alice, bob = logger.clients["10.0.0.1"].session, logger.clients["10.0.0.2"].session
+    assert (alice.task_name, bob.task_name) == ("SQL Injection", "Reflected XSS")
+    assert all("/sqli/" in transaction.pretty_url for transaction in alice.http_transactions)
+    assert all("/xss_r/" in transaction.pretty_url for transaction in bob.http_transactions)
+    assert len(alice.http_transactions) == len(bob.http_transactions) == 4
+    assert {transaction.client_name for transaction in alice.http_transactions} == {"alice"}
+    assert {transaction.client_name for transaction in bob.http_transactions} == {"bob"}
+    # two sessions started at the same time never share the output folder.
+    assert alice.start_time != bob.start_time
+
+
+def test_stopping_a_session_doesnt_stop_the_other_client(logger):
+    send(logger, flow("http://dvwa/setup.php?record=true", "10.0.0.1"))
+    send(logger, flow("http://dvwa/setup.php?record=true", "10.0.0.2"))
+    send(logger, flow("http://dvwa/index.php?record=false", "10.0.0.1"))
+    send(logger, flow("http://dvwa/index.php", "10.0.0.1", "Index"))
+    send(logger, flow("http://dvwa/index.php", "10.0.0.2", "Index"))
+
+    assert logger.clients["10.0.0.1"].recording == "off" and logger.clients["10.0.0.1"].waiting_for_json
+    assert logger.clients["10.0.0.2"].recording == "on" and not logger.clients["10.0.0.2"].waiting_for_json
+    assert len(logger.clients["10.0.0.1"].session.http_transactions) == 1
+    assert len(logger.clients["10.0.0.2"].session.http_transactions) == 2
+
+
+def test_browsers_behind_the_same_address_get_their_own_cookie():
+    logger = HTTPLogger({"10.0.0.1": "lab"})
+    try:
+        first = send(logger, flow("http://dvwa/index.php", "10.0.0.1"))
+        set_cookie = first.response.headers.get("set-cookie", "")
+        assert set_cookie.startswith(CLIENT_COOKIE + "=")
+        first_id = set_cookie.split("=", 1)[1].split(";", 1)[0]
+
+        # the first browser sends its cookie back: the interceptor removes it before forwarding the request.
+        again = send(logger, flow("http://dvwa/index.php", "10.0.0.1", cookie=first_id))
+        assert "cookie" not in again.request.headers and "set-cookie" not in again.response.headers
+        # a second browser from the same address gets a new identifier.
+        second = send(logger, flow("http://dvwa/index.php", "10.0.0.1"))
+        second_id = second.response.headers["set-cookie"].split("=", 1)[1].split(";", 1)[0]
+        assert second_id != first_id
+        assert set(logger.clients) == {first_id, second_id}
+    finally:
+        logger.done()
@@ -0,0 +1,145 @@
+# Description: tests of HTTPReplayer against a local aiohttp server: ordered and unordered replay, requests whose
+#              body has been recorded truncated, and the cookie jar of every session.
+# Notes:
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+from HTTPReplayer import HTTPReplayer
+
+
+# A server that runs in its own thread (HTTPReplayer.run starts an event loop of its own). /login sets a new session
+# cookie, every request is logged with the cookie it has been sent with.
+class Server(object):
+
+    def __init__(self):
+        self.log = []
+        self.logins = 0
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.__serve, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        assert self.ready.wait(10)
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+
+    async def __handle(self, request):
+        body = await request.read()
+        self.log.append({"path": request.path, "session": request.query.get("session"),
+                         "sid": request.cookies.get("sid"), "body": body})
+        response = web.Response(text="ok")
+        if request.path == "/login":
+            self.logins += 1
+            response.set_cookie("sid", "sid-%d" % self.logins)
+        return response
+
+    def __serve(self):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.__handle)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.target = "http://127.0.0.1:%d" % self.runner.addresses[0][1]
+        self.ready.set()
+        self.loop.run_forever()
+
+
+def transaction(path, session="a", method="GET", content="", status_code=200):
+    return {"url": "http://dvwa%s?session=%s" % (path, session),
+            "request": {"method": method, "headers": {"Host": "dvwa", "Cookie": "sid=recorded"}, "content": content},
+            "response": {"status_code": status_code, "headers": {}, "content": "ok"}}
+
+
+def write_recording(path, transactions):
+    with open(str(path), "w") as recording:
+        json.dump({"transactions": {str(key): value for key, value in enumerate(transactions, 1)}}, recording)
+    return str(path)
+
+
+# Runs the replay in a thread: a replay that hangs fails the test instead of blocking it.
+def replay(replayer):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=replayer.run()), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "the replay did not end"
+    return result["value"]
+
+
+def test_ordered_replay_sends_the_requests_in_the_recorded_order(tmp_path):
+    paths = ["/step/%d" % step for step in range(10)]
+    recording = write_recording(tmp_path / "session.json", [transaction(path) for path in paths] +
+                                [transaction("/missing", status_code=404)])
+    with Server() as server:
+        report, outcomes = replay(HTTPReplayer([recording], server.target, concurrency=4))
+    assert [entry["path"] for entry in server.log] == paths + ["/missing"]
+    assert report["requests"] == 11 and report["errors"] == 0
+    # the server answers 200 where 404 has been recorded.
+    assert report["status_mismatches"] == 1
+    assert outcomes[0]["error"] is None and outcomes[0]["requests"] == 11
+
+
+def test_unordered_replay_sends_every_request(tmp_path):
+    transactions = [transaction("/item/%d" % item, method="POST", content="body %d" % item) for item in range(50)]
+    recording = write_recording(tmp_path / "session.json", transactions)
+    with Server() as server:
+        report, outcomes = replay(HTTPReplayer([recording], server.target, concurrency=4, ordered=False))
+    assert sorted(entry["body"] for entry in server.log) == sorted(("body %d" % item).encode() for item in range(50))
+    assert report["requests"] == 50 and report["errors"] == 0
+
+
+def test_unordered_replay_survives_malformed_transactions(tmp_path):
+    # transactions without url make __send raise: more of them than senders, and more than the queue holds.
+    transactions = [{"request": {"method": "GET"}} for _ in range(12)] + [transaction("/after")]
+    recording = write_recording(tmp_path / "session.json", transactions)
+    with Server() as server:
+        report, outcomes = replay(HTTPReplayer([recording], server.target, concurrency=2, ordered=False))
+    assert [entry["path"] for entry in server.log] == ["/after"]
+    assert report["errors"] == 12 and report["requests"] == 13
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_truncated_bodies_are_not_sent(tmp_path, ordered):
+    truncated = {"encoding": "utf-8", "head": "abc", "tail": "xyz", "length": 100000, "truncated": True,
+                 "head_length": 3}
+    recording = write_recording(tmp_path / "session.json", [transaction("/upload", method="POST", content=truncated),
+                                                             transaction("/after")])
+    with Server() as server:
+        report, outcomes = replay(HTTPReplayer([recording], server.target, ordered=ordered))
+    assert [entry["path"] for entry in server.log] == ["/after"]
+    assert report["truncated"] == 1 and report["requests"] == 1
+    assert outcomes[0]["truncated"] == 1
+
+
+def test_every_session_has_its_own_cookie_jar(tmp_path):
+    recordings = [write_recording(tmp_path / ("%s.json" % session),
+                                  [transaction("/login", session), transaction("/whoami", session),
+                                   transaction("/whoami", session)])
+                  for session in ("a", "b", "c")]
+    with Server() as server:
+        replay(HTTPReplayer(recordings, server.target, concurrency=3))
+
+    cookies = {}
+    for entry in server.log:
+        if entry["path"] == "/login":
+            # the recorded Cookie header is not sent, and the jar of the session is still empty.
+            assert entry["sid"] is None
+        else:
+            cookies.setdefault(entry["session"], set()).add(entry["sid"])
+    # every session sends back only the cookie set by its own login.
+    assert all(len(sids) == 1 for sids in cookies.values())
+    assert sorted(sid for sids in cookies.values() for sid in sids) == ["sid-1", "sid-2", "sid-3"]
@@ -0,0 +1,156 @@
+# Description: tests of the injection of the action recording script (Injector.py): the byte-level scan, its
+#              BeautifulSoup fallback and the cache of the injected bodies.
+# Notes:
+
+import types
+
+import pytest
+
+pytest.importorskip("bs4")
+
+from Injector import InjectionCache, ScriptInjector, charset_of, is_html
+
+SCRIPT = "record();"
+TAG = b'<script type="text/javascript" id="wapt_dataset_collector_record">record();</script>'
+
+
+@pytest.mark.parametrize("body, expected", [
+    (b"<html><head><title>t</title></head></html>", b"<html><head>"),
+    (b"<HTML><HEAD lang='en'><title>t</title></HEAD></HTML>", b"<HTML><HEAD lang='en'>"),
+    # <header> is not <head>: the body tag is used.
+    (b"<html><body><header>menu</header></body></html>", b"<html><body>"),
+    (b"<!DOCTYPE html>\n<html>\n<head>\n", b"<!DOCTYPE html>\n<html>\n<head>"),
+])
+def test_insertion_point_follows_the_opening_tag(body, expected):
+    assert ScriptInjector.find_insertion_point(body) == len(expected)
+
+
+@pytest.mark.parametrize("body", [
+    b"<html><p>no head nor body</p></html>",
+    b'{"json": "<headless>"}',
+    # a tag that follows a comment could be inside it: the scan leaves it to BeautifulSoup.
+    b"<!-- <head> --><html><head></head></html>",
+    b"<html><!-- menu --><body></body></html>",
+])
+def test_insertion_point_is_not_guessed(body):
+    assert ScriptInjector.find_insertion_point(body) is None
+
+
+def test_comment_before_head_falls_back_to_beautifulsoup():
+    body = b"<!-- <head> is the first tag --><html><head><title>t</title></head><body></body></html>"
+    injected = ScriptInjector(SCRIPT).inject(body)
+    # the script goes in the real head, not in the comment.
+    assert injected.index(b"<!-- <head> is the first tag -->") == 0
+    assert injected.count(b"record();") == 1
+    assert injected.index(b"<head>", injected.index(b"-->")) < injected.index(b"record();") < injected.index(b"<title>")
+
+
+def test_comment_before_body_without_head():
+    injected = ScriptInjector(SCRIPT).inject(b"<html><!-- nav --><body><p>x</p></body></html>")
+    assert b"<body><script" in injected and injected.count(b"record();") == 1
+
+
+def test_page_without_head_nor_body_is_not_injected():
+    assert ScriptInjector(SCRIPT).inject(b"<p>fragment</p>") is None
+    assert ScriptInjector(SCRIPT).inject(b"\x89PNG\r\n\x1a\n\x00\x00") is None
+
+
+def test_fast_path_keeps_the_rest_of_the_document():
+    body = b"<html><head ><title>t</title></head><body><p class=x>unclosed<br></body></html>"
+    injected = ScriptInjector(SCRIPT).inject(body)
+    assert injected == body.replace(b"<head >", b"<head >" + TAG)
+
+
+def test_latin1_page_keeps_its_encoding():
+    body = "<html><head><title>caffè</title></head></html>".encode("latin-1")
+    injector = ScriptInjector("var s = 'é';")
+    injected = injector.inject(body, charset_of("text/html; charset=ISO-8859-1"))
+    assert injected.startswith(b"<html><head><script")
+    assert injected.decode("latin-1").count("caffè") == 1 and "var s = 'é';" in injected.decode("latin-1")
+
+
+def test_charset_that_is_not_ascii_compatible_uses_the_fallback():
+    body = "<html><head><title>t</title></head></html>".encode("utf-16")
+    injected = ScriptInjector(SCRIPT).inject(body, charset_of("text/html; charset=utf-16"))
+    text = injected.decode("utf-16")
+    assert "<head><script" in text and "record();" in text
+
+
+def test_charset_and_content_type():
+    assert charset_of("text/html; charset=\"UTF-8\"") == "utf-8"
+    assert charset_of("text/html; charset=unknown-charset") == "utf-8"
+    assert charset_of(None, default="latin-1") == "latin-1"
+    assert is_html("text/html; charset=utf-8") and is_html("application/xhtml+xml")
+    assert not is_html("application/json") and not is_html("text/css")
+    # as before the byte-level scan, a response without content type is injected if it has a head or body.
+    assert is_html(None) and is_html("")
+
+
+def response(body, content_type):
+    headers = {"content-type": content_type} if content_type is not None else {}
+    return types.SimpleNamespace(headers=headers, content=body)
+
+
+def test_inject_response():
+    injector = ScriptInjector(SCRIPT)
+    page = response(b"<html><head></head></html>", "text/html")
+    assert injector.inject_response(page) and TAG in page.content
+    undeclared = response(b"<html><body></body></html>", None)
+    assert injector.inject_response(undeclared) and TAG in undeclared.content
+    for untouched in (response(b'{"a": "<head>"}', "application/json"), response(b"plain", None),
+                      response(b"", "text/html")):
+        original = untouched.content
+        assert not injector.inject_response(untouched) and untouched.content == original
+
+
+def test_cache_returns_the_same_injected_body():
+    cache = InjectionCache()
+    injector = ScriptInjector(SCRIPT, cache=cache)
+    body = b"<html><head></head></html>"
+    first = injector.inject(body)
+    assert injector.inject(body) == first
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+    # the pages that can't be injected are remembered too.
+    assert injector.inject(b"<p>x</p>") is None and injector.inject(b"<p>x</p>") is None
+    assert (cache.hits, cache.misses, len(cache)) == (2, 2, 2)
+
+
+def test_cache_key_changes_with_the_script_and_the_charset():
+    cache = InjectionCache()
+    body = b"<html><head></head></html>"
+    old = ScriptInjector("old();", cache=cache).inject(body)
+    new = ScriptInjector("new();", cache=cache).inject(body)
+    assert b"old();" in old and b"new();" in new and b"old();" not in new
+    assert cache.hits == 0 and len(cache) == 2
+    ScriptInjector("new();", cache=cache).inject(body, "latin-1")
+    assert cache.hits == 0 and len(cache) == 3
+
+
+def test_cache_evicts_the_least_recently_used_entries():
+    cache = InjectionCache(max_entries=2)
+    injector = ScriptInjector(SCRIPT, cache=cache)
+    pages = [b"<html><head></head><p>%d</p></html>" % page for page in range(3)]
+    injector.inject(pages[0])
+    injector.inject(pages[1])
+    # pages[0] becomes the most recently used: pages[1] is evicted by pages[2].
+    injector.inject(pages[0])
+    injector.inject(pages[2])
+    assert cache.evictions == 1 and len(cache) == 2
+    assert cache.get(cache.key(pages[1], "utf-8", injector.version)) == (False, None)
+    assert cache.get(cache.key(pages[0], "utf-8", injector.version))[0]
+
+
+def test_cache_is_bounded_in_bytes():
+    body = b"<html><head></head>" + b"x" * 1000 + b"</html>"
+    cache = InjectionCache(max_bytes=2500)
+    injector = ScriptInjector(SCRIPT, cache=cache)
+    for page in range(5):
+        injector.inject(body + b"%d" % page)
+    assert cache.bytes <= 2500 and len(cache) == 2 and cache.evictions == 3
+    # bodies larger than max_body_size are injected but not cached.
+    small = InjectionCache(max_body_size=100)
+    assert TAG in ScriptInjector(SCRIPT, cache=small).inject(body) and len(small) == 0
+    # max_entries 0 disables the cache.
+    disabled = InjectionCache(max_entries=0)
+    ScriptInjector(SCRIPT, cache=disabled).inject(body)
+    assert len(disabled) == 0 and disabled.misses == 0
@@ -0,0 +1,54 @@
+# Description: tests of PersistenceWorker (Persistence.py).
+# Notes:
+
+import threading
+import time
+
+from Persistence import PersistenceWorker
+
+
+# Stands for a detached Session: save_session waits until release is set.
+class FakeSession(object):
+
+    def __init__(self, name, saved, release):
+        self.task_name = name
+        self.start_time = 0
+        self.saved = saved
+        self.release = release
+
+    def save_session(self):
+        assert self.release.wait(10)
+        self.saved.append(self.task_name)
+
+
+def test_submit_does_not_block_when_the_queue_is_full():
+    saved = []
+    release = threading.Event()
+    worker = PersistenceWorker(max_queue=2)
+    started = time.perf_counter()
+    for index in range(10):
+        worker.submit(FakeSession(index, saved, release))
+    # the worker is stuck on the first session: the other ones are queued or in overflow.
+    assert time.perf_counter() - started < 1
+    assert worker.overflowed >= 7
+    assert worker.depth == 10
+
+    release.set()
+    worker.flush()
+    assert sorted(saved) == list(range(10))
+    assert worker.saved == 10 and worker.depth == 0
+    worker.shutdown()
+
+
+def test_shutdown_saves_the_overflow():
+    saved = []
+    release = threading.Event()
+    worker = PersistenceWorker(max_queue=1)
+    for index in range(5):
+        worker.submit(FakeSession(index, saved, release))
+    release.set()
+    worker.shutdown()
+    assert sorted(saved) == list(range(5))
+    # sessions submitted after the shutdown are saved right away.
+    worker.submit(FakeSession(5, saved, release))
+    assert saved[-1] == 5
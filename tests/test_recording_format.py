@@ -0,0 +1,101 @@
+# Description: tests of the output formats of the recordings (RecordingFormat.py).
+# Notes:
+
+import json
+import types
+
+import pytest
+
+import RecordingFormat
+
+
+# A transaction as Session.save_session writes it: the actions are numbered with integer keys by align_actions.
+def recorded_transaction():
+    session_module = pytest.importorskip("Session")
+    actions = {"window_height": "1080", "window_width": "1920", "task_name": "sqli",
+               "0": {"action": {"type": "navigateTo", "url": "http://dvwa/vulnerabilities/sqli/"}},
+               "1": {"action": {"type": "click", "xpath": "//input[@name='id']"}},
+               "2": {"action": {"type": "keyPress", "key": "1"}}}
+    transaction = {"url": "http://dvwa/vulnerabilities/sqli/?id=1",
+                   "request": {"client": {"ip address": "172.18.0.1", "port": "50000", "name": "pentester"},
+                               "headers": {"Host": "dvwa"}, "content": "", "parameters": {"id": "1"}},
+                   "response": {"headers": {"Content-Type": "text/html"}, "content": "<html>ok</html>"}}
+    return next(session_module.Session.align_actions([transaction], actions))
+
+
+def test_orjson_encodes_recorded_transactions(monkeypatch):
+    pytest.importorskip("orjson")
+    transaction = recorded_transaction()
+    assert all(isinstance(key, int) for key in transaction["actions"])
+
+    # the fallback on the standard library must not be needed.
+    def fail(*args, **kwargs):
+        raise AssertionError("orjson could not encode the transaction")
+    monkeypatch.setattr(RecordingFormat, "json", types.SimpleNamespace(dumps=fail))
+
+    encoded = RecordingFormat._compact_json(transaction)
+    assert json.loads(encoded) == json.loads(json.dumps(transaction))
+
+
+def session(count=5):
+    transactions = {}
+    for key in range(1, count + 1):
+        transactions[str(key)] = {
+            "url": "http://dvwa/vulnerabilities/xss_r/?name=%d" % key,
+            "request": {"method": "GET", "parameters": {"name": "<script>alert(%d)</script>" % key},
+                        "content": {"encoding": "base64", "data": "AAEC", "length": 3}},
+            "response": {"status_code": 200, "headers": {"Content-Type": "text/html"},
+                         "content": "<p>caffè \"quoted\" \\ %s</p>" % ("x" * key)},
+            "actions": {1: {"time": key, "action": {"type": "keypress", "key": "é"}}}}
+    return {"window_height": "1080", "window_width": "1920", "transactions": transactions}
+
+
+def formats():
+    for encoding in RecordingFormat.ENCODINGS:
+        for compression in (None,) + RecordingFormat.COMPRESSIONS:
+            try:
+                yield RecordingFormat.RecordingFormat(encoding, compression)
+            except ValueError:
+                # the package of the format is not installed.
+                pass
+
+
+def write(path, recorded):
+    with RecordingFormat.RecordingWriter(str(path), recorded["format"]) as writer:
+        writer.write_header({k: v for k, v in recorded["session"].items() if k != "transactions"})
+        for key, transaction in recorded["session"]["transactions"].items():
+            writer.add(key, transaction)
+
+
+@pytest.mark.parametrize("recording_format", list(formats()), ids=repr)
+def test_round_trip(tmp_path, recording_format):
+    path = tmp_path / recording_format.filename
+    original = session()
+    write(path, {"format": recording_format, "session": original})
+    # the integer keys of the actions become strings, as with json.
+    expected = json.loads(json.dumps(original))
+
+    assert RecordingFormat.load_recording(str(path)) == expected
+    assert repr(RecordingFormat.format_of(str(path))) == repr(recording_format)
+    with RecordingFormat.open_recording(str(path)) as reader:
+        assert reader.header == {"window_height": "1080", "window_width": "1920"}
+        transactions = list(reader.transactions())
+    # the bodies are skipped by default.
+    assert [key for key, _ in transactions] == list(expected["transactions"])
+    assert all("content" not in t["request"] and "content" not in t["response"] for _, t in transactions)
+    assert RecordingFormat.read_transaction(str(path), "3") == expected["transactions"]["3"]
+
+
+def test_json_is_the_historical_format(tmp_path):
+    path = tmp_path / "session_recording.json"
+    original = session()
+    write(path, {"format": RecordingFormat.DEFAULT_FORMAT, "session": original})
+    assert path.read_text() == json.dumps(original, indent=2)
+
+
+def test_empty_session(tmp_path):
+    for recording_format in formats():
+        path = tmp_path / recording_format.filename
+        with RecordingFormat.RecordingWriter(str(path), recording_format) as writer:
+            writer.write_header({})
+        assert RecordingFormat.load_recording(str(path)) == {"transactions": {}}
@@ -0,0 +1,78 @@
+# Description: tests of the Session class: the single pass alignment of the actions of the pentester to the
+#              transactions (Session.align_actions) must give the same result as the original algorithm.
+# Notes:
+
+import copy
+import random
+
+import pytest
+
+# Session imports HTTPTransaction, that needs mitmproxy.
+pytest.importorskip("mitmproxy")
+
+from Session import Session
+
+METADATA_KEYS = ("task_name", "window_height", "window_width")
+
+
+# The alignment of Session.save_session before it became a single pass (a copy of the actions for every
+# transaction, consumed actions deleted from actions_performed). Returns the actions of every transaction.
+def baseline_align(transactions_count, actions_performed):
+    aligned = []
+    temp_actions_dict = {}
+    for _ in range(transactions_count):
+        action_n = 1
+        delimiter_encountered = False
+        dict_to_iterate = copy.deepcopy(actions_performed)
+        for k, v in dict_to_iterate.items():
+            if k != "task_name" and k != "window_height" and k != "window_width":
+                if v['action']['type'] == "navigateTo":
+                    if not delimiter_encountered:
+                        delimiter_encountered = True
+                        del actions_performed[k]
+                    else:
+                        break
+                else:
+                    temp_actions_dict[action_n] = v
+                    del actions_performed[k]
+                    action_n += 1
+            else:
+                del actions_performed[k]
+        aligned.append(dict(temp_actions_dict))
+        temp_actions_dict.clear()
+    return aligned
+
+
+# Returns the actions sent by the browser: random clicks and keystrokes, navigateTo, and the metadata keys at
+# random positions.
+def random_actions(rng, count):
+    actions = {}
+    types = ["navigateTo", "click", "keypress", "keydown", "keyup"]
+    for n in range(count):
+        action_type = rng.choice(types)
+        actions[str(n)] = {"time": n * 10, "action": {"type": action_type, "key": "a", "x": n, "y": n}}
+    items = list(actions.items())
+    for key in METADATA_KEYS:
+        if rng.random() < 0.5:
+            items.insert(rng.randrange(len(items) + 1), (key, "value"))
+    return dict(items)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_align_actions_matches_the_baseline(seed):
+    rng = random.Random(seed)
+    actions = random_actions(rng, rng.randrange(0, 60))
+    transactions_count = rng.randrange(0, 20)
+
+    expected = baseline_align(transactions_count, copy.deepcopy(actions))
+    transactions = [{"url": "http://dvwa/%d" % n} for n in range(transactions_count)]
+    aligned = [transaction["actions"] for transaction in Session.align_actions(transactions, actions)]
+    assert aligned == expected
+
+
+def test_align_actions_doesnt_modify_the_actions():
+    actions = {"0": {"time": 0, "action": {"type": "navigateTo"}}, "1": {"time": 5, "action": {"type": "click"}},
+               "task_name": "sqli"}
+    before = copy.deepcopy(actions)
+    assert [t["actions"] for t in Session.align_actions([{}], actions)] == [{1: before["1"]}]
+    assert actions == before
@@ -0,0 +1,110 @@
+# Description: tests of the sharded mode of the interceptor (Sharding.py): the table of the client addresses in
+#              shared memory and the merge of the shards of the workers.
+# Notes:
+
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from DatasetCatalog import open_catalog
+from Sharding import ClientAddressAddon, ClientAddressTable, Distributor, merge_shards, shard_folder
+
+
+@pytest.fixture
+def table():
+    owner = ClientAddressTable(create=True)
+    yield owner
+    owner.close()
+
+
+# Returns what a worker (another process, as in the sharded interceptor) reads from the slots of ports.
+def read_in_worker(table, ports):
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    script = ("import json, sys; sys.path.insert(0, %r); from Sharding import ClientAddressTable; "
+              "table = ClientAddressTable(%r); print(json.dumps([table.get(port) for port in %r])); table.close()"
+              % (src, table.name, list(ports)))
+    output = subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE).stdout
+    return [tuple(address) if address is not None else None for address in json.loads(output)]
+
+
+def test_workers_read_the_addresses_written_by_the_distributor(table):
+    table.set(40000, ("172.18.0.5", 51000))
+    table.set(40001, ("2001:db8::7", 51001))
+    # the clients of an IPv4 network are shown as such, even if the Distributor listens on IPv6.
+    table.set(40002, ("::ffff:10.0.0.9", 51002))
+    table.set(65535, ("fe80::1%eth0", 51003))
+
+    # 40003: a port that has never been used.
+    assert read_in_worker(table, [40000, 40001, 40002, 65535, 40003]) == \
+        [("172.18.0.5", 51000), ("2001:db8::7", 51001), ("10.0.0.9", 51002), ("fe80::1", 51003), None]
+    # a slot is overwritten when its port is used again, and a worker that exits doesn't remove the table.
+    table.set(40000, ("172.18.0.6", 52000))
+    assert read_in_worker(table, [40000]) == [("172.18.0.6", 52000)]
+
+
+def test_addon_restores_the_address_of_the_client(table):
+    table.set(40000, ("172.18.0.5", 51000))
+    client_conn = types.SimpleNamespace(address=("127.0.0.1", 40000), ip_address=("127.0.0.1", 40000))
+    ClientAddressAddon(table).clientconnect(types.SimpleNamespace(client_conn=client_conn))
+    assert client_conn.address == client_conn.ip_address == ("172.18.0.5", 51000)
+    # a connection that doesn't come from the Distributor is left as it is.
+    direct = types.SimpleNamespace(address=("127.0.0.1", 40001), ip_address=("127.0.0.1", 40001))
+    ClientAddressAddon(table).clientconnect(types.SimpleNamespace(client_conn=direct))
+    assert direct.address == ("127.0.0.1", 40001)
+
+
+def test_a_client_is_always_served_by_the_same_worker():
+    distributor = Distributor("127.0.0.1", 0, [9001, 9002, 9003], table=None)
+    workers = {ip: distributor.worker_for(ip) for ip in ("10.0.0.%d" % n for n in range(50))}
+    assert all(0 <= worker < 3 for worker in workers.values())
+    assert all(distributor.worker_for(ip) == worker for ip, worker in workers.items())
+    assert len(set(workers.values())) == 3
+
+
+def save_session(shard, task, start_time, url):
+    folder = os.path.join(shard, task, start_time)
+    os.makedirs(folder)
+    with open(os.path.join(folder, "session_recording.json"), "w") as recording:
+        json.dump({"window_width": "1920", "window_height": "1080",
+                   "transactions": {"1": {"url": url, "request": {"method": "GET"},
+                                          "response": {"status_code": 200}}}}, recording)
+
+
+def save_blob(shard, name, data):
+    path = os.path.join(shard, "blobs", name[:2], name[2:4], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as blob:
+        blob.write(data)
+
+
+def test_merge_shards_moves_sessions_and_blobs(tmp_path):
+    out = str(tmp_path)
+    first, second = shard_folder(out, 0), shard_folder(out, 1)
+    save_session(first, "sqli", "2024-01-01_10-00-00", "http://dvwa/sqli/?id=1")
+    save_session(second, "xss", "2024-01-01_10-00-01", "http://dvwa/xss_r/?name=a")
+    # two workers saved a session of the same task at the same time.
+    save_session(second, "sqli", "2024-01-01_10-00-00", "http://dvwa/sqli/?id=2")
+    save_blob(first, "abcd.zst", b"shared")
+    save_blob(second, "abcd.zst", b"shared")
+    save_blob(second, "ef01.zst", b"only in the second shard")
+    # the catalog of a shard is not a session.
+    open(os.path.join(first, "catalog.sqlite"), "w").close()
+
+    catalog = open_catalog(out)
+    try:
+        assert merge_shards(out, catalog) == 3
+        assert sorted(session["session_id"] for session in catalog.sessions()) == \
+            ["sqli/2024-01-01_10-00-00", "sqli/2024-01-01_10-00-00_1", "xss/2024-01-01_10-00-01"]
+    finally:
+        catalog.close()
+    assert sorted(os.listdir(os.path.join(out, "sqli"))) == ["2024-01-01_10-00-00", "2024-01-01_10-00-00_1"]
+    assert os.path.isfile(os.path.join(out, "xss", "2024-01-01_10-00-01", "session_recording.json"))
+    assert sorted(os.listdir(os.path.join(out, "blobs", "ab", "cd"))) == ["abcd.zst"]
+    assert os.path.isfile(os.path.join(out, "blobs", "ef", "01", "ef01.zst"))
+    assert not os.path.exists(os.path.join(out, "shards"))
+    # nothing left to merge.
+    assert merge_shards(out) == 0
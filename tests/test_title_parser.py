@@ -0,0 +1,49 @@
+# Description: tests of the incremental title parser (TitleParser.py) that names the tasks.
+# Notes:
+
+import codecs
+
+from TitleParser import detect_charset, extract_title
+
+
+def test_entities_and_whitespaces():
+    body = b"<html><head><title>\n  Vulnerability: SQL   Injection &amp; Blind &#39;SQLi&#x27;\n</title></head></html>"
+    assert extract_title(body, "text/html") == "Vulnerability: SQL Injection & Blind 'SQLi'"
+
+
+def test_charset_from_content_type():
+    body = "<title>Café Übersicht</title>".encode("latin-1")
+    assert extract_title(body, "text/html; charset=ISO-8859-1") == "Café Übersicht"
+
+
+def test_charset_from_meta():
+    body = '<html><head><meta charset="windows-1251"><title>Уязвимость</title></head></html>'.encode("cp1251")
+    assert detect_charset(body) == "cp1251"
+    assert extract_title(body, "text/html") == "Уязвимость"
+
+
+def test_bom_wins_over_content_type():
+    body = codecs.BOM_UTF8 + "<title>naïve</title>".encode("utf-8")
+    assert detect_charset(body, "text/html; charset=iso-8859-1") == "utf-8"
+    assert extract_title(body, "text/html; charset=iso-8859-1") == "naïve"
+
+
+def test_multibyte_character_split_between_chunks():
+    # "é" is encoded in two bytes: the first chunk ends between them.
+    body = "<title>aé</title>".encode("utf-8")
+    assert extract_title(body, "text/html; charset=utf-8", chunk_size=9) == "aé"
+
+
+def test_entity_split_between_chunks():
+    assert extract_title(b"<title>Tom &amp; Jerry</title>", chunk_size=12) == "Tom & Jerry"
+
+
+def test_no_title():
+    assert extract_title(b"<html><head></head><body><title>not in head</title></body></html>") is None
+    assert extract_title(b"") is None
+
+
+def test_budget():
+    body = b"<html><head>" + b"<!-- padding -->" * 1000 + b"<title>late</title></head></html>"
+    assert extract_title(body, budget=1024) is None
+    assert extract_title(body) == "late"
@@ -0,0 +1,80 @@
+# Description: tests of the recording of the WebSocket connections (WebSocketCapture.py): the bounded ring buffer
+#              of every connection and the limits on the size of the messages.
+# Notes:
+
+import pytest
+
+pytest.importorskip("mitmproxy")
+
+from mitmproxy.test import tflow
+from mitmproxy.websocket import WebSocketMessage
+
+from WebSocketCapture import WebSocketCapture, WebSocketLimits
+
+TEXT, BINARY = 1, 2
+
+
+def capture(**limits):
+    wsflow = tflow.twebsocketflow()
+    # the address of the client as HTTPTransaction reads it.
+    wsflow.handshake_flow.client_conn.ip_address = ("10.0.0.1", 50000)
+    return wsflow, WebSocketCapture(wsflow.handshake_flow, WebSocketLimits(**limits))
+
+
+def message(content, from_client=True, timestamp=1.0):
+    return WebSocketMessage(TEXT if isinstance(content, str) else BINARY, from_client, content, timestamp)
+
+
+def test_ring_buffer_drops_the_oldest_messages():
+    wsflow, websocket = capture(max_messages=3)
+    full = [websocket.add(message("message %d" % n, timestamp=n)) for n in range(5)]
+    # the caller is told as soon as the buffer is full.
+    assert full == [False, False, True, True, True]
+    assert (websocket.total_messages, websocket.dropped_messages) == (5, 2)
+    transaction = websocket.flush("alice")
+    assert [record["content"] for record in transaction.get_dict()["websocket"]["messages"]] == \
+        ["message 2", "message 3", "message 4"]
+    assert transaction.summary == {"segment": 1, "final": False, "total_messages": 5, "dropped_messages": 2}
+    # the buffer has been emptied: nothing to flush until the connection ends.
+    assert websocket.buffered_bytes == 0 and websocket.flush("alice") is None
+
+
+def test_ring_buffer_is_bounded_in_bytes():
+    wsflow, websocket = capture(buffer_size=100)
+    for n in range(10):
+        websocket.add(message(b"x" * 30))
+    assert websocket.buffered_bytes <= 100 and len(websocket.messages) == 3
+    assert websocket.dropped_messages == 7
+
+
+def test_large_messages_keep_their_head_and_tail():
+    wsflow, websocket = capture(max_message_size=10)
+    websocket.add(message("0123456789abcdefghij", from_client=False))
+    websocket.add(message(b"\x00" * 5 + b"\xff" * 20))
+    records = websocket.flush("alice").get_dict()["websocket"]["messages"]
+    assert records[0] == {"time": 1.0, "direction": "server", "type": "text", "length": 20,
+                          "content": {"encoding": "utf-8", "head": "01234", "tail": "fghij", "length": 20,
+                                      "truncated": True}}
+    assert records[1]["type"] == "binary" and records[1]["length"] == 25
+    assert records[1]["content"]["truncated"] and records[1]["content"]["encoding"] == "base64"
+    assert websocket.recorded_bytes == 20
+
+
+def test_messages_after_max_connection_bytes_are_only_counted():
+    wsflow, websocket = capture(max_connection_bytes=50)
+    for n in range(6):
+        websocket.add(message(b"y" * 20))
+    assert len(websocket.messages) == 3 and websocket.dropped_messages == 3
+    assert websocket.total_messages == 6
+
+
+def test_final_segment_describes_the_closed_connection():
+    wsflow, websocket = capture()
+    websocket.add(message("hello"))
+    assert websocket.flush("alice").summary["segment"] == 1
+    # the last segment is added even without messages, to record how the connection ended.
+    transaction = websocket.flush("alice", wsflow, final=True)
+    assert transaction.messages == []
+    assert transaction.summary["segment"] == 2 and transaction.summary["final"]
+    assert transaction.summary["close_code"] == wsflow.close_code
+    assert transaction.get_dict()["request"]["client"]["name"] == "alice"